@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+from functools import partial
+from collections import OrderedDict
+from time import monotonic
+from albatross.data_types import CaselessDict
+from albatross.status_codes import HTTP_200, HTTP_304
+
+
+class CacheEntry:
+    __slots__ = ('status_code', 'headers', 'body', 'etag', 'expires',
+                 'variants')
+
+    def __init__(self, status_code, headers, body, etag, expires):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.expires = expires
+        # compressed copies of body, filled in by Compression
+        self.variants = {}
+
+
+def etag_matches(req, etag):
+    if_none_match = req.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(','))
+    return any(tag == etag or tag == 'W/' + etag for tag in tags)
+
+
+class ResponseCache:
+    """Middleware that stores whole responses and replays them.
+
+    Handlers opt in per route with attributes:
+
+        class Handler:
+            cache_ttl = 60                 # seconds a response stays fresh
+            cache_query = ('page',)        # query values that vary the key
+            cache_headers = ('Accept',)    # header values that vary the key
+
+    A response is stored under its method, path, route args and the
+    selected query and header values. Only 200 responses without cookies
+    are stored. Concurrent misses for the same key wait for the first one
+    instead of all running the handler, and run it together, uncached, if
+    its response isn't stored. Cached responses carry an ETag and are
+    answered with 304 Not Modified when the client already has them.
+
+    Attributes:
+        max_bytes (int): total body size kept; the least recently used
+            entries are evicted past it
+        methods (tuple): request methods that are cached
+        coalesce_timeout (float): how long a miss waits for a concurrent
+            miss on the same key before running the handler itself
+    """
+
+    def __init__(self, max_bytes=2 ** 26, methods=('GET', 'HEAD'),
+                 coalesce_timeout=30):
+        self.max_bytes = max_bytes
+        self.methods = methods
+        self.coalesce_timeout = coalesce_timeout
+        self.size = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    def key(self, req, handler):
+        query = req.query
+        query_values = tuple(
+            tuple(query.get_all(name, ())) if query else ()
+            for name in getattr(handler, 'cache_query', ())
+        )
+        header_values = tuple(
+            req.headers.get(name)
+            for name in getattr(handler, 'cache_headers', ())
+        )
+        args = tuple(sorted(req.args.items())) if req.args else ()
+        return req.method, req.path, args, query_values, header_values
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < monotonic():
+            self._evict(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key, entry):
+        if key in self._entries:
+            self._evict(key)
+        if len(entry.body) > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self.size += len(entry.body)
+        while self.size > self.max_bytes:
+            self._evict(next(iter(self._entries)))
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def _evict(self, key):
+        self.size -= len(self._entries.pop(key).body)
+
+    async def process_request(self, req, res, handler):
+        req._cache_miss = None
+        if (req.method not in self.methods or
+                getattr(handler, 'cache_ttl', None) is None):
+            return False
+
+        key = self.key(req, handler)
+        entry = self.get(key)
+        if entry is None:
+            pending = self._pending.get(key)
+            if pending is not None:
+                waited, entry = await self._wait_for(key, pending)
+                if waited and entry is None:
+                    # the first request's response wasn't stored, so the
+                    # waiting requests all run the handler, uncached,
+                    # rather than each take a turn at storing it
+                    return False
+        if entry is not None:
+            self._replay(req, res, entry)
+            return True
+
+        # this request runs the handler, and others with the same key wait
+        future = asyncio.get_event_loop().create_future()
+        self._pending[key] = (future, monotonic())
+        # if the request fails or is cancelled before process_response
+        # runs, the waiting requests are woken all the same
+        if req._finalizers is None:
+            req._finalizers = []
+        req._finalizers.append(partial(self._release, key, future))
+        req._cache_miss = key, future
+        return False
+
+    async def process_response(self, req, res, handler):
+        miss = getattr(req, '_cache_miss', None)
+        if miss is None:
+            return
+        req._cache_miss = None
+        key, future = miss
+
+        entry = None
+        if (res.status_code == HTTP_200 and not res._cookies and
+                not res.started and res._file is None):
+            body = b''.join(res._chunks)
+            etag = res.headers.get('ETag')
+            if etag is None:
+                etag = '"%s"' % hashlib.blake2b(
+                    body, digest_size=16).hexdigest()
+                res.headers['ETag'] = etag
+            headers = [(k, v) for k, v in res.headers.items()
+                       if k not in ('connection', 'content-length')]
+            entry = CacheEntry(res.status_code, headers, body, etag,
+                               monotonic() + handler.cache_ttl)
+            self.set(key, entry)
+            res._variants = entry.variants
+            if etag_matches(req, etag):
+                self._not_modified(res, etag)
+
+        self._release(key, future, entry)
+
+    def _release(self, key, future, entry=None):
+        """Wakes the requests waiting on a miss, once it is answered or
+        has failed, with the entry it stored, if any."""
+        pending = self._pending.get(key)
+        if pending is not None and pending[0] is future:
+            del self._pending[key]
+        if not future.done():
+            future.set_result(entry)
+
+    async def _wait_for(self, key, pending):
+        """Waits for the request running the handler for `key`.
+
+        :return: whether there was a request to wait for, and the entry
+            it stored, or None if it stored none or took too long
+        """
+        future, started = pending
+        remaining = started + self.coalesce_timeout - monotonic()
+        if remaining <= 0:
+            # the request running the handler never finished, so this one
+            # takes its place
+            if self._pending.get(key) is pending:
+                del self._pending[key]
+            return False, None
+        try:
+            return True, await asyncio.wait_for(
+                asyncio.shield(future), remaining)
+        except asyncio.TimeoutError:
+            return True, None
+
+    def _replay(self, req, res, entry):
+        res.status_code = entry.status_code
+        res.headers = CaselessDict(entry.headers)
+        res._chunks = [entry.body]
+        res._variants = entry.variants
+        if etag_matches(req, entry.etag):
+            self._not_modified(res, entry.etag)
+
+    def _not_modified(self, res, etag):
+        headers = [('ETag', etag)]
+        for name in ('Cache-Control', 'Expires', 'Vary'):
+            if name in res.headers:
+                headers.append((name, res.headers[name]))
+        res.status_code = HTTP_304
+        res.headers = CaselessDict(headers)
+        res.clear()
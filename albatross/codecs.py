@@ -0,0 +1,61 @@
+from albatross.compat import json, orjson
+
+JSON_TYPE = 'application/json'
+
+
+def media_type(content_type):
+    """The type of a Content-Type header, without its parameters."""
+    return content_type.partition(';')[0].strip().lower()
+
+
+class JSONCodec:
+    """Encodes with the json module, or ujson when it is installed.
+
+    Both work on str, so bodies are decoded before they are parsed and
+    encoded after they are serialized.
+    """
+
+    def dumps(self, data):
+        return json.dumps(data).encode()
+
+    def loads(self, data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    """Encodes with orjson, which reads and writes bytes directly.
+
+    Its output has no spaces after separators, and by default it also
+    serializes dataclasses, datetimes and UUIDs.
+
+    Attributes:
+        option (int): orjson OPT_ flags passed to every `dumps`, which
+            let keys that aren't strings through by default, as json does
+    """
+
+    def __init__(self, option=None):
+        if orjson is None:
+            raise RuntimeError(
+                'OrjsonCodec needs the orjson package: '
+                'pip3 install albatross3[orjson]')
+        if option is None:
+            option = orjson.OPT_NON_STR_KEYS
+        self.option = option
+
+    def dumps(self, data):
+        return orjson.dumps(data, option=self.option)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+def default_codecs():
+    """Media type -> codec for a new server: orjson for JSON when it is
+    installed, the json module otherwise."""
+    return {JSON_TYPE: OrjsonCodec() if orjson is not None else JSONCodec()}
+
+
+# used by requests and responses made outside a server
+CODECS = default_codecs()
@@ -2,3 +2,23 @@ try:
     import ujson as json
 except ImportError:
     import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.errors
+    import h2.events
+    import h2.exceptions
+    import hyperframe.frame
+except ImportError:
+    h2 = hyperframe = None
@@ -0,0 +1,168 @@
+import zlib
+from albatross.compat import brotli
+from albatross.status_codes import HTTP_204, HTTP_206, HTTP_304
+
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'application/x-ndjson',
+    'image/svg+xml',
+)
+DEFAULT_LEVELS = {'br': 4, 'gzip': 6}
+
+
+class GzipEncoder:
+    """Compresses a streamed body; each chunk is flushed so it reaches the
+    client straight away."""
+
+    def __init__(self, level):
+        # wbits 31 writes a gzip header and trailer around the deflate data
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        compressor = self._compressor
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        compressor = self._compressor
+        return compressor.process(data) + compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+ENCODERS = {'br': BrotliEncoder, 'gzip': GzipEncoder}
+
+
+def compress(encoding, data, level):
+    """Compresses a whole body in one go."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class Compression:
+    """Compresses response bodies for clients that accept it.
+
+    Pass one to `Server(compression=...)`. Buffered responses are
+    compressed when their body is at least `min_size` bytes; streamed
+    responses are compressed chunk by chunk as they are sent. Responses
+    that carry `_variants`, such as replies from `ResponseCache`, keep
+    their compressed bodies there so each is only compressed once.
+
+    Attributes:
+        min_size (int): smaller buffered bodies are sent as they are
+        content_types (tuple): types, or prefixes ending in '/', to compress
+        levels (dict): compression level for each encoding
+        encodings (tuple): encodings offered, most preferred first; 'br'
+            is only used when the brotli package is installed
+    """
+
+    def __init__(self, min_size=1024, content_types=COMPRESSIBLE_TYPES,
+                 levels=None, encodings=('br', 'gzip')):
+        self.min_size = min_size
+        self.content_types = content_types
+        self.levels = dict(DEFAULT_LEVELS, **(levels or {}))
+        self.encodings = tuple(
+            e for e in encodings if e != 'br' or brotli is not None)
+
+    def choose_encoding(self, req):
+        """Picks the preferred encoding the client accepts, if any."""
+        header = req.headers.get('Accept-Encoding')
+        if not header:
+            return None
+        accepted = {}
+        for item in header.split(','):
+            name, _, params = item.partition(';')
+            quality = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name.strip().lower()] = quality
+        for encoding in self.encodings:
+            quality = accepted.get(encoding, accepted.get('*', 0))
+            if quality > 0:
+                return encoding
+        return None
+
+    def compressible(self, res):
+        # ranges index into the uncompressed body, and files are sent
+        # straight from disk
+        if (res.status_code in (HTTP_204, HTTP_206, HTTP_304) or
+                res._file is not None or 'Content-Encoding' in res.headers):
+            return False
+        content_type = res.headers.get('Content-Type', '')
+        content_type = content_type.partition(';')[0].strip().lower()
+        if content_type == 'text/event-stream':
+            # events are encoded once for all subscribers, and each would
+            # otherwise need its own compressor held open
+            return False
+        return any(
+            content_type.startswith(t) if t.endswith('/') else
+            content_type == t
+            for t in self.content_types
+        )
+
+    def compress_response(self, req, res):
+        """Compresses a buffered response in place."""
+        if not self.compressible(res):
+            return
+        self._vary(res)
+        length = sum(len(x) for x in res._chunks)
+        if length < self.min_size:
+            return
+        encoding = self.choose_encoding(req)
+        if encoding is None:
+            return
+
+        variants = res._variants
+        body = variants.get(encoding) if variants is not None else None
+        if body is None:
+            body = compress(encoding, b''.join(res._chunks),
+                            self.levels[encoding])
+            if variants is not None:
+                variants[encoding] = body
+        res._chunks = [body]
+        self._encoded(res, encoding)
+
+    def start_stream(self, req, res):
+        """Sets up a streamed response to be compressed as it is sent."""
+        if not self.compressible(res):
+            return
+        self._vary(res)
+        encoding = self.choose_encoding(req)
+        if encoding is None:
+            return
+        res._encoder = ENCODERS[encoding](self.levels[encoding])
+        self._encoded(res, encoding)
+
+    def _vary(self, res):
+        vary = res.headers.get('Vary')
+        if not vary:
+            res.headers['Vary'] = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            res.headers['Vary'] = vary + ', Accept-Encoding'
+
+    def _encoded(self, res, encoding):
+        headers = res.headers
+        headers['Content-Encoding'] = encoding
+        if 'Content-Length' in headers:
+            del headers['Content-Length']
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            # the compressed bytes differ, so the tag can only be weak
+            headers['ETag'] = 'W/' + etag
@@ -1,5 +1,6 @@
 from albatross.http_error import HTTPError
 from albatross.status_codes import HTTP_400
+import sys
 
 
 def caseless_pairs(seq):
@@ -8,12 +9,22 @@ def caseless_pairs(seq):
 
 
 class Immutable:
+    __slots__ = ()
+
     def __setitem__(self, k, v):
         raise TypeError('Cannot set item on %s' % self.__class__)
 
     def update(self, E=None, **F):
         raise TypeError('Cannot update on %s' % self.__class__)
 
+    def __delitem__(self, k):
+        raise TypeError('Cannot delete item on %s' % self.__class__)
+
+    def _immutable(self, *args):
+        raise TypeError('Cannot change %s' % self.__class__)
+
+    pop = popitem = clear = setdefault = __ior__ = _immutable
+
 
 class ImmutableMultiDict(Immutable, dict):
     def __getitem__(self, k):
@@ -52,10 +63,11 @@ class CaselessDict(dict):
     def __setitem__(self, k, v):
         super(CaselessDict, self).__setitem__(k.lower(), v)
 
+    def __delitem__(self, k):
+        super(CaselessDict, self).__delitem__(k.lower())
+
     def get(self, k, d=None):
-        if k in self:
-            return super(CaselessDict, self).__getitem__(k.lower())
-        return d
+        return super(CaselessDict, self).get(k.lower(), d)
 
     def update(self, other=None, **kwargs):
         updates = {k.lower(): v for k, v in kwargs.items()}
@@ -72,12 +84,107 @@ class ImmutableCaselessDict(Immutable, CaselessDict):
 
 class ImmutableCaselessMultiDict(ImmutableMultiDict, CaselessDict):
     def __init__(self, it=None, **kwargs):
-        it = caseless_pairs(it) if it else []
-        if kwargs:
-            kwargs = {k.lower(): [v] for k, v in kwargs.items()}
-        for k, v in it:
-            if k in kwargs:
-                kwargs[k].append(v)
+        d = {k.lower(): [v] for k, v in kwargs.items()}
+        for k, v in it or ():
+            k = k.lower()
+            values = d.get(k)
+            if values is None:
+                d[k] = [v]
             else:
-                kwargs[k] = [v]
-        super(ImmutableCaselessMultiDict, self).__init__(**kwargs)
+                values.append(v)
+        dict.__init__(self, d)
+
+    def __getitem__(self, k):
+        values = dict.get(self, k.lower())
+        if values is None:
+            raise HTTPError(HTTP_400, 'Must provide parameter \'%s\'.' % k)
+        return values[0]
+
+    def get(self, k, d=None):
+        values = dict.get(self, k.lower())
+        return d if values is None else values[0]
+
+    def get_all(self, k, d=None):
+        return dict.get(self, k.lower(), d)
+
+
+def _header_names(names):
+    table = {}
+    for name in names:
+        lower = sys.intern(name.lower())
+        table[name.encode()] = table[lower.encode()] = lower
+    return table
+
+
+# header names as clients usually send them, each mapped to one shared
+# lowercase str, so they are named without decoding or lowercasing
+COMMON_HEADERS = _header_names((
+    'Accept', 'Accept-Charset', 'Accept-Encoding', 'Accept-Language',
+    'Authorization', 'Cache-Control', 'Connection', 'Content-Encoding',
+    'Content-Length', 'Content-Type', 'Cookie', 'DNT', 'Expect', 'Forwarded',
+    'Host', 'If-Match', 'If-Modified-Since', 'If-None-Match', 'If-Range',
+    'If-Unmodified-Since', 'Keep-Alive', 'Origin', 'Pragma', 'Range',
+    'Referer', 'Sec-Fetch-Dest', 'Sec-Fetch-Mode', 'Sec-Fetch-Site',
+    'Sec-WebSocket-Key', 'Sec-WebSocket-Version', 'TE', 'Transfer-Encoding',
+    'Upgrade', 'Upgrade-Insecure-Requests', 'User-Agent', 'Via',
+    'X-Forwarded-For', 'X-Forwarded-Host', 'X-Forwarded-Proto', 'X-Real-IP',
+    'X-Request-ID', 'X-Requested-With',
+))
+
+
+class Headers(Immutable, dict):
+    """Request headers, built in one pass from the raw (name, value) byte
+    pairs the parser reports.
+
+    Names are lowercased once, the common ones by looking them up in
+    `COMMON_HEADERS`. As with ImmutableCaselessMultiDict, names are
+    caseless, indexing gives the first value and `get_all` every value of
+    a repeated header. Bytes that aren't UTF-8 decode to surrogates, which
+    `value.encode('utf-8', 'surrogateescape')` turns back into the bytes
+    the client sent.
+    """
+    __slots__ = ()
+
+    def __init__(self, raw=()):
+        names = COMMON_HEADERS
+        d = {}
+        for name, value in raw:
+            key = names.get(name)
+            if key is None:
+                key = name.decode('latin-1').lower()
+            value = value.decode('utf-8', 'surrogateescape')
+            values = d.get(key)
+            if values is None:
+                d[key] = [value]
+            else:
+                values.append(value)
+        dict.__init__(self, d)
+
+    def _values(self, k):
+        values = dict.get(self, k)
+        if values is None:
+            # most lookups already use lowercase names
+            values = dict.get(self, k.lower())
+        return values
+
+    def __contains__(self, k):
+        return dict.__contains__(self, k) or dict.__contains__(self, k.lower())
+
+    def __getitem__(self, k):
+        values = self._values(k)
+        if values is None:
+            raise HTTPError(HTTP_400, 'Must provide parameter \'%s\'.' % k)
+        return values[0]
+
+    def get(self, k, d=None):
+        values = self._values(k)
+        return d if values is None else values[0]
+
+    def get_all(self, k, d=None):
+        values = self._values(k)
+        return d if values is None else values
+
+
+# shared by every request that has none, instead of a new empty container
+# per request; it can't be changed, so sharing it is safe
+EMPTY_MULTIDICT = ImmutableMultiDict()
@@ -0,0 +1,69 @@
+import asyncio
+from albatross.executor import offloaded
+
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+
+class Endpoint:
+    """A handler with its `on_<method>` coroutines looked up once, when
+    its route is added, so a request is dispatched with one dict lookup.
+
+    HEAD falls back to `on_get`; the server drops the body of every HEAD
+    response.
+
+    Synchronous methods marked with `offload`, or all of them if the
+    handler has a true `offload` attribute, are wrapped to run in the
+    executor's thread pool.
+
+    Attributes:
+        handler: the handler object the route was added with
+        methods (dict): request method -> bound coroutine
+        allow (str): the Allow header for the handler's methods
+        allow_options (str): `allow` with OPTIONS added, for servers
+            that answer OPTIONS themselves
+        stream_body (bool): the handler reads request bodies as they arrive
+        offload_form (bool): the handler reads `req.form`, so large bodies
+            are parsed into it in a thread before the handler runs
+        websocket: the handler's `on_websocket` coroutine, if it has one
+        codecs (dict): the handler's own media type -> codec, used for its
+            requests and responses instead of the server's
+        middleware (tuple): the handler's own middleware, run after the
+            server's for its requests only
+        chain (MiddlewareChain): the server's middleware and the handler's,
+            compiled on the first request that needs them
+    """
+    __slots__ = ('handler', 'methods', 'allow', 'allow_options',
+                 'stream_body', 'offload_form', 'websocket', 'codecs',
+                 'middleware', 'chain')
+
+    def __init__(self, handler, executor=None):
+        self.handler = handler
+        offload_all = bool(getattr(handler, 'offload', False))
+        methods = {}
+        for method in METHODS:
+            coroutine = getattr(handler, 'on_' + method.lower(), None)
+            if coroutine is None:
+                continue
+            if ((offload_all or getattr(coroutine, 'offload', False)) and
+                    not asyncio.iscoroutinefunction(coroutine)):
+                if executor is None:
+                    raise ValueError(
+                        '%r is offloaded, but there is no executor' % (
+                            coroutine,))
+                coroutine = offloaded(executor, coroutine)
+            methods[method] = coroutine
+        if 'GET' in methods and 'HEAD' not in methods:
+            methods['HEAD'] = methods['GET']
+        self.methods = methods
+        self.allow = ', '.join(m for m in METHODS if m in methods)
+        if 'OPTIONS' in methods:
+            self.allow_options = self.allow
+        else:
+            self.allow_options = ', '.join(
+                m for m in METHODS if m in methods or m == 'OPTIONS')
+        self.stream_body = bool(getattr(handler, 'stream_body', False))
+        self.offload_form = bool(getattr(handler, 'offload_form', False))
+        self.websocket = getattr(handler, 'on_websocket', None)
+        self.codecs = getattr(handler, 'codecs', None)
+        self.middleware = tuple(getattr(handler, 'middleware', ()))
+        self.chain = None
@@ -0,0 +1,108 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from albatross.http_error import HTTPError
+from albatross.limits import Limiter
+from albatross.status_codes import HTTP_503
+
+# buffered JSON and multipart bodies larger than this are parsed in a thread
+OFFLOAD_BODY_SIZE = 2 ** 18
+
+
+def offload(method):
+    """Marks a synchronous handler method to be run in the server's thread
+    pool, so it can block without stalling every other connection:
+
+        class ReportHandler:
+            @offload
+            def on_get(self, req, res):
+                res.write_json(legacy_db.query(req.args['id']))
+
+    A handler with a true `offload` attribute has all its synchronous
+    methods run this way.
+    """
+    method.offload = True
+    return method
+
+
+class Executor:
+    """Runs blocking and CPU-bound work away from the event loop.
+
+    Blocking calls, such as a database driver without asyncio support, go
+    to a pool of `threads`. CPU-bound functions go to a pool of
+    `processes`, where they don't hold the event loop's GIL; they and
+    their arguments must be picklable. The pools are started on first use.
+
+    Each pool runs as many calls at once as it has workers, and up to
+    `queue_size` more wait their turn on the event loop. Calls beyond that
+    raise HTTPError 503, rather than queueing without bound.
+
+    Attributes:
+        threads (int): size of the thread pool
+        processes (int): size of the process pool, 0 for none
+        queue_size (int): calls each pool may have waiting
+        limiters (dict): 'thread' and 'process' -> the Limiter that bounds
+            each pool
+        rejected (dict): 'thread' and 'process' -> calls turned away
+    """
+
+    def __init__(self, threads=8, processes=0, queue_size=64):
+        self.threads = threads
+        self.processes = processes
+        self.queue_size = queue_size
+        self.limiters = {'thread': Limiter(threads, queue_size)}
+        if processes:
+            self.limiters['process'] = Limiter(processes, queue_size)
+        self.rejected = dict.fromkeys(self.limiters, 0)
+        self._pools = {}
+
+    async def run_in_thread(self, func, *args):
+        """Calls func(*args) in the thread pool and returns its result."""
+        return await self._run('thread', func, args)
+
+    async def run_in_process(self, func, *args):
+        """Calls func(*args) in the process pool and returns its result."""
+        if not self.processes:
+            raise RuntimeError('The executor has no process pool')
+        return await self._run('process', func, args)
+
+    async def _run(self, kind, func, args):
+        limiter = self.limiters[kind]
+        if not await limiter.acquire():
+            self.rejected[kind] += 1
+            raise HTTPError(HTTP_503)
+        try:
+            return await asyncio.get_event_loop().run_in_executor(
+                self._pool(kind), func, *args)
+        finally:
+            limiter.release()
+
+    def _pool(self, kind):
+        pool = self._pools.get(kind)
+        if pool is None:
+            if kind == 'thread':
+                pool = ThreadPoolExecutor(
+                    self.threads, thread_name_prefix='albatross')
+            else:
+                pool = ProcessPoolExecutor(self.processes)
+            self._pools[kind] = pool
+        return pool
+
+    def shutdown(self):
+        """Stops the pools, waiting for the calls they are running to
+        return, so their threads and processes are gone before the
+        interpreter exits.
+
+        Calls waiting their turn do so on the event loop rather than in
+        a pool, so there are none queued in the pools to cancel.
+        """
+        pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.shutdown(wait=True)
+
+
+def offloaded(executor, method):
+    """Wraps a synchronous handler method in a coroutine that runs it in
+    the executor's thread pool."""
+    async def run(req, res):
+        await executor.run_in_thread(method, req, res)
+    return run
@@ -0,0 +1,494 @@
+import asyncio
+from albatross.compat import h2, hyperframe
+from albatross.http_error import HTTPError
+from albatross.request import Request, RequestBody
+from albatross.response import Response, cookie_value
+from albatross.status_codes import HTTP_413, HTTP_503
+
+READ_LIMIT = 2 ** 16
+# headers that only mean something on an HTTP/1.1 connection
+CONNECTION_HEADERS = frozenset((
+    'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding',
+    'upgrade',
+))
+# headers of an upgrade request that are not passed on to its handler
+UPGRADE_HEADERS = frozenset((b'connection', b'upgrade', b'http2-settings'))
+
+
+def is_h2c_upgrade(req):
+    """Whether a request asks to switch its connection to HTTP/2.
+
+    Only requests without a body are upgraded; others are answered over
+    HTTP/1.1, as the client must allow.
+    """
+    headers = req.headers
+    if (headers.get('Upgrade', '').lower() != 'h2c' or
+            'HTTP2-Settings' not in headers or
+            req._content_length not in (None, b'0') or
+            'Transfer-Encoding' in headers):
+        return False
+    connection = headers.get('Connection', '').lower()
+    return 'upgrade' in (t.strip() for t in connection.split(','))
+
+
+class Http2Stream:
+    """A request and its response on an HTTP/2 connection.
+
+    The stream is the response's writer: the body is buffered by `write`
+    and sent by `drain` as fast as the client's flow-control windows allow.
+
+    Attributes:
+        stream_id (int):
+        req (Request):
+        res (Response): set once the request is being handled
+        task (asyncio.Task): handles the request
+    """
+
+    def __init__(self, connection, stream_id, req):
+        self.connection = connection
+        self.stream_id = stream_id
+        self.req = req
+        self.res = None
+        self.task = None
+        self.closed = False
+        self._buffer = bytearray()
+        self._window = None
+        self._body_size = 0
+        # received body data not yet acknowledged, while the handler is
+        # behind on a streamed body
+        self._unacknowledged = 0
+        self._paused = False
+
+    def write(self, data):
+        self._buffer.extend(data)
+
+    def writelines(self, data):
+        for chunk in data:
+            self._buffer.extend(chunk)
+
+    def close(self):
+        self.connection._reset(self)
+
+    async def drain(self):
+        await self.connection._send_data(self)
+
+    def _pause(self):
+        self._paused = True
+
+    def _resume(self):
+        self._paused = False
+        if self._unacknowledged:
+            self.connection._acknowledge(self.stream_id, self._unacknowledged)
+            self.connection._flush()
+            self._unacknowledged = 0
+
+    def _wake(self, exc=None):
+        waiter, self._window = self._window, None
+        if waiter is None or waiter.done():
+            return
+        if exc is None:
+            waiter.set_result(None)
+        else:
+            waiter.set_exception(exc)
+
+
+class Http2Connection:
+    """Serves the streams of one HTTP/2 connection.
+
+    Frames are read from `stream`, the bytes received after the connection
+    switched to HTTP/2, and each request is handled in a task of its own as
+    soon as it is complete, or its headers have arrived if the handler
+    streams the body. The HPACK tables and flow-control windows are those
+    of the connection's h2 state machine.
+
+    Attributes:
+        streams (dict): the open `Http2Stream`s by id
+    """
+
+    def __init__(self, server, stream, writer):
+        config = h2.config.H2Configuration(
+            client_side=False, header_encoding=None)
+        self._conn = h2.connection.H2Connection(config)
+        self._server = server
+        self._stream = stream
+        self._writer = writer
+        self._closing = False
+        self.streams = {}
+
+    async def run(self, req):
+        """Serves the connection until either side closes it.
+
+        :param req: the request that switched the connection to HTTP/2,
+            which is answered on stream 1 if it was an upgrade
+        """
+        conn = self._conn
+        if req.method is None:
+            # the client knew to speak HTTP/2 from the start
+            conn.initiate_connection()
+        else:
+            conn.initiate_upgrade_connection(
+                req.headers['HTTP2-Settings'].encode())
+        self._flush()
+        if req.method is not None:
+            self._handle(self._route(1, self._upgraded_request(req)))
+        try:
+            await self._read_frames()
+        except ConnectionError:
+            pass
+        finally:
+            for stream in list(self.streams.values()):
+                if stream.task is not None:
+                    stream.task.cancel()
+            self._writer.close()
+
+    def _upgraded_request(self, req):
+        """Copies the request that upgraded the connection, to answer it
+        on stream 1; its body has become the connection."""
+        copy = Request(req.method, req.path, req.query_string,
+                       spool_size=self._server.body_spool_size,
+                       offload_size=self._server.offload_body_size,
+                       codecs=self._server.codecs)
+        copy.http_version = '2'
+        for name, value in req._header_list:
+            if name.lower() not in UPGRADE_HEADERS:
+                copy.on_header(name, value)
+        copy.on_headers_complete()
+        copy.on_message_complete()
+        return copy
+
+    async def _read_frames(self):
+        conn = self._conn
+        timeout = self._server.keep_alive_timeout
+        while True:
+            try:
+                data = await asyncio.wait_for(
+                    self._stream.read(READ_LIMIT),
+                    None if self.streams else timeout)
+            except asyncio.TimeoutError:
+                conn.close_connection()
+                self._flush()
+                return
+            if not data:
+                return
+            try:
+                events = conn.receive_data(data)
+            except h2.exceptions.ProtocolError:
+                self._flush()
+                return
+            for event in events:
+                if isinstance(event, h2.events.ConnectionTerminated):
+                    self._flush()
+                    return
+                self._receive(event)
+            self._flush()
+
+    def _receive(self, event):
+        events = h2.events
+        stream = self.streams.get(getattr(event, 'stream_id', 0))
+        if isinstance(event, events.RequestReceived):
+            self._receive_headers(event)
+        elif isinstance(event, events.DataReceived):
+            length = event.flow_controlled_length
+            if stream is None:
+                self._acknowledge(event.stream_id, length)
+            else:
+                self._receive_data(stream, event.data, length)
+        elif isinstance(event, events.StreamEnded):
+            if stream is not None:
+                self._end_request(stream)
+        elif isinstance(event, events.StreamReset):
+            if stream is not None:
+                self._closed(stream)
+                if stream.task is not None:
+                    stream.task.cancel()
+        elif isinstance(event, events.WindowUpdated):
+            if event.stream_id:
+                if stream is not None:
+                    stream._wake()
+            else:
+                for stream in self.streams.values():
+                    stream._wake()
+        elif isinstance(event, events.RemoteSettingsChanged):
+            # the initial window size may have grown
+            for stream in self.streams.values():
+                stream._wake()
+
+    def _receive_headers(self, event):
+        if self._closing:
+            self._conn.reset_stream(
+                event.stream_id, h2.errors.ErrorCodes.REFUSED_STREAM)
+            return
+        server = self._server
+        req = Request(spool_size=server.body_spool_size,
+                      offload_size=server.offload_body_size,
+                      codecs=server.codecs)
+        req.http_version = '2'
+        try:
+            for name, value in event.headers:
+                if name == b':method':
+                    req.method = value.decode()
+                elif name == b':path':
+                    req.on_url(value)
+                elif name == b':authority':
+                    req.on_header(b'host', value)
+                elif name == b'cookie' and req._cookie is not None:
+                    # HTTP/2 clients may send each cookie separately
+                    req._cookie += b'; ' + value
+                elif name[:1] != b':':
+                    req.on_header(name, value)
+            req.on_headers_complete()
+        except Exception:
+            self._conn.reset_stream(
+                event.stream_id, h2.errors.ErrorCodes.PROTOCOL_ERROR)
+            return
+        stream = self._route(event.stream_id, req)
+        length = req._content_length
+        max_body_size = server.max_body_size
+        if (max_body_size is not None and length is not None and
+                int(length) > max_body_size):
+            self._reject(stream, HTTPError(HTTP_413))
+        if req.body is not None:
+            self._handle(stream)
+
+    def _route(self, stream_id, req):
+        stream = self.streams[stream_id] = Http2Stream(self, stream_id, req)
+        if self._server._route(req):
+            req.body = RequestBody(pause=stream._pause, resume=stream._resume)
+        return stream
+
+    def _receive_data(self, stream, data, length):
+        req = stream.req
+        stream._body_size += len(data)
+        max_body_size = self._server.max_body_size
+        if req.error is None and max_body_size is not None and (
+                stream._body_size > max_body_size):
+            self._reject(stream, HTTPError(HTTP_413))
+        if req.error is not None:
+            pass
+        elif req.body is not None:
+            req.body.feed(data)
+            if stream._paused:
+                stream._unacknowledged += length
+                return
+        else:
+            req.on_body(data)
+        self._acknowledge(stream.stream_id, length)
+
+    def _end_request(self, stream):
+        req = stream.req
+        if req.body is not None:
+            req.body.feed_eof()
+            return
+        if stream.task is not None:
+            return
+        try:
+            req.on_message_complete()
+        except Exception as e:
+            req.error = e
+        self._handle(stream)
+
+    def _reject(self, stream, error):
+        req = stream.req
+        if req.body is not None:
+            req.body.set_exception(error)
+        elif stream.task is None:
+            req.error = error
+            self._handle(stream)
+
+    def _acknowledge(self, stream_id, length):
+        self._conn.acknowledge_received_data(length, stream_id)
+
+    def _handle(self, stream):
+        stream.task = asyncio.ensure_future(self._respond(stream))
+
+    async def _respond(self, stream):
+        """Answers a stream's request, as `Server._send_response` does
+        for HTTP/1.1."""
+        server = self._server
+        req = stream.req
+        res = stream.res = Response()
+        res._on_start = lambda: self._start_response(stream)
+        res._writer = stream
+        res._drain = stream.drain
+        res._head = req.method == 'HEAD'
+        in_flight = server._in_flight
+        admitted = in_flight is None or await in_flight.acquire()
+        metrics = server.metrics
+        trace = None
+        try:
+            if admitted:
+                if metrics is not None:
+                    trace = metrics.start(req)
+                await server._respond(req, res, trace)
+            else:
+                res.status_code = HTTP_503
+                res.headers['Retry-After'] = str(server.retry_after)
+                res.write(HTTP_503)
+            if res.started:
+                await res.finish()
+            elif res._file is not None:
+                await self._send_file(stream)
+            else:
+                if server.compression is not None:
+                    server.compression.compress_response(req, res)
+                await self._send_buffered(stream)
+            self._end_stream(stream)
+            await server._drain(self._writer)
+        except ConnectionError:
+            pass
+        finally:
+            if admitted and in_flight is not None:
+                in_flight.release()
+            if trace is not None:
+                trace.bytes_out = res._sent
+                metrics.finish(trace, res)
+            if not stream.closed:
+                # the client is done with a stream once it has its answer
+                self._closed(stream)
+
+    def _start_response(self, stream):
+        """Sends the headers of a streamed response."""
+        res = stream.res
+        compression = self._server.compression
+        if compression is not None:
+            compression.start_stream(stream.req, res)
+        self._send_headers(stream)
+        self._flush()
+
+    def _send_headers(self, stream):
+        res = stream.res
+        headers = [(b':status', res.status_code[:3].encode())]
+        for key, value in res.headers.items():
+            if key not in CONNECTION_HEADERS:
+                headers.append((key.encode(), str(value).encode()))
+        if res._cookies:
+            for key, value in res._cookies.items():
+                cookie = cookie_value(key, value)
+                if cookie is not None:
+                    headers.append((b'set-cookie', cookie))
+        try:
+            self._conn.send_headers(stream.stream_id, headers)
+        except h2.exceptions.StreamClosedError:
+            raise ConnectionResetError('Stream reset')
+
+    async def _send_buffered(self, stream):
+        res = stream.res
+        body = b''.join(res._chunks)
+        res._chunks = []
+        if 'Content-Length' not in res.headers:
+            res.headers['Content-Length'] = str(len(body))
+        self._send_headers(stream)
+        if not res._head:
+            stream.write(body)
+            # sent along with the end of the stream, in one write
+            await self._send_data(stream, flush=False)
+
+    async def _send_file(self, stream):
+        res = stream.res
+        file, offset, count = res._file
+        res._file = None
+        try:
+            res.headers['Content-Length'] = str(count)
+            self._send_headers(stream)
+            if res._head:
+                return
+            file.seek(offset)
+            while count > 0:
+                chunk = file.read(min(count, READ_LIMIT))
+                if not chunk:
+                    break
+                count -= len(chunk)
+                stream.write(chunk)
+                await stream.drain()
+        finally:
+            file.close()
+
+    async def _send_data(self, stream, flush=True):
+        """Sends a stream's buffered body, waiting whenever the client's
+        flow-control windows are used up.
+
+        :param flush: write the frames to the connection once all are
+            ready, rather than leaving that to the next `_flush`
+        """
+        conn = self._conn
+        data = bytes(stream._buffer)
+        stream._buffer.clear()
+        sent = 0
+        while sent < len(data):
+            if stream.closed:
+                raise ConnectionResetError('Stream reset')
+            try:
+                window = conn.local_flow_control_window(stream.stream_id)
+                size = min(window, len(data) - sent,
+                           conn.max_outbound_frame_size)
+                if size <= 0:
+                    self._flush()
+                    stream._window = asyncio.get_event_loop().create_future()
+                    await stream._window
+                    continue
+                conn.send_data(stream.stream_id, data[sent:sent + size])
+            except h2.exceptions.StreamClosedError:
+                raise ConnectionResetError('Stream reset')
+            sent += size
+            stream.res._sent += size
+        if flush:
+            self._flush()
+            await self._server._drain(self._writer)
+
+    def _end_stream(self, stream):
+        if stream.closed:
+            return
+        trailers = stream.res._trailers
+        try:
+            if trailers:
+                self._conn.send_headers(stream.stream_id, [
+                    (key.lower().encode(), str(value).encode())
+                    for key, value in trailers.items()
+                ], end_stream=True)
+            else:
+                self._conn.end_stream(stream.stream_id)
+        except h2.exceptions.StreamClosedError:
+            pass
+        self._flush()
+
+    def _reset(self, stream):
+        """Cuts a response short, as closing the connection would over
+        HTTP/1.1."""
+        if stream.closed:
+            return
+        try:
+            self._conn.reset_stream(
+                stream.stream_id, h2.errors.ErrorCodes.INTERNAL_ERROR)
+        except h2.exceptions.StreamClosedError:
+            pass
+        self._flush()
+        self._closed(stream)
+
+    def _closed(self, stream):
+        stream.closed = True
+        stream._wake(ConnectionResetError('Stream reset'))
+        if self.streams.get(stream.stream_id) is stream:
+            del self.streams[stream.stream_id]
+        req = stream.req
+        if req.body is not None and not req.body.complete:
+            req.body.set_exception(ConnectionResetError('Stream reset'))
+        if self._closing and not self.streams:
+            self._writer.close()
+
+    def _going_away(self):
+        """Tells the client to open no more streams, and closes the
+        connection once those already open are answered."""
+        self._closing = True
+        # h2 can only send GOAWAY by closing the connection outright, which
+        # would stop the open streams being answered
+        self._flush()
+        frame = hyperframe.frame.GoAwayFrame(0)
+        frame.last_stream_id = self._conn.highest_inbound_stream_id
+        self._writer.write(frame.serialize())
+        if not self.streams:
+            self._writer.close()
+
+    def _flush(self):
+        data = self._conn.data_to_send()
+        if data:
+            self._writer.write(data)
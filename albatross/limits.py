@@ -0,0 +1,67 @@
+import asyncio
+from collections import deque
+
+# seconds a turned away connection is read from before it is closed
+LINGER_TIMEOUT = 1
+
+
+class Limiter:
+    """Caps how many of something run at once, with a bounded queue.
+
+    Attributes:
+        limit (int): how many may hold a slot at once
+        queue_size (int): how many may wait for a slot; any more are
+            turned away straight away
+        active (int): slots held right now
+    """
+
+    def __init__(self, limit, queue_size=0):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self._waiters = deque()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def try_acquire(self):
+        """Takes a slot if one is free, without waiting.
+
+        :return: True if a slot was taken
+        """
+        if self.active < self.limit:
+            self.active += 1
+            return True
+        return False
+
+    async def acquire(self):
+        """Takes a slot, waiting in the queue for one if there is room.
+
+        :return: True if a slot was taken, False if the queue was full
+        """
+        if self.try_acquire():
+            return True
+        if len(self._waiters) >= self.queue_size:
+            return False
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just as the wait was cancelled
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        return True
+
+    def release(self):
+        """Gives a slot back, handing it to the longest waiter if any."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
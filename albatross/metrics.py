@@ -0,0 +1,203 @@
+from bisect import bisect_left
+from time import perf_counter
+
+# upper bounds in seconds, as in the Prometheus client libraries
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PHASES = ('read', 'parse', 'route', 'middleware', 'handler', 'serialize',
+          'drain')
+UNMATCHED = '<unmatched>'
+
+
+class Histogram:
+    """Counts observations into fixed buckets.
+
+    Attributes:
+        buckets (tuple): sorted upper bounds
+        counts (list): observations per bucket, not cumulative; the last
+            one counts those above every bound
+        sum (float): total of all observations
+        count (int): number of observations
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Trace:
+    """What happened while answering one request, passed to callbacks.
+
+    Attributes:
+        route (str): the template of the matched route
+        method (str):
+        status_code (str):
+        phases (dict): seconds spent in each phase; see `PHASES`
+        bytes_in (int): bytes received for the request
+        bytes_out (int): bytes sent for the response
+    """
+    __slots__ = ('route', 'method', 'status_code', 'phases', 'bytes_in',
+                 'bytes_out')
+
+    def __init__(self, route, method, phases, bytes_in):
+        self.route = route
+        self.method = method
+        self.status_code = None
+        self.phases = phases
+        self.bytes_in = bytes_in
+        self.bytes_out = 0
+
+
+class Metrics:
+    """Collects per-request timings and counters for `Server(metrics=...)`.
+
+    Each request's time is split into phases: reading it from the socket,
+    parsing it, looking up its route, running middleware, running the
+    handler, serializing the response and draining it to the client.
+    Phases are kept in a histogram per route template, so paths with
+    different parameters share one series. Servers without metrics skip
+    the timing altogether.
+
+    Attributes:
+        buckets (tuple): histogram bucket bounds in seconds
+        histograms (dict): route -> phase -> Histogram
+        requests (dict): (route, method, status code) -> count
+        errors (dict): route -> count of 5xx responses
+        in_flight (int): requests being answered right now
+        bytes_in (int): bytes received in requests
+        bytes_out (int): bytes sent in responses
+        callbacks (list): called with each finished request's `Trace`
+        executor (Executor): the server's executor, whose pools are
+            reported along with the requests
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.requests = {}
+        self.errors = {}
+        self.in_flight = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.callbacks = []
+        self.clock = perf_counter
+        self.executor = None
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def start(self, req):
+        """Begins tracing a request that is about to be handled."""
+        self.in_flight += 1
+        timings = req._timings
+        phases = dict(timings) if timings is not None else {}
+        if 'read' in phases:
+            # the parser times the whole arrival, parsing included
+            phases['read'] = max(phases['read'] - phases['parse'], 0.0)
+        return Trace(req.route or UNMATCHED, req.method, phases,
+                     req._bytes_in)
+
+    def finish(self, trace, res):
+        """Records a traced request once its response has been sent."""
+        self.in_flight -= 1
+        trace.status_code = res.status_code
+        route = trace.route
+        series = self.histograms.get(route)
+        if series is None:
+            series = self.histograms[route] = {
+                phase: Histogram(self.buckets) for phase in PHASES}
+        for phase, seconds in trace.phases.items():
+            series[phase].observe(seconds)
+
+        status = res.status_code.partition(' ')[0]
+        key = (route, trace.method, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        if status[:1] == '5':
+            self.errors[route] = self.errors.get(route, 0) + 1
+        self.bytes_in += trace.bytes_in
+        self.bytes_out += trace.bytes_out
+
+        for callback in self.callbacks:
+            callback(trace)
+
+    def render(self):
+        """Formats the metrics in the Prometheus text exposition format."""
+        lines = [
+            '# HELP albatross_phase_seconds Time spent in each phase of '
+            'answering a request.',
+            '# TYPE albatross_phase_seconds histogram',
+        ]
+        for route, phase in sorted(
+                (route, phase) for route, series in self.histograms.items()
+                for phase, histogram in series.items() if histogram.count):
+            histogram = self.histograms[route][phase]
+            labels = 'route="%s",phase="%s"' % (escape(route), phase)
+            total = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',),
+                                    histogram.counts):
+                total += count
+                lines.append('albatross_phase_seconds_bucket{%s,le="%s"} %d' %
+                             (labels, bound, total))
+            lines.append('albatross_phase_seconds_sum{%s} %r' %
+                         (labels, histogram.sum))
+            lines.append('albatross_phase_seconds_count{%s} %d' %
+                         (labels, histogram.count))
+
+        lines.append('# TYPE albatross_requests_total counter')
+        for (route, method, status), count in sorted(self.requests.items()):
+            lines.append(
+                'albatross_requests_total{route="%s",method="%s",'
+                'status="%s"} %d' % (escape(route), method, status, count))
+        lines.append('# TYPE albatross_errors_total counter')
+        for route, count in sorted(self.errors.items()):
+            lines.append('albatross_errors_total{route="%s"} %d' %
+                         (escape(route), count))
+        lines.extend([
+            '# TYPE albatross_in_flight_requests gauge',
+            'albatross_in_flight_requests %d' % self.in_flight,
+            '# TYPE albatross_received_bytes_total counter',
+            'albatross_received_bytes_total %d' % self.bytes_in,
+            '# TYPE albatross_sent_bytes_total counter',
+            'albatross_sent_bytes_total %d' % self.bytes_out,
+        ])
+        executor = self.executor
+        if executor is not None:
+            pools = sorted(executor.limiters.items())
+            lines.append('# TYPE albatross_executor_active gauge')
+            lines.extend('albatross_executor_active{pool="%s"} %d' % (
+                pool, limiter.active) for pool, limiter in pools)
+            lines.append('# TYPE albatross_executor_queued gauge')
+            lines.extend('albatross_executor_queued{pool="%s"} %d' % (
+                pool, limiter.waiting) for pool, limiter in pools)
+            lines.append('# TYPE albatross_executor_rejected_total counter')
+            lines.extend(
+                'albatross_executor_rejected_total{pool="%s"} %d' % (
+                    pool, executor.rejected[pool]) for pool, _ in pools)
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+class MetricsHandler:
+    """Serves a `Metrics` for Prometheus to scrape:
+
+        app.add_route('/metrics', MetricsHandler(app.metrics))
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def on_get(self, req, res):
+        res.headers['Content-Type'] = 'text/plain; version=0.0.4'
+        res.write(self.metrics.render())
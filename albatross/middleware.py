@@ -0,0 +1,62 @@
+class Middleware:
+    """A base for middleware whose hooks do nothing. Subclasses define the
+    hooks they need, and the ones left as they are here are never called.
+
+    Middleware that doesn't subclass this may also leave either hook out.
+    """
+
+    async def process_request(self, req, res, handler):
+        """Returns True to answer the request without calling the handler
+        or the middleware after this one."""
+        return False
+
+    async def process_response(self, req, res, handler):
+        pass
+
+
+def hook(middleware, name):
+    """The bound hook of a middleware, or None if it doesn't have one that
+    does anything."""
+    method = getattr(middleware, name, None)
+    if getattr(method, '__func__', None) is getattr(Middleware, name):
+        return None
+    return method
+
+
+class MiddlewareChain:
+    """Middleware compiled into the hooks each request runs through.
+
+    Hooks a middleware doesn't define are left out, so a request only
+    awaits the ones that do something. A chain is never changed once it
+    is made: adding middleware makes a new one, and requests in flight
+    finish with the chain they started with.
+
+    Attributes:
+        middleware (tuple): the middleware, in the order they run
+        parent (MiddlewareChain): the chain this one extends, if any
+        requests (tuple): a (process_request, responses) pair for each
+            middleware with a `process_request`, where responses are the
+            `process_response` hooks to run if it answers the request:
+            those of the middleware up to and including it
+        responses (tuple): every `process_response` hook, in order
+    """
+    __slots__ = ('middleware', 'parent', 'requests', 'responses')
+
+    def __init__(self, middleware=(), parent=None):
+        self.middleware = tuple(middleware)
+        self.parent = parent
+        requests = []
+        responses = []
+        for m in self.middleware:
+            process_response = hook(m, 'process_response')
+            if process_response is not None:
+                responses.append(process_response)
+            process_request = hook(m, 'process_request')
+            if process_request is not None:
+                requests.append((process_request, tuple(responses)))
+        self.requests = tuple(requests)
+        self.responses = tuple(responses)
+
+    def extend(self, middleware):
+        """A chain that runs middleware after this chain's."""
+        return MiddlewareChain(self.middleware + tuple(middleware), self)
@@ -0,0 +1,172 @@
+import io
+import re
+
+
+PARAM = re.compile(r';\s*([^\s;=]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)')
+# a part's headers must fit in this many bytes
+MAX_HEADER_SIZE = 2 ** 14
+
+STATE_PREAMBLE = 0
+STATE_DELIMITER = 1
+STATE_HEADERS = 2
+STATE_BODY = 3
+STATE_DONE = 4
+
+
+def parse_header(value):
+    """Splits a header like Content-Type into its value and parameters.
+
+    :return: tuple of the lowercased value and a dict of parameters
+    """
+    main, _, params = value.partition(';')
+    options = {}
+    for key, param in PARAM.findall(';' + params):
+        param = param.strip()
+        if param[:1] == '"':
+            param = re.sub(r'\\(.)', r'\1', param[1:-1])
+        options[key.lower()] = param
+    return main.strip().lower(), options
+
+
+class Part:
+    """A single part of a multipart/form-data body.
+
+    Attributes:
+        name (str): the form field name
+        filename (str): the uploaded file's name, None for plain fields
+        content_type (str): the part's Content-Type, if it has one
+        file (file): file parts' contents, rewound to the start
+        value (bytes): plain fields' contents
+    """
+
+    def __init__(self, name, filename, content_type, file):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.file = file
+        self.value = None
+
+
+class MultipartParser:
+    """Parses a multipart/form-data body incrementally as chunks arrive.
+
+    Each chunk is scanned once for the next delimiter. Plain field values
+    are collected in memory, while file parts are written straight to a
+    file from `make_file`, so large uploads never sit in memory whole.
+    Errors are kept until `close`, so `feed` can be called from parser
+    callbacks that must not raise.
+    """
+
+    def __init__(self, boundary, make_file=io.BytesIO):
+        if not boundary:
+            raise ValueError('Invalid boundary in multipart form')
+        self._delimiter = b'\r\n--' + boundary.encode('latin-1')
+        self._make_file = make_file
+        # the first delimiter may come without the leading line break
+        self._buffer = bytearray(b'\r\n')
+        self._state = STATE_PREAMBLE
+        self._part = None
+        self._data = None
+        self._error = None
+        self.parts = []
+
+    def feed(self, data):
+        if self._error is not None or self._state == STATE_DONE:
+            return
+        self._buffer.extend(data)
+        try:
+            self._parse()
+        except ValueError as e:
+            self._error = e
+
+    def close(self):
+        """Checks the body was complete and well formed.
+
+        :return: the list of parsed parts
+        """
+        if self._error is not None:
+            raise self._error
+        if self._state != STATE_DONE:
+            raise ValueError('Incomplete multipart form')
+        for part in self.parts:
+            if part.filename is None:
+                part.value = bytes(part.value)
+            else:
+                part.file.seek(0)
+        return self.parts
+
+    def _parse(self):
+        buffer = self._buffer
+        delimiter = self._delimiter
+        while True:
+            if self._state in (STATE_PREAMBLE, STATE_BODY):
+                index = buffer.find(delimiter)
+                if index < 0:
+                    # hold back what could be the start of a delimiter
+                    keep = len(delimiter) - 1
+                    if len(buffer) > keep:
+                        self._write(buffer[:-keep])
+                        del buffer[:-keep]
+                    return
+                self._write(buffer[:index])
+                del buffer[:index + len(delimiter)]
+                self._state = STATE_DELIMITER
+
+            elif self._state == STATE_DELIMITER:
+                if len(buffer) < 2:
+                    return
+                if buffer[:2] == b'--':
+                    self._state = STATE_DONE
+                    del buffer[:]
+                    return
+                end = buffer.find(b'\r\n')
+                if end < 0:
+                    return
+                if buffer[:end].strip(b' \t'):
+                    raise ValueError('Malformed multipart delimiter')
+                del buffer[:end + 2]
+                self._state = STATE_HEADERS
+
+            elif self._state == STATE_HEADERS:
+                end = buffer.find(b'\r\n\r\n')
+                if end < 0:
+                    if len(buffer) > MAX_HEADER_SIZE:
+                        raise ValueError('Multipart headers too large')
+                    return
+                self._start_part(bytes(buffer[:end]))
+                del buffer[:end + 4]
+                self._state = STATE_BODY
+
+    def _start_part(self, raw_headers):
+        headers = {}
+        for line in raw_headers.decode('utf-8', 'replace').split('\r\n'):
+            key, sep, value = line.partition(':')
+            if not sep:
+                raise ValueError('Malformed multipart header')
+            headers[key.strip().lower()] = value.strip()
+
+        disposition, options = parse_header(
+            headers.get('content-disposition', ''))
+        if disposition != 'form-data' or 'name' not in options:
+            raise ValueError('Multipart part without a form-data name')
+
+        filename = options.get('filename')
+        if filename is None:
+            self._data = bytearray()
+            file = None
+        else:
+            self._data = None
+            file = self._make_file()
+        self._part = Part(
+            options['name'], filename, headers.get('content-type'), file)
+        if filename is None:
+            self._part.value = self._data
+        self.parts.append(self._part)
+
+    def _write(self, data):
+        if self._state != STATE_BODY or not data:
+            return
+        if self._data is not None:
+            self._data.extend(data)
+        else:
+            self._part.file.write(data)
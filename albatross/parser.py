@@ -0,0 +1,233 @@
+from collections import deque
+from albatross.http_error import HTTPError
+from albatross.request import Request, RequestBody, BODY_SPOOL_SIZE
+from albatross.status_codes import HTTP_413
+from httptools import HttpRequestParser, HttpParserUpgrade
+
+# answered requests kept per connection for reuse, when pooling
+MAX_FREE_REQUESTS = 16
+# what a client sends first on an HTTP/2 connection made with prior
+# knowledge, rather than upgraded from HTTP/1.1
+HTTP2_PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+
+
+class RequestParser:
+    """Parses every request sent over a single connection.
+
+    One httptools parser is kept for the lifetime of the connection and its
+    callbacks are routed to a fresh `Request` per message. Requests are
+    queued in arrival order, so pipelined requests are answered in the
+    order they were sent. A request is queued once its body is complete,
+    or as soon as its headers are parsed if `on_headers` asks for its body
+    to be streamed.
+
+    Once a request with a streamed body upgrades the connection, everything
+    received after it is fed to that body, for the new protocol to read.
+    Other upgrade requests are answered and the connection closed.
+
+    With `http2` set, a connection that opens with the HTTP/2 preface is
+    queued as a single request marked `_http2`, and everything received on
+    it is fed to that request's body.
+
+    Attributes:
+        current (Request): the request being parsed, None between requests
+        upgraded (Request): the request that upgraded the connection
+        requests (deque): parsed requests waiting to be handled
+        on_request (callable): called with each request once it is queued
+        on_headers (callable): called with each request once its headers
+            are parsed; returns True to stream the body to the handler
+        max_body_size (int): bodies larger than this are answered with 413
+        spool_size (int): buffered bodies larger than this go to disk
+        body_options (dict): keyword arguments for each `RequestBody`
+        clock (callable): when set, each request's `_timings` records how
+            long it took to arrive and to parse. Time spent parsing a
+            chunk, and its size, are split between the requests in it.
+        pool (bool): requests handed back with `release` are reset and
+            parsed into again, instead of making a new one per message
+        http2 (bool): whether to look for the HTTP/2 preface
+        offload_size (int): bodies with a codec larger than this are
+            parsed in a thread for handlers that ask for it
+        codecs (dict): media type -> codec that parses each request's form
+    """
+
+    def __init__(self, on_request=None, on_headers=None, max_body_size=None,
+                 spool_size=BODY_SPOOL_SIZE, body_options=None, clock=None,
+                 pool=False, http2=False, offload_size=None, codecs=None):
+        self._parser = HttpRequestParser(self)
+        self._free = []
+        self.requests = deque()
+        self.on_headers = on_headers
+        self.max_body_size = max_body_size
+        self.spool_size = spool_size
+        self.clock = clock
+        self.pool = pool
+        self.http2 = http2
+        self.offload_size = offload_size
+        self.codecs = codecs
+        self.reset(on_request, body_options)
+
+    def reset(self, on_request=None, body_options=None):
+        """Readies the parser for another connection. The httptools parser
+        is kept, so this is only safe once the last connection ended
+        between requests that allowed keep-alive."""
+        self._body_size = 0
+        self._queued = False
+        self._touched = []
+        self.current = None
+        self.upgraded = None
+        # the start of the connection, until it is known to be HTTP/1.1
+        self._preface = b'' if self.http2 else None
+        self.requests.clear()
+        self.on_request = on_request
+        self.body_options = body_options or {}
+
+    def release(self, req):
+        """Hands back a request once it has been answered, to be reused
+        for a later message if the parser pools requests."""
+        if self.pool and len(self._free) < MAX_FREE_REQUESTS:
+            req.reset()
+            self._free.append(req)
+
+    def feed_data(self, data):
+        if self.upgraded is not None:
+            self.upgraded.body.feed(data)
+            return
+        if self._preface is not None:
+            data = self._sniff(data)
+            if not data:
+                return
+        try:
+            self._feed_data(data)
+        except HttpParserUpgrade as e:
+            rest = data[e.args[0]:]
+            if self.upgraded is not None and rest:
+                self.upgraded.body.feed(rest)
+
+    def _sniff(self, data):
+        """Holds back the start of the connection while it could still be
+        the HTTP/2 preface.
+
+        :return: the data to parse as HTTP/1.1
+        """
+        data = self._preface + data
+        if len(data) < len(HTTP2_PREFACE) and HTTP2_PREFACE.startswith(data):
+            self._preface = data
+            return b''
+        self._preface = None
+        if not data.startswith(HTTP2_PREFACE):
+            return data
+        req = Request(spool_size=self.spool_size)
+        req._http2 = True
+        req.body = RequestBody(**self.body_options)
+        req.body.feed(data)
+        self.upgraded = req
+        self.requests.append(req)
+        if self.on_request is not None:
+            self.on_request(req)
+        return b''
+
+    def _feed_data(self, data):
+        if self.clock is None:
+            self._parser.feed_data(data)
+            return
+
+        touched = self._touched = []
+        if self.current is not None:
+            touched.append(self.current)
+        start = self.clock()
+        try:
+            self._parser.feed_data(data)
+        finally:
+            if touched:
+                share = (self.clock() - start) / len(touched)
+                size = len(data) // len(touched)
+                for req in touched:
+                    req._timings['parse'] += share
+                    req._bytes_in += size
+
+    def _queue(self, req):
+        self._queued = True
+        if self.clock is not None:
+            timings = req._timings
+            timings['read'] = self.clock() - timings['read']
+        self.requests.append(req)
+        if self.on_request is not None:
+            self.on_request(req)
+
+    def _reject(self, req, error):
+        req.keep_alive = False
+        if req.body is not None:
+            req.body.set_exception(error)
+        elif not self._queued:
+            req.error = error
+            self._queue(req)
+
+    # HTTPRequestParser protocol methods
+    def on_message_begin(self):
+        if self._free:
+            self.current = self._free.pop()
+        else:
+            self.current = Request(spool_size=self.spool_size,
+                                   offload_size=self.offload_size,
+                                   codecs=self.codecs)
+        self._body_size = 0
+        self._queued = False
+        if self.clock is not None:
+            # read holds the start time until the request is queued
+            self.current._timings = {'read': self.clock(), 'parse': 0.0}
+            self._touched.append(self.current)
+
+    def on_url(self, url: bytes):
+        self.current.on_url(url)
+
+    def on_header(self, name: bytes, value: bytes):
+        self.current.on_header(name, value)
+
+    def on_headers_complete(self):
+        req = self.current
+        req.method = self._parser.get_method().decode().upper()
+        # httptools can't go back to HTTP after an upgrade request
+        req.keep_alive = (self._parser.should_keep_alive() and
+                          not self._parser.should_upgrade())
+        req.http_version = self._parser.get_http_version()
+        req.on_headers_complete()
+
+        length = req._content_length
+        if (self.max_body_size is not None and length is not None and
+                int(length) > self.max_body_size):
+            self._reject(req, HTTPError(HTTP_413))
+        elif self.on_headers is not None and self.on_headers(req):
+            req.body = RequestBody(**self.body_options)
+            self._queue(req)
+
+    def on_body(self, body: bytes):
+        req = self.current
+        if req.error is not None:
+            return
+        self._body_size += len(body)
+        if (self.max_body_size is not None and
+                self._body_size > self.max_body_size):
+            self._reject(req, HTTPError(HTTP_413))
+        elif req.body is not None:
+            req.body.feed(body)
+        else:
+            req.on_body(body)
+
+    def on_message_complete(self):
+        req = self.current
+        self.current = None
+        if req.body is not None:
+            if self._parser.should_upgrade():
+                self.upgraded = req
+            else:
+                req.body.feed_eof()
+            return
+        if self._queued:
+            return
+        try:
+            req.on_message_complete()
+        except Exception as e:
+            # raising here would leave httptools in an error state, so the
+            # failure is re-raised when the request is handled instead
+            req.error = e
+        self._queue(req)
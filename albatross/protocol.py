@@ -0,0 +1,274 @@
+import asyncio
+import time
+from albatross.http_error import HTTPError
+from albatross.limits import LINGER_TIMEOUT
+from albatross.status_codes import HTTP_400, HTTP_408
+from httptools import HttpParserError
+
+
+MAX_PIPELINED_REQUESTS = 16
+
+
+class TransportWriter:
+    """The part of `asyncio.StreamWriter` used to send responses,
+    writing straight to a transport.
+
+    `drain` waits while the transport has asked the protocol to pause
+    writing, so large responses respect the peer's read speed.
+    """
+
+    def __init__(self, transport, loop):
+        self.transport = transport
+        self._loop = loop
+        self._paused = False
+        self._drain_waiter = None
+        self._lost = False
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def writelines(self, data):
+        self.transport.writelines(data)
+
+    def write_eof(self):
+        self.transport.write_eof()
+
+    def close(self):
+        self.transport.close()
+
+    def is_closing(self):
+        return self.transport.is_closing()
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    async def drain(self):
+        if self._lost:
+            raise ConnectionResetError('Connection lost')
+        if self._paused:
+            self._drain_waiter = self._loop.create_future()
+            await self._drain_waiter
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._wake(None)
+
+    def connection_lost(self):
+        self._lost = True
+        self._wake(ConnectionResetError('Connection lost'))
+
+    def _wake(self, exc):
+        waiter, self._drain_waiter = self._drain_waiter, None
+        if waiter is None or waiter.done():
+            return
+        if exc is None:
+            waiter.set_result(None)
+        else:
+            waiter.set_exception(exc)
+
+
+class HttpProtocol(asyncio.Protocol):
+    """Serves a connection from protocol callbacks instead of streams.
+
+    Received data goes straight into the connection's `RequestParser`.
+    A task that answers queued requests in order is started as soon as a
+    request is ready, and reading is paused while too many pipelined
+    requests are waiting or a handler is behind on a streamed body.
+    """
+
+    def __init__(self, server, loop):
+        self._server = server
+        self._loop = loop
+        self._parser = server._make_parser(
+            on_request=self._on_request,
+            body_options={
+                'pause': lambda: self._pause_reading('body'),
+                'resume': lambda: self._resume_reading('body'),
+            },
+        )
+        self._writer = None
+        self._task = None
+        self._served = 0
+        self._paused_by = set()
+        self._idle_handle = None
+        self._deadline = None
+        self._deadline_handle = None
+        self._admitted = False
+        self._discarding = False
+        self._rejected = False
+
+    def connection_made(self, transport):
+        self._writer = TransportWriter(transport, self._loop)
+        self._server._open.add(self._writer)
+        self._set_idle_timeout(fresh=True)
+        limiter = self._server._connections
+        if limiter is None or limiter.try_acquire():
+            self._admitted = limiter is not None
+        else:
+            # wait for a free slot without reading the connection
+            self._pause_reading('limit')
+            self._start(self._admit())
+
+    def connection_lost(self, exc):
+        self._cancel_idle_timeout()
+        self._set_deadline(None)
+        self._writer.connection_lost()
+        self._server._connection_closed(self._writer)
+        upgraded = self._parser.upgraded
+        if upgraded is not None:
+            upgraded.body.set_exception(
+                ConnectionResetError('Connection lost'))
+        if self._task is not None:
+            self._task.cancel()
+        elif self._parser.current is None:
+            # closed between requests, so the parser can serve another
+            self._server._recycle_parser(self._parser)
+        if self._admitted:
+            self._admitted = False
+            self._server._connections.release()
+
+    def pause_writing(self):
+        self._writer.pause_writing()
+
+    def resume_writing(self):
+        self._writer.resume_writing()
+
+    def data_received(self, data):
+        if self._discarding:
+            return
+        self._cancel_idle_timeout()
+        try:
+            self._server._feed(self._parser, data, self._writer,
+                               self._task is not None)
+        except HttpParserError:
+            self._pause_reading('error')
+            # answered after the requests queued before it
+            self._rejected = True
+            if self._task is None:
+                self._start(self._reject(HTTP_400))
+            return
+        req = self._parser.current
+        self._set_deadline(req._deadline if req is not None else None)
+
+    def _on_request(self, req):
+        if len(self._parser.requests) >= MAX_PIPELINED_REQUESTS:
+            self._pause_reading('pipeline')
+        if self._task is None:
+            self._start(self._serve())
+
+    def _start(self, coro):
+        if self._task is not None:
+            self._task.cancel()
+        self._task = self._loop.create_task(coro)
+
+    async def _serve(self):
+        server = self._server
+        requests = self._parser.requests
+        try:
+            while requests:
+                req = requests.popleft()
+                self._served += 1
+                self._resume_reading('pipeline')
+                keep_alive = await server._send_response(
+                    req, self._writer, self._served)
+                if not keep_alive:
+                    if req.error is not None and self._parser.current is req:
+                        # refused before its body arrived, which the client
+                        # may still be sending
+                        self._linger()
+                    else:
+                        self._writer.close()
+                    return
+                self._parser.release(req)
+        except ConnectionError:
+            self._writer.close()
+            return
+        if self._rejected:
+            await self._reject(HTTP_400)
+            return
+        self._task = None
+        if self._parser.current is None:
+            self._set_idle_timeout()
+        else:
+            server._write_continue(self._parser.current, self._writer)
+
+    async def _reject(self, status_code):
+        try:
+            await self._server._reject(self._writer, status_code)
+        except ConnectionError:
+            pass
+        self._writer.close()
+
+    async def _admit(self):
+        server = self._server
+        if await server._connections.acquire():
+            self._admitted = True
+            self._task = None
+            self._resume_reading('limit')
+            return
+        try:
+            await server._shed(self._writer)
+        except ConnectionError:
+            self._writer.close()
+            return
+        self._linger()
+
+    def _linger(self):
+        """Reads and drops what the client still sends until it closes,
+        for a moment, so closing doesn't reset the connection before it
+        reads the response."""
+        self._discarding = True
+        self._writer.write_eof()
+        if self._paused_by:
+            self._paused_by.clear()
+            self._writer.transport.resume_reading()
+        self._loop.call_later(LINGER_TIMEOUT, self._writer.close)
+
+    def _set_deadline(self, deadline):
+        """Times out the request being received at `deadline`."""
+        if deadline == self._deadline:
+            return
+        if self._deadline_handle is not None:
+            self._deadline_handle.cancel()
+            self._deadline_handle = None
+        self._deadline = deadline
+        if deadline is not None:
+            self._deadline_handle = self._loop.call_later(
+                max(deadline - time.monotonic(), 0), self._timed_out)
+
+    def _timed_out(self):
+        self._deadline_handle = None
+        req = self._parser.current
+        if req is None:
+            return
+        # the request is answered with 408 in turn, and nothing more is
+        # read from the connection
+        self._pause_reading('error')
+        self._parser._reject(req, HTTPError(HTTP_408))
+
+    def _pause_reading(self, reason):
+        if not self._paused_by:
+            self._writer.transport.pause_reading()
+        self._paused_by.add(reason)
+
+    def _resume_reading(self, reason):
+        if reason in self._paused_by:
+            self._paused_by.remove(reason)
+            if not self._paused_by:
+                self._writer.transport.resume_reading()
+
+    def _set_idle_timeout(self, fresh=False):
+        self._server._set_idle(self._writer, True, fresh)
+        timeout = self._server.keep_alive_timeout
+        if timeout is not None:
+            self._idle_handle = self._loop.call_later(
+                timeout, self._writer.close)
+
+    def _cancel_idle_timeout(self):
+        self._server._set_idle(self._writer, False)
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
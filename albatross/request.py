@@ -1,28 +1,182 @@
 from albatross.data_types import (
+    EMPTY_MULTIDICT,
+    Headers,
     ImmutableMultiDict,
     ImmutableCaselessMultiDict
 )
-from albatross.compat import json
+from albatross.codecs import CODECS, media_type
+from albatross.multipart import MultipartParser, parse_header
 import urllib.parse as parse
 from httptools import parse_url
-import cgi
-import io
+import asyncio
+import tempfile
 
 
 REQUEST_STATE_PROCESSING = 0
 REQUEST_STATE_CONTINUE = 1
 REQUEST_STATE_COMPLETE = 2
 
+# marks lazily parsed attributes that have not been computed yet
+NOT_PARSED = object()
+
+# buffered bodies larger than this are moved from memory to a temp file
+BODY_SPOOL_SIZE = 2 ** 20
+# streamed bodies stop reading from the socket with this much unread
+BODY_BUFFER_LIMIT = 2 ** 18
+
 
 def trim_keys(d):
     return {k.strip(): v for k, v in d.items()}
 
 
 class FileStorage:
+    """An uploaded file from a multipart form.
+
+    Attributes:
+        filename (str): the name the client gave the file
+        content_type (str): the file's Content-Type, if sent
+        file (file): the contents, in memory or spooled to disk
+    """
+
+    def __init__(self, filename, file, content_type=None):
+        self.filename = filename
+        self.file = file
+        self.content_type = content_type
+
+    @property
+    def value(self):
+        """The whole contents as bytes."""
+        self.file.seek(0)
+        return self.file.read()
+
+
+class SpooledBody(tempfile.SpooledTemporaryFile):
+    """A buffered request body, kept in memory until it outgrows
+    `max_size` and on disk after that."""
+
+    def getvalue(self):
+        position = self.tell()
+        self.seek(0)
+        value = self.read()
+        self.seek(position)
+        return value
+
+    def getbuffer(self):
+        """The whole contents, as a view of the memory they are kept in,
+        or as bytes read from disk. A view must be released before the
+        body is written to or closed."""
+        if not self._rolled:
+            return self._file.getbuffer()
+        return self.getvalue()
+
+
+class RequestBody:
+    """A request body that handlers read while it is still arriving.
+
+    When the buffer runs dry, more data is either pulled from the
+    connection with `fill`, or awaited from `feed`. In the second case
+    `pause` is called once more than `limit` bytes are waiting to be read
+    and `resume` once the handler has caught up, so a slow handler stops
+    the socket from being read instead of buffering the whole body.
+
+    Attributes:
+        complete (bool): True once the whole body has been received
+    """
+
+    def __init__(self, fill=None, pause=None, resume=None,
+                 limit=BODY_BUFFER_LIMIT):
+        self._buffer = bytearray()
+        self._exception = None
+        self._waiter = None
+        self._fill = fill
+        self._pause = pause
+        self._resume = resume
+        self._paused = False
+        self.limit = limit
+        self.complete = False
+
+    def feed(self, data):
+        self._buffer.extend(data)
+        if (self._pause is not None and not self._paused and
+                len(self._buffer) > self.limit):
+            self._paused = True
+            self._pause()
+        self._wake()
+
+    def feed_eof(self):
+        self.complete = True
+        self._wake()
+
+    def set_exception(self, exc):
+        self._exception = exc
+        self._wake()
+
+    async def read(self, n=-1):
+        """Reads up to n bytes, or the rest of the body if n is negative.
+
+        :return: b'' once the body has been read
+        """
+        while not self.complete and (n < 0 or not self._buffer):
+            if self._exception is not None:
+                raise self._exception
+            await self._wait()
+        if self._exception is not None:
+            raise self._exception
+
+        buffer = self._buffer
+        if n < 0 or n >= len(buffer):
+            data = bytes(buffer)
+            buffer.clear()
+        else:
+            data = bytes(buffer[:n])
+            del buffer[:n]
+        if self._paused and len(buffer) <= self.limit:
+            self._paused = False
+            self._resume()
+        return data
+
+    async def readexactly(self, n):
+        """Reads exactly n bytes.
+
+        :raises asyncio.IncompleteReadError: if the body ends first
+        """
+        data = await self.read(n)
+        if len(data) == n:
+            return data
+        chunks = [data]
+        missing = n - len(data)
+        while missing:
+            chunk = await self.read(missing)
+            if not chunk:
+                partial = b''.join(chunks)
+                raise asyncio.IncompleteReadError(partial, n)
+            chunks.append(chunk)
+            missing -= len(chunk)
+        return b''.join(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        data = await self.read(2 ** 16)
+        if not data:
+            raise StopAsyncIteration
+        return data
+
+    async def _wait(self):
+        if self._paused:
+            self._paused = False
+            self._resume()
+        if self._fill is not None:
+            await self._fill()
+        else:
+            self._waiter = asyncio.get_event_loop().create_future()
+            await self._waiter
 
-    def __init__(self, field_storage):
-        self.filename = field_storage.filename
-        self.value = field_storage.value
+    def _wake(self):
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
 
 
 class Request:
@@ -32,55 +186,237 @@ class Request:
         path (str): Full request path
         query_string (str): Full query string
         query (dict): dict of the request query
-        body (str): Request body
+        raw_body (file): The buffered request body, spilled to a temp file
+            when it is larger than spool_size. Multipart bodies are parsed
+            into form as they arrive and are not kept here.
+        body (RequestBody): Set instead of raw_body and form for handlers
+            with `stream_body = True`, which read the body as it arrives
         args (dict): Dictionary of named parameters in route regex
+        route (str): The template of the matched route
         form (dict): Dictionary of body parameters
+        keep_alive (bool): Whether the client allows the connection to be
+            reused for another request
+        http_version (str): '1.1' or '1.0'
+        error (Exception): Set if the body could not be parsed
+
+    query, headers, cookies, form and raw_body are only built the first
+    time they are used, so handlers don't pay for the parts they ignore.
     """
 
+    __slots__ = (
+        '_header_list', '_handler', '_endpoint', '_multipart', '_spool_size',
+        '_state', '_content_type', '_content_length', '_cookie', '_raw_body',
+        'method', 'path', 'query_string', '_query', 'args', 'route',
+        '_timings', '_deadline', '_bytes_in', '_headers', '_cookies', 'body',
+        '_form', 'keep_alive', 'http_version', 'error', '_cache_miss',
+        '_response', '_websocket', '_http2', '_offload_size', '_codecs',
+        '_finalizers',
+        # middleware may still keep its own attributes on a request
+        '__dict__',
+    )
+
     def __init__(self, method=None, path=None, query_string='',
-                 args=None, headers=None, form=None, cookies=None):
+                 args=None, headers=None, form=None, cookies=None,
+                 spool_size=BODY_SPOOL_SIZE, offload_size=None,
+                 codecs=None):
         self._header_list = []
-        self._state = REQUEST_STATE_PROCESSING
+        self._spool_size = spool_size
+        self._offload_size = offload_size
+        self._codecs = codecs if codecs is not None else CODECS
+        self._response = None
+        self._clear()
         self.method = method
         self.path = path
         self.query_string = query_string
-        self.query = None
+        self._query = NOT_PARSED if query_string else None
         self.args = args
-        self.headers = ImmutableCaselessMultiDict()
-        self.cookies = ImmutableMultiDict()
-        self.raw_body = io.BytesIO()
-        self.form = form
 
-        if query_string:
-            self.query = ImmutableMultiDict(parse.parse_qs(self.query_string))
+        if form is not None:
+            self._form = form
 
         if headers:
-            self.headers = ImmutableCaselessMultiDict(**headers)
+            self._headers = ImmutableCaselessMultiDict(**headers)
 
         if cookies:
-            self.cookies = ImmutableMultiDict(**cookies)
+            self._cookies = ImmutableMultiDict(**cookies)
+
+    def reset(self):
+        """Forgets the message, so the request can be parsed into again.
+
+        Servers that pool objects reuse a request this way once it has been
+        answered, along with the Response it was answered with.
+        """
+        if self._raw_body is not None:
+            self._raw_body.close()
+        if self._response is not None:
+            self._response.reset()
+        self._header_list.clear()
+        self.__dict__.clear()
+        self._clear()
+
+    def _clear(self):
+        self._raw_body = None
+        self._handler = None
+        self._endpoint = None
+        self._multipart = None
+        self._state = REQUEST_STATE_PROCESSING
+        self._content_type = None
+        self._content_length = None
+        self._cookie = None
+        self.method = None
+        self.path = None
+        self.query_string = ''
+        self._query = None
+        self.args = None
+        self.route = None
+        self._timings = None
+        self._deadline = None
+        self._bytes_in = 0
+        self._headers = None
+        self._cookies = NOT_PARSED
+        self.body = None
+        self._form = NOT_PARSED
+        self.keep_alive = False
+        self.http_version = '1.1'
+        self.error = None
+        self._cache_miss = None
+        self._websocket = False
+        self._http2 = False
+        # called once the request has been answered, failed or cancelled
+        self._finalizers = None
+
+    @property
+    def query(self):
+        if self._query is NOT_PARSED:
+            if self.query_string:
+                self._query = ImmutableMultiDict(
+                    parse.parse_qs(self.query_string))
+            else:
+                self._query = EMPTY_MULTIDICT
+        return self._query
+
+    @query.setter
+    def query(self, value):
+        self._query = value
+
+    @property
+    def headers(self):
+        if self._headers is None:
+            self._headers = Headers(self._header_list)
+        return self._headers
+
+    @headers.setter
+    def headers(self, value):
+        self._headers = value
+
+    @property
+    def cookies(self):
+        if self._cookies is NOT_PARSED:
+            if self._cookie:
+                self._cookies = self._parse_cookie(self._cookie.decode())
+            else:
+                self._cookies = EMPTY_MULTIDICT
+        return self._cookies
+
+    @cookies.setter
+    def cookies(self, value):
+        self._cookies = value
+
+    @property
+    def form(self):
+        if self._form is NOT_PARSED:
+            if not self.finished:
+                return None
+            self._parse_body(self.raw_body)
+            if self._form is NOT_PARSED:
+                self._form = None
+        return self._form
+
+    @form.setter
+    def form(self, value):
+        self._form = value
+
+    @property
+    def raw_body(self):
+        if self._raw_body is None:
+            self._raw_body = SpooledBody(max_size=self._spool_size)
+        return self._raw_body
+
+    @raw_body.setter
+    def raw_body(self, value):
+        self._raw_body = value
 
     def _parse_cookie(self, value):
-        cookies = trim_keys(parse.parse_qs(value))
+        # cookies are separated by ';', which parse_qs no longer splits on
+        cookies = trim_keys(parse.parse_qs(value.replace(';', '&')))
         return ImmutableMultiDict(cookies)
 
+    def _make_multipart_parser(self, content_type):
+        _, options = parse_header(content_type)
+        return MultipartParser(
+            options.get('boundary'),
+            make_file=lambda: SpooledBody(max_size=self._spool_size),
+        )
+
     def _parse_form(self, body_stream):
-        # TODO theres probably a way to not read whole body first)
-        env = {'REQUEST_METHOD': 'POST'}
-        form = cgi.FieldStorage(body_stream, headers=self.headers, environ=env)
+        parser = self._multipart
+        if parser is None:
+            # the body was buffered rather than parsed as it arrived
+            parser = self._make_multipart_parser(
+                self.headers.get('Content-Type', ''))
+            for chunk in iter(lambda: body_stream.read(2 ** 16), b''):
+                parser.feed(chunk)
         d = {}
-        for k in form.keys():
-            if form[k].filename:
-                d[k] = [FileStorage(form[k])]
+        for part in parser.close():
+            if part.filename is not None:
+                value = FileStorage(part.filename, part.file,
+                                    part.content_type)
             else:
-                d[k] = [form[k].value]
+                value = part.value.decode('utf-8', 'replace')
+            d.setdefault(part.name, []).append(value)
         return ImmutableMultiDict(d)
 
+    def _codec(self, media_type):
+        """The codec for a media type: the handler's own, if it has one
+        for it, otherwise the server's."""
+        endpoint = self._endpoint
+        if endpoint is not None and endpoint.codecs:
+            codec = endpoint.codecs.get(media_type)
+            if codec is not None:
+                return codec
+        return self._codecs.get(media_type)
+
+    def _offload_form(self):
+        """Whether the buffered body is of a type with a codec and larger
+        than `offload_size`, so parsing it into form would hold up the
+        event loop, and is better done in a thread.
+
+        Multipart bodies are parsed as they arrive, a chunk at a time, so
+        there is never a large parse of them to offload.
+        """
+        if (self._offload_size is None or self._form is not NOT_PARSED or
+                self._raw_body is None or not self.finished):
+            return False
+        content_type = self._content_type
+        if (content_type is None or
+                self._codec(media_type(content_type.decode())) is None):
+            return False
+        size = self._raw_body.seek(0, 2)
+        self._raw_body.seek(0)
+        return size > self._offload_size
+
     def _parse_body(self, body_stream):
         content_type = self.headers.get('Content-Type', '')
-        if content_type == 'application/json':
-            data = body_stream.getvalue().decode()
-            self.form = json.loads(data)
+        codec = self._codec(media_type(content_type))
+        if codec is not None:
+            # parsed from the buffer the body arrived in, without a copy
+            # when the codec reads bytes
+            data = body_stream.getbuffer()
+            try:
+                self.form = codec.loads(data)
+            finally:
+                if isinstance(data, memoryview):
+                    data.release()
         elif content_type.startswith('multipart/form-data'):
             self.form = self._parse_form(body_stream)
         elif content_type == 'application/x-www-form-urlencoded':
@@ -88,31 +424,55 @@ class Request:
             self.form = ImmutableMultiDict(parse.parse_qs(data))
         body_stream.seek(0)
 
+    async def read(self, n=-1):
+        """Reads up to n bytes of the body, or all of it if n is negative,
+        whether it is streamed or buffered."""
+        if self.body is not None:
+            return await self.body.read(n)
+        return self.raw_body.read(n)
+
     # HTTPRequestParser protocol methods
     def on_url(self, url: bytes):
         parsed = parse_url(url)
         self.path = parsed.path.decode()
         self.query_string = (parsed.query or b'').decode()
-        self.query = ImmutableMultiDict(parse.parse_qs(self.query_string))
+        self._query = NOT_PARSED
 
     def on_header(self, name: bytes, value: bytes):
-        self._header_list.append((name.decode(), value.decode()))
-        if name.lower() == b'expect' and value == b'100-continue':
+        # headers are decoded on first use; only those the server itself
+        # needs are picked out here
+        self._header_list.append((name, value))
+        name = name.lower()
+        if name == b'content-type':
+            self._content_type = value
+        elif name == b'content-length':
+            self._content_length = value
+        elif name == b'cookie':
+            if self._cookie is None:
+                self._cookie = value
+        elif name == b'expect' and value == b'100-continue':
             self._state = REQUEST_STATE_CONTINUE
 
     def on_headers_complete(self):
-        self.headers = ImmutableCaselessMultiDict(self._header_list)
-        cookie_value = self.headers.get('Cookie')
-        if cookie_value:
-            self.cookies = self._parse_cookie(cookie_value)
+        content_type = self._content_type
+        if content_type and content_type.startswith(b'multipart/form-data'):
+            try:
+                self._multipart = self._make_multipart_parser(
+                    content_type.decode())
+            except ValueError:
+                pass  # raised again when the body is parsed
 
     def on_body(self, body: bytes):
-        self.raw_body.write(body)
+        if self._multipart is not None:
+            # multipart bodies are parsed as they arrive, not buffered
+            self._multipart.feed(body)
+        else:
+            self.raw_body.write(body)
 
     def on_message_complete(self):
         self._state = REQUEST_STATE_COMPLETE
-        self.raw_body.seek(0)
-        self._parse_body(self.raw_body)
+        if self._raw_body is not None:
+            self._raw_body.seek(0)
 
     @property
     def finished(self):
@@ -1,28 +1,185 @@
+import os
+from datetime import datetime
 from albatross import status_codes
-from albatross.compat import json
+from albatross.codecs import CODECS, JSON_TYPE
 from albatross.data_types import CaselessDict
 from albatross.http_error import HTTPError
 
 
+def cookie_value(key, value):
+    """Serializes a cookie for a Set-Cookie header.
+
+    :param value: the value, or a (value, expiry) tuple, where expiry is a
+        datetime or a max-age in seconds
+    :return: None if the expiry is neither
+    """
+    if isinstance(value, tuple):
+        value, duration = value
+        if isinstance(duration, datetime):
+            format = duration.strftime('%a %d %b %Y %H:%M:%S GMT').encode()
+            return b'%s=%s;expires=%s' % (
+                key.encode(), str(value).encode(), format)
+        elif isinstance(duration, int):
+            return b'%s=%s;max-age=%d' % (
+                key.encode(), str(value).encode(), duration)
+        return None
+    return b'%s=%s' % (key.encode(), str(value).encode())
+
+
 class Response:
     """
     Attributes:
         status_code (str): HTTP status code
         headers (dict): Be careful about case-sensitivity here.
         body (str):
+        trailers (dict): Headers sent after a streamed body
+        started (bool): True once the status and headers have been sent
 
+    A response is buffered and sent when the handler returns, unless the
+    handler streams it with `start` and `send`, or `stream`. The status and
+    headers are then sent straight away, so they can't change later, and
+    the body follows chunk by chunk, waiting whenever the client falls
+    behind.
     """
 
+    __slots__ = (
+        'status_code', '_chunks', 'headers', '_cookies', '_trailers',
+        'started', 'finished', '_on_start', '_writer', '_drain', '_chunked',
+        '_keep_alive', '_encoder', '_variants', '_file', '_sent', '_head',
+        '_codec', '_server',
+        # middleware may still keep its own attributes on a response
+        '__dict__',
+    )
+
     def __init__(self):
-        self.status_code = status_codes.HTTP_200
         self._chunks = []
-        self.headers = CaselessDict([
-            ('Content-Type', 'text/html')
-        ])
-        self.cookies = {}
+        self.headers = CaselessDict()
+        self._file = None
+        self._clear()
+
+    def reset(self):
+        """Returns the response to the state of a new one, so a pooled
+        instance can answer the next request on its connection."""
+        self.clear()
+        self.headers.clear()
+        self.__dict__.clear()
+        self._clear()
+
+    def _clear(self):
+        self.status_code = status_codes.HTTP_200
+        self.headers['content-type'] = 'text/html'
+        # cookies and trailers are rare, so they're made on first use
+        self._cookies = None
+        self._trailers = None
+        self.started = False
+        self.finished = False
+        self._on_start = None
+        self._writer = None
+        self._drain = None
+        self._chunked = False
+        self._keep_alive = False
+        self._encoder = None
+        self._variants = None
+        self._sent = 0
+        self._head = False
+        self._codec = None
+        self._server = None
+
+    @property
+    def cookies(self):
+        if self._cookies is None:
+            self._cookies = {}
+        return self._cookies
+
+    @cookies.setter
+    def cookies(self, value):
+        self._cookies = value
+
+    @property
+    def trailers(self):
+        if self._trailers is None:
+            self._trailers = CaselessDict()
+        return self._trailers
+
+    @trailers.setter
+    def trailers(self, value):
+        self._trailers = value
 
     def clear(self):
         self._chunks = []
+        if self._file is not None:
+            self._file[0].close()
+            self._file = None
+
+    def start(self):
+        """Sends the status and headers; anything already written follows
+        with the next `send` or `finish`."""
+        if self.started:
+            return
+        if self._on_start is None:
+            raise RuntimeError('Response is not attached to a connection')
+        self.started = True
+        self._on_start()
+
+    async def send(self, chunk):
+        """Sends part of the body, starting the response if need be."""
+        self.start()
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        self._chunks.append(chunk)
+        self._flush()
+        await self._drain()
+
+    async def stream(self, iterable):
+        """Sends each chunk of a (async) iterable, then ends the body."""
+        self.start()
+        if hasattr(iterable, '__aiter__'):
+            async for chunk in iterable:
+                await self.send(chunk)
+        else:
+            for chunk in iterable:
+                await self.send(chunk)
+        await self.finish()
+
+    async def finish(self):
+        """Ends a streamed body, sending the trailers."""
+        self.start()
+        if self.finished:
+            return
+        self._flush(final=True)
+        self.finished = True
+        if self._chunked and not self._head:
+            lines = [b'0\r\n']
+            for key, value in (self._trailers or {}).items():
+                lines.append(b'%s: %s\r\n' % (
+                    key.encode(), str(value).encode()))
+            lines.append(b'\r\n')
+            self._writer.write(b''.join(lines))
+        await self._drain()
+
+    def abort(self):
+        """Cuts a streamed response short by closing the connection."""
+        self.finished = True
+        self._keep_alive = False
+        self._writer.close()
+
+    def _flush(self, final=False):
+        chunks, self._chunks = self._chunks, []
+        if self._head:
+            return
+        if self._encoder is not None:
+            chunks = [self._encoder.compress(chunk) for chunk in chunks]
+            if final:
+                chunks.append(self._encoder.finish())
+        for chunk in chunks:
+            if not chunk:
+                continue
+            self._sent += len(chunk)
+            if self._chunked:
+                self._writer.writelines(
+                    [b'%x\r\n' % len(chunk), chunk, b'\r\n'])
+            else:
+                self._writer.write(chunk)
 
     def write(self, string):
         self._chunks.append(string.encode())
@@ -30,9 +187,25 @@ class Response:
     def write_bytes(self, bytes):
         self._chunks.append(bytes)
 
+    def write_file(self, file, offset=0, count=None):
+        """Sends part of an open file as the body, with sendfile where the
+        platform allows. The file is closed once it has been sent.
+
+        :param file: a file opened in binary mode
+        :param count: bytes to send, by default up to the end of the file
+        """
+        if count is None:
+            count = os.fstat(file.fileno()).st_size - offset
+        self.clear()
+        self._file = (file, offset, count)
+
     def write_json(self, data):
-        self.headers['Content-Type'] = 'application/json'
-        self._chunks.append(json.dumps(data).encode())
+        """Writes data encoded by the route's JSON codec, or the server's."""
+        codec = self._codec
+        if codec is None:
+            codec = CODECS[JSON_TYPE]
+        self.headers['Content-Type'] = JSON_TYPE
+        self._chunks.append(codec.dumps(data))
 
     def redirect(self, location, permanent=False):
         self.headers['Location'] = location
@@ -0,0 +1,147 @@
+import re
+from collections import OrderedDict
+
+
+PARAM_SEGMENT = re.compile('{([-_a-zA-Z]+)}$')
+PLACEHOLDER = re.compile('{([-_a-zA-Z]+)}')
+REGEX_CHARS = frozenset('.^$*+?{}[]\\|()')
+NO_MATCH = (float('inf'), None, (), None, ())
+
+
+class _Node:
+    __slots__ = ('static', 'param', 'route', 'min_index')
+
+    def __init__(self):
+        self.static = {}
+        self.param = None
+        self.route = None
+        self.min_index = NO_MATCH[0]
+
+
+class Router:
+    """Maps request paths to handlers.
+
+    Templates made of static segments and whole-segment `{name}`
+    placeholders are compiled into a segment trie, so a lookup only walks
+    the path once instead of trying every route. Anything else, including
+    every `add_regex`, is matched with a regex as before. The first route
+    registered that matches a path always wins, whichever kind it is.
+
+    Attributes:
+        cache_size (int): when positive, the results for this many recently
+            looked up paths are kept, which pays off for hot static paths
+    """
+
+    def __init__(self, cache_size=0):
+        self._root = _Node()
+        self._regexes = []
+        self._count = 0
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def add(self, template, handler):
+        names = PLACEHOLDER.findall(template)
+        for name in names:
+            if names.count(name) > 1:
+                raise ValueError(
+                    'Route %r uses the parameter %r more than once' % (
+                        template, name))
+        segments = template.split('/')
+        if not all(PARAM_SEGMENT.match(s) or REGEX_CHARS.isdisjoint(s)
+                   for s in segments):
+            route = PLACEHOLDER.sub('(?P<\\g<1>>[^/?]+)', template)
+            return self.add_regex(route, handler, template)
+
+        index = self._next_index()
+        node = self._root
+        names = []
+        for segment in segments:
+            node.min_index = min(node.min_index, index)
+            param = PARAM_SEGMENT.match(segment)
+            if param:
+                names.append(param.group(1))
+                if node.param is None:
+                    node.param = _Node()
+                node = node.param
+            else:
+                node = node.static.setdefault(segment, _Node())
+        node.min_index = min(node.min_index, index)
+        if node.route is None:
+            node.route = (index, handler, tuple(names), template)
+
+    def add_regex(self, route, handler, template=None):
+        compiled = re.compile(route + '$')
+        self._regexes.append(
+            (self._next_index(), compiled, handler, template or route))
+
+    def get(self, path):
+        """
+        :param path:
+        :return: the handler and a dict of named parameters, or
+            (None, None) if no route matches
+        """
+        return self.match(path)[:2]
+
+    def match(self, path):
+        """
+        :param path:
+        :return: the handler, a dict of named parameters and the template
+            the route was registered with, or (None, None, None)
+        """
+        if self.cache_size:
+            cached = self._cache.get(path)
+            if cached is not None:
+                self._cache.move_to_end(path)
+                handler, args, template = cached
+                if args is not None:
+                    args = dict(args)
+                return handler, args, template
+
+        handler, args, template = self._lookup(path)
+
+        if self.cache_size:
+            self._cache[path] = handler, args, template
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            if args is not None:
+                args = dict(args)
+        return handler, args, template
+
+    def _next_index(self):
+        self._cache.clear()
+        self._count += 1
+        return self._count
+
+    def _lookup(self, path):
+        index, handler, names, template, values = self._search(
+            self._root, path.split('/'), 0, [], NO_MATCH)
+
+        for regex_index, compiled, regex_handler, regex in self._regexes:
+            if regex_index > index:
+                break
+            match = compiled.match(path)
+            if match:
+                return regex_handler, match.groupdict(), regex
+
+        if handler is None:
+            return None, None, None
+        return handler, dict(zip(names, values)), template
+
+    def _search(self, node, segments, depth, values, best):
+        if node.min_index >= best[0]:
+            return best
+        if depth == len(segments):
+            route = node.route
+            if route is not None and route[0] < best[0]:
+                return route + (tuple(values),)
+            return best
+
+        segment = segments[depth]
+        child = node.static.get(segment)
+        if child is not None:
+            best = self._search(child, segments, depth + 1, values, best)
+        if node.param is not None and segment and '?' not in segment:
+            values.append(segment)
+            best = self._search(node.param, segments, depth + 1, values, best)
+            values.pop()
+        return best
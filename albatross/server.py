@@ -1,170 +1,925 @@
-import re
 import asyncio
-from datetime import datetime
-from albatross import Request, Response
-from albatross.status_codes import HTTP_404, HTTP_500, HTTP_405
+import signal
+import time
+import warnings
+from albatross import Response, status_codes
+from albatross.codecs import JSON_TYPE, default_codecs
+from albatross.compat import h2
+from albatross.response import cookie_value
+from albatross.parser import RequestParser
+from albatross.protocol import HttpProtocol
+from albatross.dispatch import Endpoint
+from albatross.middleware import MiddlewareChain
+from albatross.executor import OFFLOAD_BODY_SIZE, Executor
+from albatross.http2 import Http2Connection, is_h2c_upgrade
+from albatross.limits import LINGER_TIMEOUT, Limiter
+from albatross.request import BODY_SPOOL_SIZE
+from albatross.router import Router
+from albatross.static import send_file
+from albatross.websocket import (
+    CLOSE_INTERNAL_ERROR, WebSocket, handshake, is_websocket_request)
+from albatross.workers import Supervisor
+from albatross.status_codes import (
+    HTTP_101, HTTP_400, HTTP_404, HTTP_405, HTTP_408, HTTP_426, HTTP_500,
+    HTTP_503)
 from albatross.http_error import HTTPError
-from httptools import HttpRequestParser
+from httptools import HttpParserError
 import traceback
 
 
+STATUS_LINES = {
+    code: b'HTTP/1.1 %s\r\n' % code.encode()
+    for name, code in vars(status_codes).items() if name.startswith('HTTP_')
+}
+HEADER_NAMES = {
+    name: name.encode() + b': ' for name in (
+        'content-type', 'content-length', 'connection', 'location',
+        'cache-control', 'etag', 'last-modified', 'date', 'server',
+        'allow', 'vary', 'content-encoding', 'transfer-encoding',
+        'accept-ranges', 'content-range', 'retry-after',
+    )
+}
+READ_LIMIT = 2 ** 16
+# responses up to this size are sent with a single write
+SINGLE_WRITE_LIMIT = 2 ** 16
+# parsers kept for new connections, when pooling objects
+PARSER_POOL_SIZE = 256
+
+
+def joins_writelines(writer):
+    """Whether the writer's transport copies what `writelines` is given
+    into one buffer before sending it, as asyncio's socket transports do
+    before Python 3.12, so large bodies are better written chunk by chunk.
+    """
+    transport = getattr(writer, 'transport', None)
+    return (getattr(type(transport), 'writelines', None) is
+            asyncio.WriteTransport.writelines)
+
+
+def format_cookie(key, value):
+    cookie = cookie_value(key, value)
+    return b'Set-Cookie: %s\r\n' % cookie if cookie is not None else b''
+
+
 def write_cookie(writer, key, value):
-    if isinstance(value, tuple):
-        value, duration = value
-        if isinstance(duration, datetime):
-            format = duration.strftime('%a %d %b %Y %H:%M:%S GMT').encode()
-            writer.write(b'Set-Cookie: %s=%s;expires=%s\r\n' % (
-                key.encode(), str(value).encode(), format)
-            )
-        elif isinstance(duration, int):
-            writer.write(b'Set-Cookie: %s=%s;max-age=%d\r\n' % (
-                key.encode(), str(value).encode(), duration)
-            )
-    else:
-        writer.write(b'Set-Cookie: %s=%s\r\n' % (
-            key.encode(), str(value).encode())
-        )
+    """Writes a Set-Cookie header line to `writer`.
+
+    Deprecated: responses are serialized into one buffer now, with the
+    line from `format_cookie`.
+    """
+    warnings.warn('write_cookie is deprecated, use format_cookie',
+                  DeprecationWarning, stacklevel=2)
+    line = format_cookie(key, value)
+    if line:
+        writer.write(line)
 
 
 class Server:
     """The core albatross server
 
     Attributes:
-        _handlers (list): a list of route-handler tuples
-        _middleware (list): a list of middlewares to process requests
+        _router (Router): maps request paths to handlers
+        _middleware (MiddlewareChain): the middleware every request runs
+            through
+        keep_alive_timeout (float): seconds an idle keep-alive connection
+            is held open waiting for the next request
+        max_keep_alive_requests (int): requests served on one connection
+            before it is closed
+        engine (str): 'stream' serves connections through asyncio streams,
+            'protocol' feeds the parser straight from an asyncio.Protocol
+        route_cache_size (int): number of recent path lookups to remember
+        max_body_size (int): requests with larger bodies get a 413
+        body_spool_size (int): buffered bodies larger than this are kept in
+            a temp file instead of memory
+        compression (Compression): compresses responses for clients that
+            accept it, if set
+        metrics (Metrics): times each phase of every request, if set
+        max_connections (int): connections served at once; more wait
+            unread in a queue of `connection_queue_size`, and beyond that
+            are answered with 503
+        max_in_flight (int): requests handled at once across all
+            connections; more wait in a queue of `request_queue_size`, and
+            beyond that are answered with 503
+        retry_after (int): seconds sent in Retry-After with those 503s
+        header_timeout (float): seconds a client has to send a request's
+            headers, so slow clients can't hold connections open
+        body_timeout (float): seconds a client has to send a request's
+            body once its headers have arrived
+        handler_timeout (float): seconds a handler may run before the
+            request is answered with 503, unless it has started streaming
+            its response by then
+        write_timeout (float): seconds a response may wait for a slow
+            client to read it before the connection is closed
+        shutdown_timeout (float): seconds in-flight requests get to finish
+            after SIGTERM or SIGINT before their connections are closed
+        pool_objects (bool): reuse each connection's Request and Response
+            objects once a request has been answered, and the parsers of
+            closed connections for new ones, instead of allocating them
+            anew. Handlers and middleware must then not hold on to a
+            request or response after it has been answered.
+        websocket_max_size (int): WebSocket messages larger than this close
+            the connection
+        websocket_ping_interval (float): seconds between pings sent on each
+            WebSocket; one that goes unanswered until the next closes it
+        http2 (bool): also serve cleartext HTTP/2 (h2c), to clients that
+            connect with prior knowledge or upgrade with `Upgrade: h2c`.
+            Needs the h2 package.
+        executor (Executor): the thread and process pools that offloaded
+            handler methods and large bodies are run in; one with the
+            default pools is made if none is given
+        offload_body_size (int): bodies with a codec, such as JSON, larger
+            than this are parsed in the executor before handlers with a
+            true `offload_form` attribute run, or None to always parse
+            them on the event loop
+        codecs (dict): media type -> codec that parses request bodies of
+            that type into `req.form`. The codec for 'application/json'
+            also serializes `res.write_json`. Defaults to orjson when it is
+            installed, the json module otherwise.
+
+    Requests that exceed the header or body timeout get a 408.
+
+    On SIGTERM or SIGINT the server stops accepting connections, closes
+    idle ones, lets in-flight requests finish with `Connection: close`,
+    then runs `shutdown` before exiting.
+
+    Middleware can answer a request itself by returning True from
+    `process_request`; the handler and later middleware are then skipped.
+    Middleware may define only one of `process_request` and
+    `process_response`, and only those it defines are called. Handlers
+    with a `middleware` attribute have that middleware run after the
+    server's, for their requests only.
+
+    Handlers with a true `stream_body` attribute are called as soon as the
+    request headers arrive, and read the body with `await req.read(n)` or
+    `async for chunk in req.body`.
+
+    WebSocket upgrade requests are handed to the handler's
+    `on_websocket(req, ws)` coroutine, with a `WebSocket` to receive and
+    send messages on. The WebSocket is closed when it returns. On shutdown
+    open WebSockets are closed with 1001.
+
+    Over HTTP/2 the requests of a connection are handled concurrently, each
+    on its own stream, with the same handlers and middleware. On shutdown
+    HTTP/2 connections are sent GOAWAY and closed once their open streams
+    are answered.
     """
-    def __init__(self):
-        self._handlers = []
-        self._middleware = []
+    def __init__(self, keep_alive_timeout=75, max_keep_alive_requests=1000,
+                 engine='stream', route_cache_size=0, max_body_size=None,
+                 body_spool_size=BODY_SPOOL_SIZE, compression=None,
+                 metrics=None, max_connections=None, connection_queue_size=0,
+                 max_in_flight=None, request_queue_size=0, retry_after=1,
+                 header_timeout=None, body_timeout=None, handler_timeout=None,
+                 write_timeout=None, shutdown_timeout=30,
+                 pool_objects=False, websocket_max_size=2 ** 20,
+                 websocket_ping_interval=20, http2=False, executor=None,
+                 offload_body_size=OFFLOAD_BODY_SIZE, codecs=None):
+        if http2 and h2 is None:
+            raise RuntimeError(
+                'HTTP/2 needs the h2 package: pip3 install albatross3[h2]')
+        self._router = Router(cache_size=route_cache_size)
+        self._middleware = MiddlewareChain()
         self.spoof_options = True
+        self.engine = engine
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_keep_alive_requests = max_keep_alive_requests
+        self.max_body_size = max_body_size
+        self.body_spool_size = body_spool_size
+        self.compression = compression
+        self.metrics = metrics
+        self._connections = None
+        if max_connections is not None:
+            self._connections = Limiter(max_connections, connection_queue_size)
+        self._in_flight = None
+        if max_in_flight is not None:
+            self._in_flight = Limiter(max_in_flight, request_queue_size)
+        self.retry_after = retry_after
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.handler_timeout = handler_timeout
+        self.write_timeout = write_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.pool_objects = pool_objects
+        self.websocket_max_size = websocket_max_size
+        self.websocket_ping_interval = websocket_ping_interval
+        self.http2 = http2
+        self.executor = executor if executor is not None else Executor()
+        self.offload_body_size = offload_body_size
+        self.codecs = default_codecs()
+        if codecs:
+            self.codecs.update(codecs)
+        if metrics is not None:
+            metrics.executor = self.executor
+        self._parsers = []
+        self._websockets = set()
+        self._event_streams = set()
+        self._http2_connections = set()
+        self._open = set()
+        self._idle = set()
+        self._fresh = set()
+        self._draining = False
+        self._drained = None
 
     def get_handler(self, path):
-        for route, handler in self._handlers:
-            match = route.match(path)
-            if match:
-                return handler, match.groupdict()
-        return None, None
+        endpoint, args = self._router.get(path)
+        return (endpoint.handler if endpoint is not None else None), args
 
     def add_regex_route(self, route, handler):
-        route += '$'
-        compiled = re.compile(route)
-        self._handlers.append((compiled, handler))
+        self._router.add_regex(route, Endpoint(handler, self.executor))
 
     def add_route(self, route, handler):
-        route = re.sub('{([-_a-zA-Z]+)}', '(?P<\g<1>>[^/?]+)', route)
-        self.add_regex_route(route, handler)
+        self._router.add(route, Endpoint(handler, self.executor))
+
+    def add_codec(self, media_type, codec):
+        """Parses request bodies of a media type with codec, an object
+        with `loads(bytes)` and `dumps(data) -> bytes`."""
+        self.codecs[media_type] = codec
 
     def add_middleware(self, middleware):
-        self._middleware.append(middleware)
-
-    async def _parse_request(self, request_reader, response_writer):
-        limit = 2 ** 16
-        req = Request()
-        parser = HttpRequestParser(req)
-
-        while True:
-            data = await request_reader.read(limit)
-            parser.feed_data(data)
-            if req.finished or not data:
-                break
-            elif req.needs_write_continue:
-                response_writer.write(b'HTTP/1.1 100 (Continue)\r\n\r\n')
-                req.reset_state()
-
-        if req.path is None:
-            # connected without a formed HTTP request
+        self._middleware = MiddlewareChain(
+            self._middleware.middleware + (middleware,))
+
+    def _chain(self, endpoint):
+        """The middleware a request for endpoint runs through."""
+        chain = self._middleware
+        if endpoint is None or not endpoint.middleware:
+            return chain
+        route_chain = endpoint.chain
+        if route_chain is None or route_chain.parent is not chain:
+            # made again whenever the server's middleware changes
+            route_chain = endpoint.chain = chain.extend(endpoint.middleware)
+        return route_chain
+
+    def _make_parser(self, on_request=None, body_options=None):
+        if self._parsers:
+            parser = self._parsers.pop()
+            parser.reset(on_request, body_options)
+            return parser
+        return RequestParser(
+            on_request=on_request,
+            on_headers=self._route,
+            max_body_size=self.max_body_size,
+            spool_size=self.body_spool_size,
+            body_options=body_options,
+            clock=self.metrics.clock if self.metrics is not None else None,
+            pool=self.pool_objects,
+            http2=self.http2,
+            offload_size=self.offload_body_size,
+            codecs=self.codecs,
+        )
+
+    def _recycle_parser(self, parser):
+        """Keeps the parser of a connection that closed between requests,
+        for a new connection to use."""
+        if self.pool_objects and len(self._parsers) < PARSER_POOL_SIZE:
+            self._parsers.append(parser)
+
+    def _route(self, req):
+        """Looks up the handler once the request headers are parsed.
+
+        :return: True if the handler streams the request body
+        """
+        timings = req._timings
+        if timings is not None:
+            start = self.metrics.clock()
+        endpoint, req.args, req.route = self._router.match(req.path)
+        req._endpoint = endpoint
+        req._handler = endpoint.handler if endpoint is not None else None
+        if timings is not None:
+            timings['route'] = self.metrics.clock() - start
+        if self.body_timeout is not None:
+            req._deadline = time.monotonic() + self.body_timeout
+        else:
+            req._deadline = None
+        if (self.http2 and req.http_version == '1.1' and
+                is_h2c_upgrade(req)):
+            # the body becomes the HTTP/2 connection
+            req._http2 = True
+            return True
+        if endpoint is None:
+            return False
+        if endpoint.websocket is not None and is_websocket_request(req):
+            # the body becomes the stream of WebSocket frames
+            req._websocket = True
+            return True
+        return endpoint.stream_body
+
+    def _read_timeout(self, parser):
+        """How long to wait for the next data on a connection."""
+        req = parser.current
+        if req is None:
+            if parser.upgraded is not None:
+                # the new protocol keeps itself alive
+                return None
+            # idle between requests, so the keep-alive timeout applies
+            return self.keep_alive_timeout
+        if req._deadline is None:
+            return None
+        return max(req._deadline - time.monotonic(), 0)
+
+    async def _read_requests(self, parser, request_reader, response_writer,
+                             fresh=False):
+        """Reads from the connection until a request is ready to handle.
+
+        :param fresh: True if no request has been read on it yet
+        :return: False if the client closed the connection first.
+        """
+        while not parser.requests:
+            # every response before it has been sent
+            self._write_continue(parser.current, response_writer)
+            idle = parser.current is None
+            if idle:
+                self._set_idle(response_writer, True, fresh)
+            try:
+                data = await asyncio.wait_for(
+                    request_reader.read(READ_LIMIT),
+                    self._read_timeout(parser))
+            finally:
+                if idle:
+                    self._set_idle(response_writer, False)
+            if not data:
+                return False
+            self._feed(parser, data, response_writer)
+        return True
+
+    def _feed(self, parser, data, response_writer, busy=False):
+        """Parses data received on a connection.
+
+        :param busy: True while a response is being sent on it
+        """
+        parser.feed_data(data)
+        req = parser.current
+        if req is None:
             return
+        if (req.method is None and req._deadline is None and
+                self.header_timeout is not None):
+            # the headers have started arriving
+            req._deadline = time.monotonic() + self.header_timeout
+        if not busy and not parser.requests:
+            self._write_continue(req, response_writer)
 
-        handler, args = self.get_handler(req.path)
+    def _write_continue(self, req, writer):
+        """Tells a client waiting to send a request body to go ahead.
 
-        req.method = parser.get_method().decode().upper()
-        req.args = args
-        return req, handler
+        Only called once the responses to the requests before it have
+        been sent, so the 100 can't land in the middle of one. Requests
+        already refused, e.g. with 413, never get one.
+        """
+        if (req is not None and req.needs_write_continue and
+                req.error is None):
+            writer.write(b'HTTP/1.1 100 (Continue)\r\n\r\n')
+            req.reset_state()
 
-    async def _route_request(self, handler, req, res):
-        method = req.method
-        if handler is None:
+    async def _dispatch(self, req, res):
+        """Calls the handler's coroutine for the request method."""
+        endpoint = req._endpoint
+        if endpoint is None:
             raise HTTPError(HTTP_404)
-        elif method == 'GET' and hasattr(handler, 'on_get'):
-            await handler.on_get(req, res)
-        elif method == 'POST' and hasattr(handler, 'on_post'):
-            await handler.on_post(req, res)
-        elif method == 'PUT' and hasattr(handler, 'on_put'):
-            await handler.on_put(req, res)
-        elif method == 'DELETE' and hasattr(handler, 'on_delete'):
-            await handler.on_delete(req, res)
-        elif method == 'OPTIONS':
-            if hasattr(handler, 'on_options'):
-                await handler.on_options(req, res)
-            elif self.spoof_options:
-                res.headers['Allow'] = 'GET,POST,DELETE,PUT'
-            else:
-                raise HTTPError(HTTP_405)
+        if req._websocket:
+            await self._accept_websocket(req, res, endpoint.websocket)
+            return
+        method = endpoint.methods.get(req.method)
+        if method is not None:
+            await method(req, res)
+        elif req.method == 'OPTIONS' and self.spoof_options:
+            res.headers['Allow'] = endpoint.allow_options
+        elif endpoint.websocket is not None and req.method == 'GET':
+            res.headers['Upgrade'] = 'websocket'
+            raise HTTPError(HTTP_426)
         else:
+            res.headers['Allow'] = (
+                endpoint.allow_options if self.spoof_options else
+                endpoint.allow)
             raise HTTPError(HTTP_405)
 
     async def _handle(self, request_reader, response_writer):
         """Takes reader and writer from asyncio loop server and
-        writes the response to the request.
+        writes the responses to the requests sent on the connection.
+
+        The connection is kept open between requests while both sides
+        allow it, and pipelined requests are answered in order.
 
         :param request_reader:
         :param response_writer:
         :return:
         """
-        res = Response()
+        async def fill():
+            # streamed bodies are read from the socket only when the
+            # handler asks for more, which keeps them out of memory
+            try:
+                data = await asyncio.wait_for(
+                    request_reader.read(READ_LIMIT),
+                    self._read_timeout(parser))
+            except asyncio.TimeoutError:
+                raise HTTPError(HTTP_408)
+            if not data:
+                raise ConnectionResetError('Connection lost mid-request')
+            self._feed(parser, data, response_writer, busy=True)
 
+        if (self._connections is not None and
+                not await self._connections.acquire()):
+            try:
+                await self._shed(response_writer)
+                await self._linger(request_reader, response_writer)
+            except ConnectionError:
+                pass
+            response_writer.close()
+            return
+
+        parser = self._make_parser(body_options={'fill': fill})
+        served = 0
+        clean = False
+        self._open.add(response_writer)
         try:
-            req, handler = await self._parse_request(
-                request_reader, response_writer)
+            while True:
+                try:
+                    if not await self._read_requests(
+                            parser, request_reader, response_writer,
+                            served == 0):
+                        clean = parser.current is None
+                        break
+                except asyncio.TimeoutError:
+                    if parser.current is not None:
+                        await self._reject(response_writer, HTTP_408)
+                    break
+                except ConnectionError:
+                    break
+                except HttpParserError:
+                    await self._reject(response_writer, HTTP_400)
+                    break
+
+                req = parser.requests.popleft()
+                served += 1
+                if not await self._send_response(req, response_writer, served):
+                    if req.error is not None and parser.current is req:
+                        # refused before its body arrived, which the client
+                        # may still be sending
+                        await self._linger(request_reader, response_writer)
+                    break
+                parser.release(req)
+        except ConnectionError:
+            pass
+        finally:
+            response_writer.close()
+            self._connection_closed(response_writer)
+            if clean:
+                self._recycle_parser(parser)
+            if self._connections is not None:
+                self._connections.release()
 
-            for middleware in self._middleware:
-                await middleware.process_request(req, res, handler)
+    def _set_idle(self, writer, idle, fresh=False):
+        """Tracks whether a connection is waiting for its next request, so
+        it can be closed straight away on shutdown.
+
+        A fresh connection, which has yet to send its first request, was
+        likely accepted just as shutdown began, with the request on its
+        way. It gets `LINGER_TIMEOUT` to send it instead.
+        """
+        if not idle:
+            self._idle.discard(writer)
+            self._fresh.discard(writer)
+        elif fresh:
+            self._fresh.add(writer)
+            if self._draining:
+                asyncio.get_event_loop().call_later(
+                    LINGER_TIMEOUT, self._close_fresh, writer)
+        elif self._draining:
+            writer.close()
+        else:
+            self._idle.add(writer)
 
+    def _close_fresh(self, writer):
+        if writer in self._fresh:
+            writer.close()
+
+    def _connection_closed(self, writer):
+        self._open.discard(writer)
+        self._idle.discard(writer)
+        self._fresh.discard(writer)
+        if self._drained is not None and not self._open:
+            self._drained.set()
+
+    async def _send_response(self, req, writer, served):
+        """Responds to a request on a connection.
+
+        :param served: number of requests seen on the connection so far
+        :return: True if the connection can be reused for another request
+        """
+        if req._http2:
+            await self._serve_http2(req, writer)
+            return False
+        if self._in_flight is not None:
+            if not await self._in_flight.acquire():
+                await self._shed(writer)
+                return False
             try:
-                await self._route_request(handler, req, res)
-            except HTTPError as e:
-                self.handle_error(res, e)
+                return await self._send_admitted(req, writer, served)
+            finally:
+                self._in_flight.release()
+        return await self._send_admitted(req, writer, served)
+
+    async def _send_admitted(self, req, writer, served):
+        if req.body is not None:
+            # a streamed body is read once the handler runs
+            self._write_continue(req, writer)
+        res = req._response
+        if res is None:
+            res = Response()
+            if self.pool_objects:
+                # reset and reused along with the request
+                req._response = res
+        res._on_start = lambda: self._start_response(req, res, writer, served)
+        res._writer = writer
+        res._drain = lambda: self._drain(writer)
+        # HEAD responses get the headers a GET would, without the body
+        res._head = req.method == 'HEAD'
+        metrics = self.metrics
+        trace = metrics.start(req) if metrics is not None else None
+        try:
+            await self._respond(req, res, trace)
 
-            for middleware in self._middleware:
-                await middleware.process_response(req, res, handler)
+            if res.started:
+                # the handler streamed its body; close it off if it didn't
+                await res.finish()
+                return res._keep_alive
+
+            keep_alive = self._keep_alive(req, res, served)
+            if res._file is not None:
+                await self._write_file_response(res, writer, keep_alive)
+                return keep_alive
+            if trace is not None:
+                start = metrics.clock()
+            if self.compression is not None:
+                self.compression.compress_response(req, res)
+            self._write_response(res, writer, keep_alive)
+            if trace is not None:
+                end = metrics.clock()
+                trace.phases['serialize'] = end - start
+            await self._drain(writer)
+            if trace is not None:
+                trace.phases['drain'] = metrics.clock() - end
+            return keep_alive
+        finally:
+            if trace is not None:
+                trace.bytes_out = res._sent
+                metrics.finish(trace, res)
+
+    async def _accept_websocket(self, req, res, on_websocket):
+        """Completes the WebSocket handshake and runs the handler."""
+        handshake(req, res)
+        res.status_code = HTTP_101
+        res.started = res.finished = True
+        head = b''.join(self._head_lines(res))
+        res._sent += len(head)
+        res._writer.write(head)
+        ws = WebSocket(req.body, res._writer, res._drain,
+                       self.websocket_max_size, self.websocket_ping_interval)
+        self._websockets.add(ws)
+        try:
+            await res._drain()
+            ws.start()
+            await on_websocket(req, ws)
+            await ws.close()
+        except ConnectionError:
+            pass
+        except Exception:
+            await ws.close(CLOSE_INTERNAL_ERROR)
+            raise
+        finally:
+            self._websockets.discard(ws)
+            ws._abort()
+
+    async def _serve_http2(self, req, writer):
+        """Serves a connection that switched to HTTP/2, after answering
+        the request that upgraded it with 101."""
+        if req.method is not None:
+            writer.write(b'HTTP/1.1 101 Switching Protocols\r\n'
+                         b'Connection: Upgrade\r\nUpgrade: h2c\r\n\r\n')
+        connection = Http2Connection(self, req.body, writer)
+        self._http2_connections.add(connection)
+        try:
+            await connection.run(req)
+        finally:
+            self._http2_connections.discard(connection)
+
+    def _keep_alive(self, req, res, served):
+        return (
+            req.keep_alive and
+            (req.body is None or req.body.complete) and
+            served < self.max_keep_alive_requests and
+            not self._draining and
+            res.headers.get('Connection', '').lower() != 'close'
+        )
+
+    def _start_response(self, req, res, writer, served):
+        """Sends the status line and headers of a streamed response.
+
+        The body is sent with chunked transfer encoding unless the handler
+        set Content-Length. HTTP/1.0 clients can't read chunks, so their
+        body ends when the connection is closed instead.
+        """
+        if self.compression is not None:
+            self.compression.start_stream(req, res)
+        keep_alive = self._keep_alive(req, res, served)
+        chunked = 'Content-Length' not in res.headers
+        if chunked and req.http_version == '1.0':
+            chunked = keep_alive = False
+        elif chunked:
+            res.headers['Transfer-Encoding'] = 'chunked'
+            if res._trailers:
+                res.headers['Trailer'] = ', '.join(res._trailers)
+        res.headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        res._chunked = chunked
+        res._keep_alive = keep_alive
+        head = b''.join(self._head_lines(res))
+        res._sent += len(head)
+        writer.write(head)
+
+    async def _reject(self, writer, status_code):
+        """Answers a request that could not be parsed."""
+        res = Response()
+        self.handle_error(res, HTTPError(status_code))
+        self._write_response(res, writer, False)
+        await self._drain(writer)
+
+    async def _shed(self, writer):
+        """Turns a request or connection away while the server is full."""
+        res = Response()
+        res.status_code = HTTP_503
+        res.headers['Retry-After'] = str(self.retry_after)
+        res.write(HTTP_503)
+        self._write_response(res, writer, False)
+        await self._drain(writer)
+
+    async def _linger(self, reader, writer):
+        """Discards what the client still sends until it closes, for a
+        moment. Closing a socket with unread data resets it, which can
+        lose the response before the client reads it."""
+        writer.write_eof()
+
+        async def discard():
+            while await reader.read(READ_LIMIT):
+                pass
+        try:
+            await asyncio.wait_for(discard(), LINGER_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _drain(self, writer):
+        if self.write_timeout is None:
+            await writer.drain()
+            return
+        try:
+            await asyncio.wait_for(writer.drain(), self.write_timeout)
+        except asyncio.TimeoutError:
+            writer.close()
+            raise ConnectionResetError('Timed out writing to the client')
+
+    async def _respond(self, req, res, trace=None):
+        """Runs the middleware and handler for a parsed request.
+
+        :param req:
+        :param res: the Response to fill in
+        :param trace: the Trace to record phase timings in, if any
+        """
+        try:
+            handler = req._handler
+            res._codec = req._codec(JSON_TYPE)
+            res._server = self
+            if req.error is not None:
+                raise req.error
+            endpoint = req._endpoint
+            if (endpoint is not None and endpoint.offload_form and
+                    req._offload_form()):
+                # a large body would stall every other connection while
+                # it is parsed
+                await self.executor.run_in_thread(lambda: req.form)
+
+            if trace is not None:
+                clock = self.metrics.clock
+                start = clock()
+            answered = False
+            chain = self._chain(req._endpoint)
+            responses = chain.responses
+            # WebSockets stay open as long as the handler runs
+            timeout = None if req._websocket else self.handler_timeout
+            for process_request, answered_responses in chain.requests:
+                if await process_request(req, res, handler):
+                    # the middleware answered, e.g. from a cache, so the
+                    # handler and later middleware are skipped
+                    answered = True
+                    responses = answered_responses
+                    break
+
+            if trace is not None:
+                handler_start = clock()
+            if not answered:
+                try:
+                    if timeout is None:
+                        await self._dispatch(req, res)
+                    else:
+                        await self._run_with_timeout(req, res)
+                except Exception as e:
+                    # answered with the error, and the middleware that ran
+                    # still sees the response, to release what it holds
+                    self.handle_error(res, e)
+
+            if trace is not None:
+                handler_end = clock()
+            for process_response in responses:
+                await process_response(req, res, handler)
+            if trace is not None:
+                phases = trace.phases
+                phases['handler'] = handler_end - handler_start
+                phases['middleware'] = (
+                    handler_start - start + clock() - handler_end)
         except Exception as e:
             self.handle_error(res, e)
+        finally:
+            finalizers = req._finalizers
+            if finalizers is not None:
+                req._finalizers = None
+                for finalize in finalizers:
+                    finalize()
 
-        self._write_response(res, response_writer)
-        await response_writer.drain()
-        response_writer.close()
+    async def _run_with_timeout(self, req, res):
+        task = asyncio.ensure_future(self._dispatch(req, res))
+        try:
+            done, _ = await asyncio.wait(
+                (task,), timeout=self.handler_timeout)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        if done:
+            return task.result()
+        if res.started:
+            # a handler streaming its response, e.g. events, runs until
+            # it finishes or the client goes away
+            return await task
+        task.cancel()
+        raise HTTPError(HTTP_503)
 
     def handle_error(self, res, e):
-        res.clear()
-        if isinstance(e, HTTPError):
-            res.status_code = e.status_code
-            res.write(e.message)
+        if res.started:
+            # the status and headers are already sent, so the response
+            # can only be cut short
+            res.abort()
         else:
-            res.status_code = HTTP_500
-            res.write(res.status_code)
+            res.clear()
+            if isinstance(e, HTTPError):
+                res.status_code = e.status_code
+                res.write(e.message)
+            else:
+                res.status_code = HTTP_500
+                res.write(res.status_code)
         traceback.print_exc()
 
-    def _write_response(self, res, writer):
-        writer.write(b'HTTP/1.1 %s\r\n' % res.status_code.encode())
-        if 'Content-Length' not in res.headers:
-            length = sum(len(x) for x in res._chunks)
-            res.headers['Content-Length'] = str(length)
+    def _head_lines(self, res):
+        """Serializes the status line, headers and cookies."""
+        status_line = STATUS_LINES.get(res.status_code)
+        if status_line is None:
+            status_line = b'HTTP/1.1 %s\r\n' % res.status_code.encode()
+        lines = [status_line]
         for key, value in res.headers.items():
-            writer.write(key.encode() + b': ' + str(value).encode() + b'\r\n')
-        for key, value in res.cookies.items():
-            write_cookie(writer, key, value)
-        writer.write(b'\r\n')
-        for chunk in res._chunks:
-            writer.write(chunk)
-        writer.write_eof()
+            name = HEADER_NAMES.get(key)
+            if name is None:
+                name = key.encode() + b': '
+            lines.append(name)
+            lines.append(str(value).encode())
+            lines.append(b'\r\n')
+        if res._cookies:
+            for key, value in res._cookies.items():
+                lines.append(format_cookie(key, value))
+        lines.append(b'\r\n')
+        return lines
+
+    def _write_response(self, res, writer, keep_alive=False):
+        """Serializes the status line and headers into one buffer and sends
+        it with the body in a single write, or a single writelines for a
+        large body where that doesn't join it into one copy."""
+        headers = res.headers
+        chunks = res._chunks
+        length = sum(len(x) for x in chunks)
+        headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        if 'Content-Length' not in headers:
+            headers['Content-Length'] = str(length)
+        if res._head:
+            chunks = []
+            length = 0
+
+        lines = self._head_lines(res)
+        if length <= SINGLE_WRITE_LIMIT:
+            lines.extend(chunks)
+            data = b''.join(lines)
+            res._sent += len(data)
+            writer.write(data)
+        else:
+            # large bodies are not copied into the header buffer
+            head = b''.join(lines)
+            res._sent += len(head) + length
+            if joins_writelines(writer):
+                writer.write(head)
+                for chunk in chunks:
+                    writer.write(chunk)
+            else:
+                writer.writelines([head] + chunks)
+
+    async def _write_file_response(self, res, writer, keep_alive=False):
+        """Sends the status line and headers, then the file body set with
+        `write_file`, closing the file afterwards."""
+        file, offset, count = res._file
+        res._file = None
+        try:
+            res.headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+            res.headers['Content-Length'] = str(count)
+            head = b''.join(self._head_lines(res))
+            res._sent += len(head)
+            writer.write(head)
+            await self._drain(writer)
+            if not res._head:
+                await send_file(writer, file, offset, count)
+                res._sent += count
+        finally:
+            file.close()
 
     async def initialize(self):
         pass
 
-    def serve(self, port=8000, host='0.0.0.0'):
+    async def shutdown(self):
+        pass
+
+    async def _shutdown_gracefully(self, server):
+        """Stops accepting connections and lets open ones finish, closing
+        those still open after `shutdown_timeout`."""
+        self._draining = True
+        self._drained = asyncio.Event()
+        server.close()
+        for writer in list(self._idle):
+            writer.close()
         loop = asyncio.get_event_loop()
-        loop.run_until_complete(self.initialize())
+        for writer in list(self._fresh):
+            loop.call_later(LINGER_TIMEOUT, self._close_fresh, writer)
+        for ws in list(self._websockets):
+            ws._going_away()
+        for stream in list(self._event_streams):
+            stream._going_away()
+        for connection in list(self._http2_connections):
+            connection._going_away()
+        if self._open:
+            try:
+                await asyncio.wait_for(
+                    self._drained.wait(), self.shutdown_timeout)
+            except asyncio.TimeoutError:
+                for writer in list(self._open):
+                    writer.close()
+        await self.shutdown()
+
+    def start_server(self, host, port, **kwargs):
+        """Returns a coroutine that starts listening with the configured
+        engine, as `asyncio.start_server` does."""
+        if self.engine == 'protocol':
+            loop = asyncio.get_event_loop()
+            return loop.create_server(
+                lambda: HttpProtocol(self, loop), host, port, **kwargs)
+        elif self.engine == 'stream':
+            return asyncio.start_server(self._handle, host, port, **kwargs)
+        raise ValueError('Unknown engine %r' % self.engine)
+
+    def serve(self, port=8000, host='0.0.0.0', workers=1):
+        """Serves until SIGTERM or SIGINT, then shuts down gracefully.
+
+        :param workers: with more than one, the server runs in that many
+            forked processes, which are restarted if they die and replaced
+            without downtime on SIGHUP. A single process has nothing to
+            replace it, so it shuts down gracefully on SIGHUP too, for
+            its process manager to start it again.
+        """
         print('Serving on %s:%d' % (host, port))
-        loop.create_task(asyncio.start_server(self._handle, host, port))
-        loop.run_forever()
-        loop.close()
+        if workers > 1:
+            Supervisor(self, host, port, workers).run()
+        else:
+            self._run(host, port, asyncio.get_event_loop())
+
+    def _run(self, host, port, loop, ready=None, **kwargs):
+        """Serves on `loop` until SIGTERM, SIGINT or SIGHUP, then shuts
+        down gracefully.
+
+        :param ready: called once the server is listening
+        """
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self.initialize())
+        server = loop.run_until_complete(
+            self.start_server(host, port, **kwargs))
+        stop = loop.create_future()
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            loop.add_signal_handler(
+                signum, lambda: stop.done() or stop.set_result(None))
+        if ready is not None:
+            ready()
+        try:
+            loop.run_until_complete(stop)
+            loop.run_until_complete(self._shutdown_gracefully(server))
+        finally:
+            server.close()
+            # the pools are joined while the loop that used them is open
+            self.executor.shutdown()
+            loop.close()
@@ -0,0 +1,210 @@
+import asyncio
+from collections import deque
+
+# seconds between comments sent to keep idle streams open through proxies
+HEARTBEAT_INTERVAL = 15
+HEARTBEAT = b':\n\n'
+
+
+def encode_event(data, event=None, id=None, retry=None):
+    """Serializes one event in the text/event-stream format.
+
+    :param data: str; each of its lines is sent as a data field
+    :param retry: milliseconds the client should wait before reconnecting
+    """
+    lines = []
+    if id is not None:
+        lines.append('id: %s\n' % id)
+    if event is not None:
+        lines.append('event: %s\n' % event)
+    if retry is not None:
+        lines.append('retry: %d\n' % retry)
+    for line in data.splitlines() or ['']:
+        lines.append('data: %s\n' % line)
+    lines.append('\n')
+    return ''.join(lines).encode()
+
+
+class Subscription:
+    """The events published to a `Channel` that one client has yet to be
+    sent, in a queue of at most `max_queue`.
+
+    Attributes:
+        dropped (bool): True once the client fell too far behind and was
+            unsubscribed
+        closed (bool): True once the subscription was closed
+    """
+
+    def __init__(self, channel, max_queue):
+        self._channel = channel
+        self._events = deque()
+        self._waiter = None
+        self.max_queue = max_queue
+        self.dropped = False
+        self.closed = False
+
+    def put(self, frame):
+        if len(self._events) >= self.max_queue:
+            self.dropped = True
+            self._events.clear()
+            self._channel.unsubscribe(self)
+        else:
+            self._events.append(frame)
+        self._wake()
+
+    async def get(self, timeout=None):
+        """Waits for the next encoded event.
+
+        :return: the event, or None after `timeout` seconds or once the
+            subscription has been dropped or closed
+        """
+        if not self._events and not self.dropped and not self.closed:
+            self._waiter = asyncio.get_event_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self._events:
+            return self._events.popleft()
+        return None
+
+    def close(self):
+        """Stops queueing events, waking a pending `get`."""
+        self.closed = True
+        self._channel.unsubscribe(self)
+        self._wake()
+
+    def _wake(self):
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+
+class Channel:
+    """Publishes events to every subscribed client.
+
+    Each event is encoded once and the same bytes are queued for every
+    subscriber. A subscriber whose queue fills up is dropped, so its
+    stream ends and the client reconnects. The last `history` events are
+    kept, so a client reconnecting with Last-Event-ID is first sent those
+    it missed. Events are given increasing ids unless published with one.
+
+    Attributes:
+        max_queue (int): events each subscriber may fall behind by
+        history (int): events kept for reconnecting clients
+        subscribers (set): the current Subscriptions
+    """
+
+    def __init__(self, max_queue=256, history=256):
+        self.max_queue = max_queue
+        self.history = history
+        self.subscribers = set()
+        self._history = deque(maxlen=history)
+        self._next_id = 1
+
+    def publish(self, data, event=None, id=None):
+        """Encodes an event and queues it for every subscriber."""
+        if id is None:
+            id = self._next_id
+            self._next_id += 1
+        id = str(id)
+        frame = encode_event(data, event, id)
+        if self.history:
+            self._history.append((id, frame))
+        for subscription in list(self.subscribers):
+            subscription.put(frame)
+
+    def subscribe(self, last_event_id=None):
+        """Starts queueing events for a client.
+
+        :param last_event_id: the last event the client saw; those after
+            it are queued first, if it is still in the history
+        """
+        subscription = Subscription(self, self.max_queue)
+        if last_event_id is not None:
+            missed = None
+            for id, frame in self._history:
+                if missed is not None:
+                    missed.append(frame)
+                elif id == last_event_id:
+                    missed = []
+            for frame in (missed or ())[-self.max_queue:]:
+                subscription.put(frame)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+
+
+class EventStream:
+    """Streams Server-Sent Events on a response:
+
+        async def on_get(self, req, res):
+            await EventStream(req, res).subscribe(channel)
+
+    The response is started with the text/event-stream headers, and each
+    event is sent as soon as it is produced. While no event is due, a
+    comment is sent every `heartbeat` seconds, which keeps proxies from
+    closing the connection and notices clients that have gone. Streams
+    subscribed to a channel end as soon as the server starts shutting
+    down, so they don't hold it up until `shutdown_timeout`.
+
+    Attributes:
+        last_event_id (str): the Last-Event-ID the client reconnected with
+        heartbeat (float): seconds between heartbeats
+    """
+
+    def __init__(self, req, res, heartbeat=HEARTBEAT_INTERVAL, retry=None):
+        self.last_event_id = req.headers.get('Last-Event-ID')
+        self.heartbeat = heartbeat
+        self._res = res
+        self._retry = retry
+        self._subscription = None
+
+    def start(self):
+        res = self._res
+        if res.started:
+            return
+        res.headers['Content-Type'] = 'text/event-stream'
+        res.headers['Cache-Control'] = 'no-cache'
+        # stops nginx from buffering the stream
+        res.headers['X-Accel-Buffering'] = 'no'
+        if self._retry is not None:
+            res.write_bytes(b'retry: %d\n\n' % self._retry)
+        res.start()
+
+    async def send(self, data, event=None, id=None):
+        self.start()
+        await self._res.send(encode_event(data, event, id))
+
+    async def subscribe(self, channel):
+        """Sends the channel's events until the client disconnects, falls
+        too far behind or the server shuts down."""
+        self.start()
+        res = self._res
+        server = res._server
+        subscription = self._subscription = channel.subscribe(
+            self.last_event_id)
+        if server is not None:
+            server._event_streams.add(self)
+            if server._draining:
+                subscription.close()
+        try:
+            while not subscription.dropped and not subscription.closed:
+                frame = await subscription.get(self.heartbeat)
+                if frame is None and subscription.closed:
+                    break
+                await res.send(frame if frame is not None else HEARTBEAT)
+        except ConnectionError:
+            return
+        finally:
+            subscription.close()
+            if server is not None:
+                server._event_streams.discard(self)
+        await res.finish()
+
+    def _going_away(self):
+        """Ends the stream because the server is stopping."""
+        if self._subscription is not None:
+            self._subscription.close()
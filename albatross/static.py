@@ -0,0 +1,214 @@
+import asyncio
+import mimetypes
+import mmap
+import os
+import stat
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import unquote
+from albatross.cache import etag_matches
+from albatross.http_error import HTTPError
+from albatross.status_codes import HTTP_206, HTTP_304, HTTP_404, HTTP_416
+
+# files are copied through mmap in slices of this size without sendfile
+MMAP_SLICE = 2 ** 20
+
+
+async def send_file(writer, file, offset, count):
+    """Sends `count` bytes of an open file from `offset` to the client.
+
+    The kernel copies the file straight to the socket with sendfile where
+    the event loop and transport support it. Otherwise the file is mapped
+    into memory and written in slices, which avoids the read calls and
+    buffers of copying it in Python.
+    """
+    if count <= 0:
+        return
+    transport = getattr(writer, 'transport', None)
+    if transport is not None:
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.sendfile(transport, file, offset, count, fallback=False)
+            return
+        except (asyncio.SendfileNotAvailableError, NotImplementedError):
+            pass
+
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        end = offset + count
+        while offset < end:
+            stop = min(offset + MMAP_SLICE, end)
+            writer.write(mapped[offset:stop])
+            offset = stop
+            await writer.drain()
+
+
+def parse_range(header, size):
+    """Parses a single byte range like `bytes=0-99`, `bytes=100-` or
+    `bytes=-100`.
+
+    :return: the first and last byte positions, None to send the whole
+        file, or raises HTTPError(416) if the range lies past its end
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        # multiple ranges aren't supported, so the whole file is sent
+        return None
+    first, sep, last = spec.strip().partition('-')
+    try:
+        if not sep:
+            return None
+        if not first:
+            length = int(last)
+            if length <= 0:
+                raise HTTPError(HTTP_416)
+            return max(size - length, 0), size - 1
+        first = int(first)
+        last = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if first >= size:
+        raise HTTPError(HTTP_416)
+    if last < first:
+        return None
+    return first, min(last, size - 1)
+
+
+class StaticFiles:
+    """Serves the files in a directory.
+
+    Register it with a route that captures the file's path as `path`:
+
+        app.add_regex_route('/static/(?P<path>.*)', StaticFiles('public'))
+
+    Large files are sent with sendfile, without passing through Python.
+    Files up to `max_cached_file_size` bytes are kept in memory, least
+    recently used first out once they add up to `max_cache_bytes`, and are
+    re-read when they change on disk. Their compressed copies are kept
+    alongside them, as `ResponseCache` keeps those of its responses, so
+    `Compression` compresses each version of a file once. Responses carry
+    an ETag and Last-Modified date, so clients can revalidate them with
+    If-None-Match or If-Modified-Since and get a 304, and a single `Range`
+    is answered with 206 Partial Content.
+
+    Attributes:
+        directory (str): the directory files are served from
+        max_cache_bytes (int): total size of the files kept in memory
+        max_cached_file_size (int): larger files are always sent from disk
+        cache_control (str): Cache-Control header for every file, if set
+    """
+
+    def __init__(self, directory, max_cache_bytes=2 ** 23,
+                 max_cached_file_size=2 ** 16, cache_control=None):
+        self.directory = os.path.realpath(directory)
+        self.max_cache_bytes = max_cache_bytes
+        self.max_cached_file_size = max_cached_file_size
+        self.cache_control = cache_control
+        self.cache_size = 0
+        self._cache = OrderedDict()
+
+    def resolve(self, path):
+        """Maps a request path onto a file inside `directory`.
+
+        :return: the file's absolute path, or raises HTTPError(404) for
+            paths that would escape the directory
+        """
+        path = unquote(path)
+        parts = path.replace('\\', '/').split('/')
+        if '\x00' in path or '..' in parts:
+            raise HTTPError(HTTP_404)
+        full = os.path.realpath(os.path.join(self.directory, *parts))
+        if os.path.commonpath((full, self.directory)) != self.directory:
+            raise HTTPError(HTTP_404)
+        return full
+
+    async def on_get(self, req, res):
+        path = self.resolve((req.args or {}).get('path', ''))
+        try:
+            info = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise HTTPError(HTTP_404)
+        if not stat.S_ISREG(info.st_mode):
+            raise HTTPError(HTTP_404)
+
+        size = info.st_size
+        etag = '"%x-%x"' % (info.st_mtime_ns, size)
+        headers = res.headers
+        headers['Content-Type'] = (
+            mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        headers['ETag'] = etag
+        headers['Last-Modified'] = formatdate(info.st_mtime, usegmt=True)
+        headers['Accept-Ranges'] = 'bytes'
+        if self.cache_control is not None:
+            headers['Cache-Control'] = self.cache_control
+
+        if self._not_modified(req, etag, info.st_mtime):
+            res.status_code = HTTP_304
+            del headers['Content-Type']
+            return
+
+        first, last = 0, size - 1
+        byte_range = req.headers.get('Range')
+        if byte_range and self._if_range(req, etag):
+            try:
+                span = parse_range(byte_range, size)
+            except HTTPError:
+                headers['Content-Range'] = 'bytes */%d' % size
+                raise
+            if span is not None:
+                first, last = span
+                res.status_code = HTTP_206
+                headers['Content-Range'] = 'bytes %d-%d/%d' % (
+                    first, last, size)
+
+        if size <= self.max_cached_file_size:
+            data, variants = self._cached(path, info)
+            if res.status_code == HTTP_206:
+                res.write_bytes(data[first:last + 1])
+            else:
+                res.write_bytes(data)
+                res._variants = variants
+        else:
+            res.write_file(open(path, 'rb'), first, last - first + 1)
+
+    def _not_modified(self, req, etag, mtime):
+        if 'If-None-Match' in req.headers:
+            return etag_matches(req, etag)
+        since = req.headers.get('If-Modified-Since')
+        if not since:
+            return False
+        try:
+            since = parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+
+    def _if_range(self, req, etag):
+        # a client holding a stale copy gets the whole new file instead
+        if_range = req.headers.get('If-Range')
+        return if_range is None or if_range.strip() == etag
+
+    def _cached(self, path, info):
+        """The contents of a small file, from memory if it hasn't changed.
+
+        :return: the contents, and a dict of their compressed copies for
+            `res._variants`, or None if the file is not kept
+        """
+        version = (info.st_mtime_ns, info.st_size)
+        entry = self._cache.get(path)
+        if entry is not None and entry[0] == version:
+            self._cache.move_to_end(path)
+            return entry[1], entry[2]
+        with open(path, 'rb') as f:
+            data = f.read()
+        if entry is not None:
+            self.cache_size -= len(self._cache.pop(path)[1])
+        if len(data) > self.max_cache_bytes:
+            return data, None
+        # a changed file gets new, empty variants along with its contents
+        variants = {}
+        self._cache[path] = (version, data, variants)
+        self.cache_size += len(data)
+        while self.cache_size > self.max_cache_bytes:
+            _, (_, evicted, _) = self._cache.popitem(last=False)
+            self.cache_size -= len(evicted)
+        return data, variants
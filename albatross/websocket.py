@@ -0,0 +1,431 @@
+import asyncio
+import base64
+import hashlib
+import struct
+import sys
+from albatross.http_error import HTTPError
+from albatross.status_codes import HTTP_400, HTTP_426
+
+GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_NO_STATUS = 1005
+CLOSE_ABNORMAL = 1006
+CLOSE_INVALID_DATA = 1007
+CLOSE_TOO_BIG = 1009
+CLOSE_INTERNAL_ERROR = 1011
+
+# seconds to wait for the client to answer a close frame
+CLOSE_TIMEOUT = 5
+# received messages held for the handler before the socket stops being read
+MAX_QUEUE = 16
+
+
+class WebSocketClosed(ConnectionError):
+    """Raised when reading from or writing to a closed WebSocket.
+
+    Attributes:
+        code (int): the close code, CLOSE_ABNORMAL if the connection was
+            lost without one
+        reason (str):
+    """
+
+    def __init__(self, code, reason=''):
+        super(WebSocketClosed, self).__init__(
+            'WebSocket closed with %d %s' % (code, reason))
+        self.code = code
+        self.reason = reason
+
+
+class ProtocolError(Exception):
+    def __init__(self, code, reason):
+        super(ProtocolError, self).__init__(reason)
+        self.code = code
+        self.reason = reason
+
+
+def apply_mask(data, mask):
+    """XORs data with a 4 byte mask, in one pass over a big integer rather
+    than byte by byte in Python. Masking and unmasking are the same."""
+    length = len(data)
+    if not length:
+        return b''
+    repeated = mask * (length >> 2) + mask[:length & 3]
+    value = (int.from_bytes(data, sys.byteorder) ^
+             int.from_bytes(repeated, sys.byteorder))
+    return value.to_bytes(length, sys.byteorder)
+
+
+def frame_header(opcode, length, fin=True):
+    first = opcode | 0x80 if fin else opcode
+    if length < 126:
+        return bytes((first, length))
+    if length < 2 ** 16:
+        return struct.pack('!BBH', first, 126, length)
+    return struct.pack('!BBQ', first, 127, length)
+
+
+def encode_frame(opcode, payload, fin=True):
+    """Serializes an unmasked frame, as servers send them."""
+    return frame_header(opcode, len(payload), fin) + payload
+
+
+def encode_message(message):
+    if isinstance(message, str):
+        return OP_TEXT, message.encode()
+    return OP_BINARY, bytes(message)
+
+
+def encode_close(code, reason=''):
+    if code == CLOSE_NO_STATUS:
+        return b''
+    return struct.pack('!H', code) + reason.encode()
+
+
+def is_websocket_request(req):
+    return req.headers.get('Upgrade', '').lower() == 'websocket'
+
+
+def handshake(req, res):
+    """Checks a WebSocket upgrade request and fills in the 101 response.
+
+    :raises HTTPError: 400 for a malformed request, or 426 for a protocol
+        version other than 13
+    """
+    headers = req.headers
+    connection = headers.get('Connection', '').lower()
+    key = headers.get('Sec-WebSocket-Key')
+    if (req.method != 'GET' or key is None or
+            'upgrade' not in (t.strip() for t in connection.split(','))):
+        raise HTTPError(HTTP_400, 'Invalid WebSocket upgrade')
+    if headers.get('Sec-WebSocket-Version') != '13':
+        res.headers['Sec-WebSocket-Version'] = '13'
+        raise HTTPError(HTTP_426)
+    try:
+        if len(base64.b64decode(key, validate=True)) != 16:
+            raise ValueError(key)
+    except ValueError:
+        raise HTTPError(HTTP_400, 'Invalid Sec-WebSocket-Key')
+    accept = base64.b64encode(hashlib.sha1(key.encode() + GUID).digest())
+    res.headers.clear()
+    res.headers['Upgrade'] = 'websocket'
+    res.headers['Connection'] = 'Upgrade'
+    res.headers['Sec-WebSocket-Accept'] = accept.decode()
+
+
+class WebSocket:
+    """One side of a WebSocket, handed to `on_websocket(req, ws)` handlers.
+
+    Frames are read by a task of their own, so pings are answered and
+    close frames handled whether or not the handler is reading. Up to
+    `MAX_QUEUE` messages wait for `receive`; beyond that the connection
+    stops being read until the handler catches up. `send` waits while the
+    client is slow to read, so a slow client holds up only its own sender.
+
+    Attributes:
+        closed (bool): True once a close frame has been sent or received,
+            or the connection was lost
+        close_code (int): the code the WebSocket closed with
+        close_reason (str):
+        max_size (int): messages larger than this close the WebSocket
+            with 1009
+        ping_interval (float): seconds between pings; the connection is
+            dropped if a ping has not been answered by the next one
+    """
+
+    def __init__(self, stream, writer, drain, max_size=2 ** 20,
+                 ping_interval=None):
+        self._stream = stream
+        self._writer = writer
+        self._drain = drain
+        self._messages = asyncio.Queue(MAX_QUEUE)
+        self._reader = None
+        self._pinger = None
+        self._awaiting_pong = False
+        self._close_sent = False
+        self._close_received = None
+        self.closed = False
+        self.close_code = None
+        self.close_reason = ''
+        self.max_size = max_size
+        self.ping_interval = ping_interval
+
+    def start(self):
+        loop = asyncio.get_event_loop()
+        self._close_received = loop.create_future()
+        self._reader = loop.create_task(self._read_frames())
+        if self.ping_interval:
+            self._pinger = loop.create_task(self._keep_alive())
+
+    async def receive(self):
+        """Waits for the next message.
+
+        :return: str for text messages, bytes for binary ones
+        :raises WebSocketClosed: once the WebSocket has closed
+        """
+        if self._messages.empty() and self.closed:
+            raise WebSocketClosed(self.close_code, self.close_reason)
+        message = await self._messages.get()
+        if message is None:
+            # put back for any other reader, then report the close
+            self._messages.put_nowait(None)
+            raise WebSocketClosed(self.close_code, self.close_reason)
+        return message
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.receive()
+        except WebSocketClosed:
+            raise StopAsyncIteration
+
+    async def send(self, message):
+        """Sends a str as a text message, or bytes as a binary one."""
+        opcode, payload = encode_message(message)
+        self._check_open()
+        self._writer.writelines([frame_header(opcode, len(payload)),
+                                 payload])
+        await self._drain()
+
+    async def send_fragments(self, fragments):
+        """Sends one message in parts from a (async) iterable of str or
+        bytes, without joining it in memory. The first part decides
+        whether it is a text or binary message. Nothing else may be sent on
+        the WebSocket until this returns."""
+        opcode = pending = None
+        async for fragment in _iterate(fragments):
+            kind, payload = encode_message(fragment)
+            if pending is not None:
+                # a part is only sent once it is known not to be the last
+                await self._send_fragment(opcode, pending, False)
+                opcode = OP_CONTINUATION
+            elif opcode is None:
+                opcode = kind
+            pending = payload
+        if pending is not None:
+            await self._send_fragment(opcode, pending, True)
+
+    async def _send_fragment(self, opcode, payload, fin):
+        self._check_open()
+        self._writer.writelines([frame_header(opcode, len(payload), fin),
+                                 payload])
+        await self._drain()
+
+    async def send_frame(self, frame):
+        """Sends a frame serialized with `encode_frame`."""
+        self._check_open()
+        self._writer.write(frame)
+        await self._drain()
+
+    async def ping(self, data=b''):
+        self._check_open()
+        self._writer.write(encode_frame(OP_PING, data))
+        await self._drain()
+
+    async def close(self, code=CLOSE_NORMAL, reason=''):
+        """Starts the closing handshake and waits, for up to
+        `CLOSE_TIMEOUT`, for the client to answer it."""
+        if not self._close_sent and not self.closed:
+            self._send_close(code, reason)
+            self._set_closed(code, reason)
+        if self._close_received is not None:
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(self._close_received), CLOSE_TIMEOUT)
+            except (asyncio.TimeoutError, ConnectionError):
+                pass
+        self._abort()
+
+    def _going_away(self):
+        """Starts closing the WebSocket because the server is stopping."""
+        if not self.closed:
+            self._send_close(CLOSE_GOING_AWAY)
+            self._set_closed(CLOSE_GOING_AWAY)
+
+    def _check_open(self):
+        if self.closed:
+            raise WebSocketClosed(self.close_code, self.close_reason)
+
+    def _send_close(self, code, reason=''):
+        self._close_sent = True
+        try:
+            self._writer.write(encode_frame(OP_CLOSE,
+                                            encode_close(code, reason)))
+        except (ConnectionError, RuntimeError):
+            pass
+
+    def _set_closed(self, code, reason=''):
+        if self.closed:
+            return
+        self.closed = True
+        self.close_code = code
+        self.close_reason = reason
+        try:
+            self._messages.put_nowait(None)
+        except asyncio.QueueFull:
+            # receive raises once the queue has drained
+            pass
+
+    def _abort(self):
+        """Stops the background tasks and closes the connection."""
+        self._set_closed(CLOSE_ABNORMAL)
+        for task in (self._reader, self._pinger):
+            if task is not None and task is not asyncio.current_task():
+                task.cancel()
+        self._writer.close()
+
+    async def _read_frames(self):
+        try:
+            fragments = []
+            size = 0
+            opcode = None
+            while True:
+                fin, kind, payload = await self._read_frame()
+                if kind >= OP_CLOSE:
+                    await self._control(kind, payload)
+                    if kind == OP_CLOSE:
+                        return
+                    continue
+                if kind == OP_CONTINUATION:
+                    if opcode is None:
+                        raise ProtocolError(CLOSE_PROTOCOL_ERROR,
+                                            'Unexpected continuation')
+                elif opcode is not None:
+                    raise ProtocolError(CLOSE_PROTOCOL_ERROR,
+                                        'Expected a continuation')
+                else:
+                    opcode = kind
+                size += len(payload)
+                if size > self.max_size:
+                    raise ProtocolError(CLOSE_TOO_BIG, 'Message too big')
+                fragments.append(payload)
+                if not fin:
+                    continue
+                message = (fragments[0] if len(fragments) == 1 else
+                           b''.join(fragments))
+                if opcode == OP_TEXT:
+                    try:
+                        message = message.decode()
+                    except UnicodeDecodeError:
+                        raise ProtocolError(CLOSE_INVALID_DATA,
+                                            'Invalid UTF-8')
+                fragments = []
+                size = 0
+                opcode = None
+                await self._messages.put(message)
+        except ProtocolError as e:
+            if not self._close_sent:
+                self._send_close(e.code, e.reason)
+            self._set_closed(e.code, e.reason)
+            self._writer.close()
+        except (ConnectionError, HTTPError, asyncio.IncompleteReadError):
+            self._set_closed(CLOSE_ABNORMAL)
+        finally:
+            if not self._close_received.done():
+                self._close_received.set_result(None)
+
+    async def _read_frame(self):
+        read = self._stream.readexactly
+        first, second = await read(2)
+        if first & 0x70:
+            raise ProtocolError(CLOSE_PROTOCOL_ERROR, 'Unexpected RSV bits')
+        opcode = first & 0x0F
+        if opcode not in (OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE,
+                          OP_PING, OP_PONG):
+            raise ProtocolError(CLOSE_PROTOCOL_ERROR, 'Unknown opcode')
+        if not second & 0x80:
+            raise ProtocolError(CLOSE_PROTOCOL_ERROR,
+                                'Client frames must be masked')
+        length = second & 0x7F
+        if opcode >= OP_CLOSE and (length > 125 or not first & 0x80):
+            raise ProtocolError(CLOSE_PROTOCOL_ERROR,
+                                'Invalid control frame')
+        if length == 126:
+            length, = struct.unpack('!H', await read(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', await read(8))
+        if length > self.max_size:
+            raise ProtocolError(CLOSE_TOO_BIG, 'Message too big')
+        mask = await read(4)
+        payload = apply_mask(await read(length), mask) if length else b''
+        return first & 0x80, opcode, payload
+
+    async def _control(self, opcode, payload):
+        if opcode == OP_PING:
+            if not self._close_sent:
+                self._writer.write(encode_frame(OP_PONG, payload))
+                await self._drain()
+        elif opcode == OP_PONG:
+            self._awaiting_pong = False
+        else:
+            code, reason = CLOSE_NO_STATUS, ''
+            if len(payload) == 1:
+                raise ProtocolError(CLOSE_PROTOCOL_ERROR,
+                                    'Invalid close frame')
+            if payload:
+                code, = struct.unpack('!H', payload[:2])
+                try:
+                    reason = payload[2:].decode()
+                except UnicodeDecodeError:
+                    raise ProtocolError(CLOSE_INVALID_DATA, 'Invalid UTF-8')
+            if not self._close_sent:
+                # echo the close, then the server closes the connection
+                self._send_close(code)
+            self._set_closed(code, reason)
+            self._writer.close()
+
+    async def _keep_alive(self):
+        while not self.closed:
+            await asyncio.sleep(self.ping_interval)
+            if self.closed:
+                return
+            if self._awaiting_pong:
+                # the last ping went unanswered
+                self._abort()
+                return
+            self._awaiting_pong = True
+            try:
+                await self.ping()
+            except ConnectionError:
+                self._abort()
+                return
+
+
+async def _iterate(iterable):
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+async def broadcast(sockets, message):
+    """Sends one message to many WebSockets, serializing it only once.
+
+    Every socket is written to before any is waited on, so a slow client
+    doesn't hold up the others. Sockets that have closed are skipped.
+    """
+    opcode, payload = encode_message(message)
+    frame = encode_frame(opcode, payload)
+    sent = []
+    for ws in sockets:
+        if not ws.closed:
+            ws._writer.write(frame)
+            sent.append(ws)
+    for ws in sent:
+        try:
+            await ws._drain()
+        except ConnectionError:
+            pass
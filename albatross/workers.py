@@ -0,0 +1,202 @@
+import asyncio
+import os
+import select
+import signal
+import socket
+import time
+import traceback
+
+# signals the supervisor handles, and its workers reset
+SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD)
+
+
+class Supervisor:
+    """Runs a server in several forked worker processes.
+
+    The supervisor binds one listening socket, and every worker accepts
+    on it. Workers that die are replaced until the supervisor receives
+    SIGTERM or SIGINT, which it passes on to the workers before waiting
+    for them.
+
+    SIGHUP replaces every worker without dropping a connection: a new set
+    is started, and once all of them are listening the old ones are sent
+    SIGTERM, which they handle by finishing their in-flight requests. The
+    socket and its backlog belong to the supervisor, so connections that
+    an old worker hasn't accepted when it stops are accepted by a new one.
+    Separate SO_REUSEPORT sockets per worker would spread connections
+    more evenly, but the kernel resets those queued on a socket when it
+    closes.
+    A SIGHUP during a reload starts another once it is done, and SIGTERM
+    cuts it short.
+    New workers run `initialize` again, so settings loaded there are
+    reloaded, but code is not, as workers are forked from the supervisor.
+
+    Attributes:
+        restart_delay (float): a worker that dies sooner than this after
+            starting is replaced only after waiting this long, so a worker
+            that crashes on startup does not fork in a tight loop
+        ready_timeout (float): how long new workers get to start listening
+            on SIGHUP before they are given up on and the old ones kept
+    """
+    restart_delay = 1
+    ready_timeout = 30
+
+    def __init__(self, server, host, port, workers):
+        self.server = server
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self._pids = {}
+        self._retiring = set()
+        self._stopping = False
+        self._sock = None
+        self._wakeup = self._wakeup_write = None
+        self._signals = set()
+
+    def run(self):
+        self._sock = socket.create_server(
+            (self.host, self.port), backlog=1024)
+        self._sock.set_inheritable(True)
+
+        # the handlers only note the signal; it is acted on here, outside
+        # them, so a reload or stop never runs inside another
+        self._wakeup, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_write, False)
+        signal.set_wakeup_fd(self._wakeup_write)
+        for signum in SIGNALS:
+            signal.signal(signum, self._on_signal)
+        try:
+            for _ in range(self.workers):
+                os.close(self._spawn())
+
+            while self._pids:
+                if not self._signals:
+                    select.select([self._wakeup], [], [])
+                    self._read_signals()
+                signals, self._signals = self._signals, set()
+                if signals & {signal.SIGTERM, signal.SIGINT}:
+                    self._stop()
+                self._reap()
+                if signal.SIGHUP in signals and not self._stopping:
+                    self._reload()
+        finally:
+            signal.set_wakeup_fd(-1)
+            for signum in SIGNALS:
+                signal.signal(signum, signal.SIG_DFL)
+            os.close(self._wakeup)
+            os.close(self._wakeup_write)
+            self._sock.close()
+
+    def _on_signal(self, signum, frame):
+        # the signal number is written to the wakeup pipe
+        pass
+
+    def _read_signals(self):
+        self._signals.update(os.read(self._wakeup, 512))
+
+    def _reap(self):
+        """Collects the workers that exited, replacing those that died."""
+        while self._pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._pids.clear()
+                return
+            if pid == 0:
+                return
+            started = self._pids.pop(pid, None)
+            if pid in self._retiring:
+                self._retiring.discard(pid)
+                continue
+            if started is None or self._stopping:
+                continue
+            print('Worker %d exited with status %d' % (pid, status))
+            if time.monotonic() - started < self.restart_delay:
+                time.sleep(self.restart_delay)
+            os.close(self._spawn())
+
+    def _spawn(self):
+        """Forks a worker.
+
+        :return: a pipe the worker writes to once it is listening, which
+            the caller must close
+        """
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid:
+            os.close(ready_write)
+            self._pids[pid] = time.monotonic()
+            return ready_read
+
+        def ready():
+            try:
+                os.write(ready_write, b'1')
+            except OSError:
+                # nobody is waiting for this worker
+                pass
+            os.close(ready_write)
+
+        status = 0
+        try:
+            os.close(ready_read)
+            signal.set_wakeup_fd(-1)
+            os.close(self._wakeup)
+            os.close(self._wakeup_write)
+            for signum in SIGNALS:
+                signal.signal(signum, signal.SIG_DFL)
+            self.server._run(
+                None, None, asyncio.new_event_loop(), ready=ready,
+                sock=self._sock)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _reload(self):
+        old = set(self._pids) - self._retiring
+        pipes = [self._spawn() for _ in range(self.workers)]
+        new = set(self._pids) - old - self._retiring
+
+        # a worker writes to its pipe once it is listening, and the pipe
+        # closes empty if it dies first
+        ready = 0
+        deadline = time.monotonic() + self.ready_timeout
+        while pipes and time.monotonic() < deadline:
+            readable, _, _ = select.select(
+                pipes + [self._wakeup], [], [], deadline - time.monotonic())
+            if self._wakeup in readable:
+                readable.remove(self._wakeup)
+                self._read_signals()
+                if self._signals & {signal.SIGTERM, signal.SIGINT}:
+                    # stopping takes every worker, old and new, with it
+                    break
+            for fd in readable:
+                if os.read(fd, 1):
+                    ready += 1
+                os.close(fd)
+                pipes.remove(fd)
+        for fd in pipes:
+            os.close(fd)
+        if self._signals & {signal.SIGTERM, signal.SIGINT}:
+            return
+
+        if ready == self.workers:
+            retire = old
+        else:
+            print('New workers failed to start; keeping the old ones')
+            retire = new
+        self._retiring.update(retire)
+        for pid in retire:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _stop(self):
+        self._stopping = True
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
@@ -0,0 +1,97 @@
+"""Counts the memory albatross allocates per request with tracemalloc.
+
+"held" parses requests into a connection's queue and gives each one a
+Response, without answering them, to show the blocks and bytes every
+request in flight keeps alive. "answered" parses and answers requests one
+after another on a connection, with object pooling off and on, and shows
+the highest memory in use while a request is answered, above what was in
+use before it arrived.
+
+Run it on an older checkout to compare the numbers with a release.
+
+    python3 bench_alloc.py
+"""
+import asyncio
+import gc
+import time
+import tracemalloc
+from albatross import Response, Server
+
+HELD = 1000
+ANSWERED = 2000
+RAW = (b'GET /items/42?page=1 HTTP/1.1\r\nHost: localhost\r\n'
+       b'User-Agent: bench\r\nAccept: */*\r\n\r\n')
+
+
+class ItemHandler:
+    async def on_get(self, req, res):
+        res.write('item %s %s' % (req.args['id'], req.query['page']))
+
+
+class NullWriter:
+    def write(self, data):
+        pass
+
+    def writelines(self, data):
+        pass
+
+    async def drain(self):
+        pass
+
+
+def make_server(**kwargs):
+    server = Server(**kwargs)
+    server.add_route('/items/{id}', ItemHandler())
+    return server
+
+
+def held():
+    server = make_server()
+    parser = server._make_parser()
+    gc.collect()
+    before = tracemalloc.take_snapshot()
+    for _ in range(HELD):
+        parser.feed_data(RAW)
+    kept = [(req, Response()) for req in parser.requests]
+    for req, _ in kept:
+        # what a handler typically touches
+        req.headers, req.query, req.cookies
+    after = tracemalloc.take_snapshot()
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    return blocks / HELD, size / HELD
+
+
+async def answered(**kwargs):
+    server = make_server(**kwargs)
+    parser = server._make_parser()
+    writer = NullWriter()
+    peaks = []
+    start = time.perf_counter()
+    for _ in range(ANSWERED):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        parser.feed_data(RAW)
+        req = parser.requests.popleft()
+        await server._send_response(req, writer, 1)
+        parser.release(req)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    elapsed = (time.perf_counter() - start) / ANSWERED
+    # the first requests warm up the pool and caches
+    peaks = sorted(peaks[ANSWERED // 10:])
+    return peaks[len(peaks) // 2], elapsed
+
+
+def main():
+    tracemalloc.start()
+    blocks, size = held()
+    print('held      %6.1f blocks %8.1f bytes per request' % (blocks, size))
+    for name, pool in (('pool off', False), ('pool on', True)):
+        peak, elapsed = asyncio.run(answered(pool_objects=pool))
+        print('answered  %-8s %8d bytes peak per request  '
+              '%6.2f us per request (traced)' % (name, peak, elapsed * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Measures CPU time per MB and compression ratio of gzip and brotli at a
+few levels on a JSON payload, to help pick `Compression(levels=...)`.
+
+    python3 bench_compression.py
+"""
+import json
+import time
+from albatross.compat import brotli
+from albatross.compression import compress
+
+PAYLOAD = json.dumps([
+    {'id': i, 'name': 'user %d' % i, 'email': 'user%d@example.com' % i,
+     'active': i % 3 == 0, 'score': i * 1.5}
+    for i in range(20000)
+]).encode()
+MB = len(PAYLOAD) / 2 ** 20
+
+
+def measure(encoding, level, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.process_time()
+        compressed = compress(encoding, PAYLOAD, level)
+        best = min(best, time.process_time() - start)
+    return best * 1000 / MB, len(PAYLOAD) / len(compressed)
+
+
+def main():
+    print('payload: %.2f MB' % MB)
+    print('%-8s %6s %12s %8s' % ('encoding', 'level', 'ms per MB', 'ratio'))
+    cases = [('gzip', 1), ('gzip', 6), ('gzip', 9)]
+    if brotli is not None:
+        cases += [('br', 1), ('br', 4), ('br', 11)]
+    else:
+        print('brotli is not installed, skipping br')
+    for encoding, level in cases:
+        ms, ratio = measure(encoding, level, repeat=1 if level == 11 else 3)
+        print('%-8s %6d %12.1f %8.1f' % (encoding, level, ms, ratio))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Times building request headers and looking them up, comparing `Headers`
+with the old ImmutableCaselessMultiDict built from decoded pairs.
+
+    python3 bench_headers.py
+"""
+from timeit import timeit
+from albatross.data_types import Headers
+
+
+def caseless_pairs(seq):
+    for k, v in seq:
+        yield k.lower(), v
+
+
+class OldCaselessMultiDict(dict):
+    def __init__(self, it=None, **kwargs):
+        it = caseless_pairs(it) if it else []
+        if kwargs:
+            kwargs = {k.lower(): [v] for k, v in kwargs.items()}
+        for k, v in it:
+            if k in kwargs:
+                kwargs[k].append(v)
+            else:
+                kwargs[k] = [v]
+        super().__init__(**kwargs)
+
+    def __contains__(self, k):
+        return super().__contains__(k.lower())
+
+    def __getitem__(self, k):
+        if k in self:
+            return super().__getitem__(k.lower())[0]
+        raise KeyError(k)
+
+    def get(self, k, d=None):
+        if k in self:
+            return super().__getitem__(k.lower())[0]
+        return d
+
+
+def build_old(raw):
+    return OldCaselessMultiDict(
+        (name.decode(), value.decode()) for name, value in raw)
+
+
+RAW = [
+    (b'Host', b'localhost:8000'),
+    (b'User-Agent', b'Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0'),
+    (b'Accept', b'text/html,application/xhtml+xml,*/*;q=0.8'),
+    (b'Accept-Language', b'en-US,en;q=0.5'),
+    (b'Accept-Encoding', b'gzip, deflate, br'),
+    (b'Connection', b'keep-alive'),
+    (b'Cookie', b'session=abc123; theme=dark'),
+    (b'Upgrade-Insecure-Requests', b'1'),
+    (b'X-Trace', b'7f3a'),
+]
+LOOKUPS = ('Accept-Encoding', 'content-type', 'If-None-Match', 'Host')
+
+
+def main(number=100000):
+    for name, build in (('old', build_old), ('Headers', Headers)):
+        headers = build(RAW)
+
+        def lookup():
+            for key in LOOKUPS:
+                headers.get(key)
+
+        built = timeit(lambda: build(RAW), number=number) / number
+        looked = timeit(lookup, number=number) / number / len(LOOKUPS)
+        print('%-8s build %6.2f us   get %6.3f us' % (
+            name, built * 1e6, looked * 1e6))
+
+
+if __name__ == '__main__':
+    main()
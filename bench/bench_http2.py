@@ -0,0 +1,121 @@
+"""Sends many small concurrent requests to a server with HTTP/2 enabled,
+over HTTP/1.1 with a connection per request, over HTTP/1.1 with a
+keep-alive connection per concurrent request, and over a single HTTP/2
+connection carrying every request as a stream of its own.
+
+The load generator runs on the same machine, so give it a core of its
+own. Needs the h2 package.
+
+    python3 bench_http2.py
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from h2.config import H2Configuration
+from h2.connection import H2Connection
+from h2.events import DataReceived, StreamEnded, StreamReset
+from loadgen import Scenario, percentile, run
+from run_suite import free_port, wait_for_port
+
+CONCURRENCY = 100
+DURATION = 5
+
+
+def serve(port):
+    from albatross import Server
+
+    class HelloHandler:
+        async def on_get(self, req, res):
+            res.write('Hello, world!')
+
+    app = Server(engine='protocol', http2=True)
+    app.add_route('/hello', HelloHandler())
+    app.serve(port=port, host='127.0.0.1')
+
+
+async def run_http2(host, port, concurrency, duration):
+    """Drives `concurrency` requests at a time over one connection."""
+    reader, writer = await asyncio.open_connection(host, port)
+    conn = H2Connection(H2Configuration(client_side=True))
+    conn.initiate_connection()
+    writer.write(conn.data_to_send())
+    waiting = {}
+    latencies = []
+
+    async def read():
+        while True:
+            data = await reader.read(2 ** 16)
+            if not data:
+                return
+            for event in conn.receive_data(data):
+                if isinstance(event, DataReceived):
+                    conn.acknowledge_received_data(
+                        event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, (StreamEnded, StreamReset)):
+                    waiting.pop(event.stream_id).set_result(None)
+            writer.write(conn.data_to_send())
+
+    async def requests(deadline):
+        loop = asyncio.get_event_loop()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            stream_id = conn.get_next_available_stream_id()
+            done = waiting[stream_id] = loop.create_future()
+            conn.send_headers(stream_id, [
+                (':method', 'GET'), (':path', '/hello'),
+                (':scheme', 'http'), (':authority', host),
+            ], end_stream=True)
+            writer.write(conn.data_to_send())
+            await done
+            latencies.append(time.perf_counter() - start)
+
+    reading = asyncio.ensure_future(read())
+    started = time.perf_counter()
+    await asyncio.gather(*(requests(started + duration)
+                           for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    reading.cancel()
+    writer.close()
+    latencies.sort()
+    return {
+        'req_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def main():
+    if sys.argv[1:2] == ['serve']:
+        return serve(int(sys.argv[2]))
+    port = free_port()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [os.path.dirname(os.path.abspath(os.path.dirname(
+            __file__))), env.get('PYTHONPATH')]))
+    process = subprocess.Popen(
+        [sys.executable, __file__, 'serve', str(port)],
+        env=env, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, process)
+        for name, keep_alive in (('http/1.1 close', False),
+                                 ('http/1.1 keep-alive', True)):
+            scenario = Scenario(name, '/hello', keep_alive=keep_alive)
+            result = asyncio.run(run(scenario, '127.0.0.1', port,
+                                     CONCURRENCY, DURATION))
+            print('%-20s %8.1f req/s  p50 %7.2f ms  p99 %7.2f ms' % (
+                name, result['req_per_sec'], result['p50_ms'],
+                result['p99_ms']))
+        result = asyncio.run(run_http2('127.0.0.1', port, CONCURRENCY,
+                                       DURATION))
+        print('%-20s %8.1f req/s  p50 %7.2f ms  p99 %7.2f ms' % (
+            'h2c, 1 connection', result['req_per_sec'], result['p50_ms'],
+            result['p99_ms']))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    main()
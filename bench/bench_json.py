@@ -0,0 +1,79 @@
+"""Measures JSON round trips through a request and a response, parsing the
+body into `req.form` and writing it back with `res.write_json`, for each
+codec at a few payload sizes. 'old' parses and serializes the way
+albatross did before codecs, decoding to str and encoding back.
+
+    python3 bench_json.py
+"""
+import json
+import time
+from albatross import Request, Response
+from albatross.codecs import JSON_TYPE, JSONCodec, OrjsonCodec
+from albatross.compat import json as compat_json, orjson
+
+
+class OldCodec:
+    def dumps(self, data):
+        return compat_json.dumps(data).encode()
+
+    def loads(self, data):
+        return compat_json.loads(bytes(data).decode())
+
+
+class StdlibCodec(JSONCodec):
+    def dumps(self, data):
+        return json.dumps(data).encode()
+
+    def loads(self, data):
+        return json.loads(bytes(data))
+
+
+def payload(records):
+    return json.dumps([
+        {'id': i, 'name': 'user %d' % i, 'email': 'user%d@example.com' % i,
+         'active': i % 3 == 0, 'score': i * 1.5, 'tags': ['a', 'b']}
+        for i in range(records)
+    ]).encode()
+
+
+def round_trip(codecs, body):
+    req = Request(codecs=codecs)
+    req.on_header(b'Content-Type', b'application/json')
+    req.on_headers_complete()
+    req.on_body(body)
+    req.on_message_complete()
+    res = Response()
+    res._codec = codecs[JSON_TYPE]
+    res.write_json(req.form)
+    req.reset()
+
+
+def measure(codec, body, seconds=1):
+    codecs = {JSON_TYPE: codec}
+    count = 0
+    start = time.perf_counter()
+    while True:
+        round_trip(codecs, body)
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > seconds:
+            return count / elapsed
+
+
+def main():
+    codecs = [('old', OldCodec()), ('json', StdlibCodec()),
+              ('default', JSONCodec())]
+    if orjson is not None:
+        codecs.append(('orjson', OrjsonCodec()))
+    print('%-8s %10s %14s %10s' % ('codec', 'payload', 'round trips/s',
+                                   'MB/s'))
+    for records in (1, 100, 10000):
+        body = payload(records)
+        for name, codec in codecs:
+            rate = measure(codec, body)
+            print('%-8s %9dB %14.0f %10.1f' % (
+                name, len(body), rate, rate * len(body) / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Times parsing and answering requests in-process with metrics off and
+on, to show what the instrumentation costs per request.
+
+With metrics off the server only checks whether they are set, so its time
+should match what it was before the hooks were added.
+
+    python3 bench_metrics.py
+"""
+import asyncio
+import time
+from albatross import Server
+from albatross.metrics import Metrics
+
+REQUESTS = 20000
+RAW = b'GET /items/42?page=1 HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+
+class ItemHandler:
+    async def on_get(self, req, res):
+        res.write('item %s' % req.args['id'])
+
+
+class NullWriter:
+    def write(self, data):
+        pass
+
+    def writelines(self, data):
+        pass
+
+    async def drain(self):
+        pass
+
+
+def make_server(metrics):
+    server = Server(metrics=metrics)
+    server.add_route('/items/{id}', ItemHandler())
+    return server
+
+
+async def serve(server):
+    parser = server._make_parser()
+    writer = NullWriter()
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        parser.feed_data(RAW)
+        await server._send_response(parser.requests.popleft(), writer, 1)
+    return (time.perf_counter() - start) / REQUESTS
+
+
+def main():
+    for name, metrics in (('metrics off', None), ('metrics on', Metrics())):
+        best = min(asyncio.run(serve(make_server(metrics)))
+                   for _ in range(5))
+        print('%-12s %6.2f us per request' % (name, best * 1e6))
+
+
+if __name__ == '__main__':
+    main()
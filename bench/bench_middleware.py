@@ -0,0 +1,102 @@
+"""Measures the time middleware adds to each request, with 0, 5 and 20
+middlewares that each define one of the two hooks, run by the compiled
+chain and by the old loop that awaited both hooks of every middleware.
+
+    python3 bench_middleware.py
+"""
+import asyncio
+import time
+from albatross import Request, Response, Server
+from albatross.codecs import JSON_TYPE
+from albatross.http_error import HTTPError
+from albatross.middleware import Middleware
+
+
+class Stamp(Middleware):
+    async def process_request(self, req, res, handler):
+        req.stamped = True
+
+
+class Header(Middleware):
+    async def process_response(self, req, res, handler):
+        res.headers['X-Header'] = '1'
+
+
+class Handler:
+    async def on_get(self, req, res):
+        res.write('hello')
+
+
+class OldServer(Server):
+    """Runs middleware the way `_respond` did before chains."""
+
+    async def _respond(self, req, res, trace=None):
+        try:
+            handler = req._handler
+            res._codec = req._codec(JSON_TYPE)
+            if req.error is not None:
+                raise req.error
+            endpoint = req._endpoint
+            if (endpoint is not None and endpoint.offload_form and
+                    req._offload_form()):
+                await self.executor.run_in_thread(lambda: req.form)
+            answered = False
+            ran = 0
+            timeout = None if req._websocket else self.handler_timeout
+            for middleware in self._middleware.middleware:
+                ran += 1
+                if await middleware.process_request(req, res, handler):
+                    answered = True
+                    break
+            if not answered:
+                try:
+                    if timeout is None:
+                        await self._dispatch(req, res)
+                    else:
+                        await self._run_with_timeout(req, res)
+                except HTTPError as e:
+                    self.handle_error(res, e)
+            for middleware in self._middleware.middleware[:ran]:
+                await middleware.process_response(req, res, handler)
+        except Exception as e:
+            self.handle_error(res, e)
+
+
+def make_server(cls, count):
+    server = cls()
+    server.add_route('/hello', Handler())
+    for i in range(count):
+        server.add_middleware(Stamp() if i % 2 else Header())
+    return server
+
+
+async def measure(server, number):
+    req = Request()
+    req.on_url(b'/hello')
+    req.method = 'GET'
+    server._route(req)
+    start = time.perf_counter()
+    for _ in range(number):
+        await server._respond(req, Response())
+    return (time.perf_counter() - start) / number
+
+
+def main(number=100000):
+    loop = asyncio.new_event_loop()
+    baseline = {}
+    print('%-6s %12s %12s %14s' % ('chain', 'middleware', 'us/request',
+                                   'us overhead'))
+    for name, cls in (('old', OldServer), ('new', Server)):
+        for count in (0, 5, 20):
+            server = make_server(cls, count)
+            took = loop.run_until_complete(measure(server, number)) * 1e6
+            if count == 0:
+                baseline[name] = took
+            print('%-6s %12d %12.2f %14.2f' % (
+                name, count, took, took - baseline[name]))
+            server.executor.shutdown()
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
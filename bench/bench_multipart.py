@@ -0,0 +1,86 @@
+"""Compares multipart upload parsing with cgi.FieldStorage (where Python
+still ships it) and the incremental parser, by throughput and peak memory.
+
+    python3 bench_multipart.py
+"""
+import io
+import time
+import tracemalloc
+from albatross import Request
+
+try:
+    import cgi
+except ImportError:
+    cgi = None
+
+BOUNDARY = '------------------------5969313f95a69716'
+CHUNK = 2 ** 16
+
+
+def make_body(size):
+    return (
+        b'--%s\r\nContent-Disposition: form-data; name="key1"\r\n\r\n'
+        b'value1\r\n'
+        b'--%s\r\nContent-Disposition: form-data; name="upload"; '
+        b'filename="upload.bin"\r\nContent-Type: application/octet-stream'
+        b'\r\n\r\n%s\r\n--%s--\r\n'
+    ) % (BOUNDARY.encode(), BOUNDARY.encode(), b'x' * size, BOUNDARY.encode())
+
+
+def make_request():
+    req = Request()
+    req.on_header(b'Content-Type',
+                  b'multipart/form-data; boundary=' + BOUNDARY.encode())
+    return req
+
+
+def parse_cgi(body):
+    # what Request did before: buffer the body, then hand it to cgi
+    req = make_request()
+    req.on_headers_complete()
+    buffered = io.BytesIO()
+    for i in range(0, len(body), CHUNK):
+        buffered.write(body[i:i + CHUNK])
+    buffered.seek(0)
+    headers = {'content-type': req.headers['Content-Type'],
+               'content-length': str(len(body))}
+    form = cgi.FieldStorage(buffered, headers=headers,
+                            environ={'REQUEST_METHOD': 'POST'})
+    return form['upload'].value
+
+
+def parse_incremental(body):
+    req = make_request()
+    req.on_headers_complete()
+    for i in range(0, len(body), CHUNK):
+        req.on_body(body[i:i + CHUNK])
+    req.on_message_complete()
+    return req.form['upload'].file
+
+
+def measure(parse, body):
+    tracemalloc.start()
+    start = time.perf_counter()
+    parse(body)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parsers = [('incremental', parse_incremental)]
+    if cgi is not None:
+        parsers.insert(0, ('cgi', parse_cgi))
+    print('%8s  %-12s %10s %12s' % ('upload', 'parser', 'MB/s', 'peak MB'))
+    for megabytes in (1, 8, 32):
+        body = make_body(megabytes * 2 ** 20)
+        for name, parse in parsers:
+            elapsed, peak = measure(parse, body)
+            rate = len(body) / elapsed / 2 ** 20
+            print('%6dMB  %-12s %10.1f %12.1f' % (
+                megabytes, name, rate, peak / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Measures the latency of a fast route while a CPU-heavy route is being
+hammered, with the heavy work run on the event loop, in the thread pool
+and in the process pool.
+
+On the event loop every fast request waits behind the heavy ones. In a
+thread the loop still shares the GIL with the work, but gets it back
+every switch interval. In a process the work only competes for the CPU.
+The load generator runs on the same machine, so give it a core of its
+own.
+
+    python3 bench_offload.py
+"""
+import asyncio
+import os
+import subprocess
+import sys
+from loadgen import Scenario, run
+from run_suite import free_port, wait_for_port
+
+DURATION = 5
+FAST_CONNECTIONS = 10
+HEAVY_CONNECTIONS = 20
+
+
+def work(n=200000):
+    # about 10ms of pure Python
+    total = 0
+    for i in range(n):
+        total += i * i
+    return total
+
+
+def serve(port, mode):
+    from albatross import Server
+    from albatross.executor import Executor, offload
+
+    app = Server(engine='protocol', executor=Executor(processes=2))
+
+    class FastHandler:
+        async def on_get(self, req, res):
+            res.write('fast')
+
+    class InlineHandler:
+        async def on_get(self, req, res):
+            res.write(str(work()))
+
+    class ThreadHandler:
+        @offload
+        def on_get(self, req, res):
+            res.write(str(work()))
+
+    class ProcessHandler:
+        async def on_get(self, req, res):
+            res.write(str(await app.executor.run_in_process(work)))
+
+    heavy = {'inline': InlineHandler, 'thread': ThreadHandler,
+             'process': ProcessHandler}[mode]
+    app.add_route('/fast', FastHandler())
+    app.add_route('/heavy', heavy())
+    app.serve(port=port, host='127.0.0.1')
+
+
+async def load(port):
+    return await asyncio.gather(
+        run(Scenario('fast', '/fast'), '127.0.0.1', port, FAST_CONNECTIONS,
+            DURATION),
+        run(Scenario('heavy', '/heavy'), '127.0.0.1', port,
+            HEAVY_CONNECTIONS, DURATION))
+
+
+def bench(mode):
+    port = free_port()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [os.path.dirname(os.path.abspath(os.path.dirname(
+            __file__))), env.get('PYTHONPATH')]))
+    process = subprocess.Popen(
+        [sys.executable, __file__, 'serve', str(port), mode],
+        env=env, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, process)
+        return asyncio.run(load(port))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    if sys.argv[1:2] == ['serve']:
+        return serve(int(sys.argv[2]), sys.argv[3])
+    for mode in ('inline', 'thread', 'process'):
+        fast, heavy = bench(mode)
+        print('%-8s fast p50 %7.2f ms  p99 %7.2f ms  %7.1f req/s   '
+              'heavy %6.1f req/s  %d errors' % (
+                  mode, fast['p50_ms'], fast['p99_ms'], fast['req_per_sec'],
+                  heavy['req_per_sec'], heavy['errors']))
+
+
+if __name__ == '__main__':
+    main()
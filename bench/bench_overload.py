@@ -0,0 +1,85 @@
+"""Overloads a server whose handler can only keep up with a fraction of the
+offered load, with and without connection and in-flight limits, and
+reports latency, shed requests and memory for each.
+
+Without limits every connection is accepted and every request waits its
+turn, so latency and memory grow with the load. With limits the excess is
+answered straight away with 503, and the requests that are admitted keep
+a steady latency. Latencies are those of successful requests. The load
+generator runs on the same machine, so give it a core of its own.
+
+    python3 bench_overload.py
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from loadgen import Scenario, run
+from run_suite import free_port, memory, wait_for_port
+
+CONNECTIONS = 500
+DURATION = 5
+LIMITS = {
+    'max_connections': 400,
+    'max_in_flight': 50,
+    'request_queue_size': 50,
+    'header_timeout': 5,
+    'handler_timeout': 5,
+}
+
+
+def serve(port, limits):
+    from albatross import Server
+
+    class WorkHandler:
+        async def on_get(self, req, res):
+            # wait on a database call while holding a buffer, then spend a
+            # millisecond of CPU, so the server manages ~1000 req/s
+            buffer = bytearray(2 ** 16)
+            await asyncio.sleep(0.01)
+            end = time.process_time() + 0.001
+            while time.process_time() < end:
+                pass
+            res.write('done %d' % len(buffer))
+
+    app = Server(engine='protocol', **limits)
+    app.add_route('/work', WorkHandler())
+    app.serve(port=port, host='127.0.0.1')
+
+
+def bench(name, limits):
+    port = free_port()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [os.path.dirname(os.path.abspath(os.path.dirname(
+            __file__))), env.get('PYTHONPATH')]))
+    process = subprocess.Popen(
+        [sys.executable, __file__, 'serve', str(port), json.dumps(limits)],
+        env=env, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, process)
+        result = asyncio.run(run(Scenario(name, '/work'), '127.0.0.1', port,
+                                 CONNECTIONS, DURATION))
+        result['rss_kb'], result['peak_rss_kb'] = memory(process.pid)
+        return result
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    if sys.argv[1:2] == ['serve']:
+        return serve(int(sys.argv[2]), json.loads(sys.argv[3]))
+    for name, limits in (('unlimited', {}), ('limited', LIMITS)):
+        result = bench(name, limits)
+        print('%-10s %8.1f req/s  p50 %8.1f ms  p99 %8.1f ms  '
+              '%6d shed  peak rss %d KiB' % (
+                  name, result['req_per_sec'], result['p50_ms'],
+                  result['p99_ms'], result['errors'],
+                  result['peak_rss_kb'] or 0))
+
+
+if __name__ == '__main__':
+    main()
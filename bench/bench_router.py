@@ -0,0 +1,52 @@
+"""Times route lookup against the number of registered routes, comparing
+the segment trie with the old linear regex scan.
+
+    python3 bench_router.py
+"""
+import re
+from timeit import timeit
+from albatross.router import Router
+
+
+class LinearRouter:
+    def __init__(self):
+        self._handlers = []
+
+    def add(self, route, handler):
+        route = re.sub('{([-_a-zA-Z]+)}', '(?P<\\g<1>>[^/?]+)', route)
+        self._handlers.append((re.compile(route + '$'), handler))
+
+    def get(self, path):
+        for route, handler in self._handlers:
+            match = route.match(path)
+            if match:
+                return handler, match.groupdict()
+        return None, None
+
+
+def build(router, n):
+    for i in range(n):
+        router.add('/resource%d' % i, i)
+        router.add('/resource%d/{id}/detail' % i, i)
+    return router
+
+
+def main(number=20000):
+    print('%6s  %-22s %9s %9s %9s' % (
+        'routes', 'path', 'linear', 'trie', 'cached'))
+    for n in (10, 100, 400, 1000):
+        routers = [build(LinearRouter(), n // 2), build(Router(), n // 2),
+                   build(Router(cache_size=1024), n // 2)]
+        last = n // 2 - 1
+        for path in ('/resource0', '/resource%d' % last,
+                     '/resource%d/42/detail' % last):
+            times = [
+                timeit(lambda: r.get(path), number=number) / number * 1e6
+                for r in routers
+            ]
+            print('%6d  %-22s %7.2fus %7.2fus %7.2fus' % (
+                (n, path) + tuple(times)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""Times publishing an event to many subscribers of a `Channel`, which
+encodes it once, against encoding it for each subscriber.
+
+    python3 bench_sse.py
+"""
+from timeit import timeit
+from albatross.sse import Channel, encode_event
+
+
+def main(number=200):
+    message = 'x' * 200
+    print('%12s %12s %12s' % ('subscribers', 'each', 'channel'))
+    for count in (10, 100, 1000):
+        channel = Channel(max_queue=number + 1)
+        for _ in range(count):
+            channel.subscribe()
+        each = timeit(lambda: [encode_event(message, id=1)
+                               for _ in range(count)], number=number)
+        once = timeit(lambda: channel.publish(message), number=number)
+        print('%12d %9.1f us %9.1f us' % (
+            count, each / number * 1e6, once / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
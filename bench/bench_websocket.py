@@ -0,0 +1,37 @@
+"""Times unmasking WebSocket payloads, comparing `apply_mask` with a
+byte by byte loop, and the cost of `broadcast` serializing once against
+encoding a frame per socket.
+
+    python3 bench_websocket.py
+"""
+import os
+from timeit import timeit
+from albatross.websocket import OP_TEXT, apply_mask, encode_frame
+
+
+def bytewise_mask(data, mask):
+    return bytes(b ^ mask[i & 3] for i, b in enumerate(data))
+
+
+def main(number=200):
+    mask = os.urandom(4)
+    print('%8s %12s %12s' % ('bytes', 'bytewise', 'apply_mask'))
+    for size in (16, 1024, 65536):
+        data = os.urandom(size)
+        times = [timeit(lambda: f(data, mask), number=number) / number
+                 for f in (bytewise_mask, apply_mask)]
+        print('%8d %9.2f us %9.2f us' % (
+            size, times[0] * 1e6, times[1] * 1e6))
+
+    message = 'x' * 200
+    sockets = 1000
+    each = timeit(lambda: [encode_frame(OP_TEXT, message.encode())
+                           for _ in range(sockets)], number=number) / number
+    once = timeit(lambda: encode_frame(OP_TEXT, message.encode()),
+                  number=number) / number
+    print('a frame for %d sockets: %.1f us encoding each, %.1f us once' % (
+        sockets, each * 1e6, once * 1e6))
+
+
+if __name__ == '__main__':
+    main()
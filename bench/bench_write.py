@@ -0,0 +1,128 @@
+"""Counts write calls and bytes copied per response, and times sending it
+over a real socket, for the old per-header writes and the single buffer.
+
+Responses go through the event loop's own socket transport to a peer
+that reads them in the same loop, so the times include the send()
+syscalls that each write to an idle transport costs. Bytes copied are
+the peak memory tracemalloc sees allocated while a response is sent:
+the joined buffers, and whatever the transport copies into its own
+buffer when the socket doesn't take everything at once.
+
+    python3 bench_write.py
+"""
+import asyncio
+import socket
+import time
+import tracemalloc
+from albatross import Response, Server
+
+
+class CountingWriter:
+    """Passes writes on to a transport, counting them and the bytes."""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.calls = 0
+        self.bytes = 0
+
+    def write(self, data):
+        self.calls += 1
+        self.bytes += len(data)
+        self.transport.write(data)
+
+    def writelines(self, data):
+        self.calls += 1
+        data = list(data)
+        self.bytes += sum(len(chunk) for chunk in data)
+        self.transport.writelines(data)
+
+
+def old_write_response(res, writer, keep_alive=True):
+    res.headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+    writer.write(b'HTTP/1.1 %s\r\n' % res.status_code.encode())
+    if 'Content-Length' not in res.headers:
+        length = sum(len(x) for x in res._chunks)
+        res.headers['Content-Length'] = str(length)
+    for key, value in res.headers.items():
+        writer.write(key.encode() + b': ' + str(value).encode() + b'\r\n')
+    for key, value in res.cookies.items():
+        writer.write(b'Set-Cookie: %s=%s\r\n' % (
+            key.encode(), str(value).encode()))
+    writer.write(b'\r\n')
+    for chunk in res._chunks:
+        writer.write(chunk)
+
+
+def make_response(size, chunks):
+    res = Response()
+    res.headers['Cache-Control'] = 'no-cache'
+    res.cookies['session'] = 'abc123'
+    for _ in range(chunks):
+        res.write_bytes(b'x' * (size // chunks))
+    return res
+
+
+async def connect(loop):
+    ours, peer = socket.socketpair()
+    peer.setblocking(False)
+    transport, _ = await loop.connect_accepted_socket(asyncio.Protocol, ours)
+    return transport, peer
+
+
+async def send(loop, write, res, transport, peer, buffer):
+    """Writes a response and reads all of it on the other end."""
+    writer = CountingWriter(transport)
+    write(res, writer)
+    received = 0
+    while received < writer.bytes:
+        received += await loop.sock_recv_into(peer, buffer)
+    return writer.calls
+
+
+async def measure(loop, write, res, number):
+    transport, peer = await connect(loop)
+    buffer = bytearray(2 ** 20)
+    calls = await send(loop, write, res, transport, peer, buffer)
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    await send(loop, write, res, transport, peer, buffer)
+    copied = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    best = None
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(number):
+            await send(loop, write, res, transport, peer, buffer)
+        took = (time.perf_counter() - start) / number
+        best = took if best is None else min(best, took)
+    transport.close()
+    peer.close()
+    return calls, copied, best
+
+
+def main(number=2000):
+    loop = asyncio.new_event_loop()
+    server = Server()
+
+    def new(res, writer):
+        server._write_response(res, writer, keep_alive=True)
+    print('%-14s %-6s %6s %9s %9s' % ('response', 'impl', 'writes',
+                                      'copied', 'time'))
+    for label, size, chunks in (('small json', 64, 1),
+                                ('4 chunks', 4096, 4),
+                                ('1MB body', 2 ** 20, 16)):
+        for impl, write in (('old', old_write_response), ('new', new)):
+            res = make_response(size, chunks)
+            n = number if size < 2 ** 20 else number // 20
+            calls, copied, took = loop.run_until_complete(
+                measure(loop, write, res, n))
+            print('%-14s %-6s %6d %9d %7.2fus' % (
+                label, impl, calls, copied, took * 1e6))
+    server.executor.shutdown()
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""A small asyncio HTTP load generator.
+
+Each connection sends one request at a time and times it until its
+response is complete, so latency percentiles include queueing in the
+server but not in the client.
+
+    python3 loadgen.py http://127.0.0.1:8000/hello -c 50 -d 5
+"""
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+from httptools import HttpResponseParser
+
+
+class Scenario:
+    """A request sent over and over.
+
+    Attributes:
+        name (str): reported with the results
+        method (str):
+        path (str):
+        headers (list): extra (name, value) pairs
+        body (bytes):
+        keep_alive (bool): reuse connections, or open one per request
+    """
+
+    def __init__(self, name, path, method='GET', headers=(), body=b'',
+                 keep_alive=True):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.headers = list(headers)
+        self.body = body
+        self.keep_alive = keep_alive
+
+    def encode(self, host):
+        lines = ['%s %s HTTP/1.1' % (self.method, self.path),
+                 'Host: %s' % host]
+        lines.extend('%s: %s' % header for header in self.headers)
+        if self.body:
+            lines.append('Content-Length: %d' % len(self.body))
+        if not self.keep_alive:
+            lines.append('Connection: close')
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode() + self.body
+
+
+class _Response:
+    def __init__(self):
+        self.parser = HttpResponseParser(self)
+        self.complete = False
+
+    def on_message_complete(self):
+        self.complete = True
+
+
+async def _read_response(reader):
+    response = _Response()
+    while not response.complete:
+        data = await reader.read(2 ** 16)
+        if not data:
+            raise ConnectionResetError('Server closed the connection')
+        response.parser.feed_data(data)
+    parser = response.parser
+    return parser.get_status_code(), parser.should_keep_alive()
+
+
+async def _connection(host, port, request, keep_alive, deadline, results):
+    reader = writer = None
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            status, reusable = await _read_response(reader)
+            results['responses'] += 1
+            if status >= 400:
+                results['errors'] += 1
+            else:
+                results['latencies'].append(time.perf_counter() - start)
+            if not keep_alive or not reusable:
+                writer.close()
+                writer = None
+    except (OSError, ValueError):
+        results['errors'] += 1
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def run(scenario, host, port, connections=50, duration=5.0):
+    """Drives the scenario from `connections` connections for `duration`
+    seconds.
+
+    :return: a dict of req/s, error count and the latency percentiles of
+        successful requests in ms
+    """
+    results = {'latencies': [], 'errors': 0, 'responses': 0}
+    request = scenario.encode('%s:%d' % (host, port))
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(
+        _connection(host, port, request, scenario.keep_alive, deadline,
+                    results)
+        for _ in range(connections)
+    ))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(results['latencies'])
+
+    def ms(fraction):
+        value = percentile(latencies, fraction)
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        'scenario': scenario.name,
+        'requests': results['responses'],
+        'errors': results['errors'],
+        'req_per_sec': round(results['responses'] / elapsed, 1),
+        'p50_ms': ms(0.5),
+        'p99_ms': ms(0.99),
+        'p999_ms': ms(0.999),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('url')
+    parser.add_argument('-c', '--connections', type=int, default=50)
+    parser.add_argument('-d', '--duration', type=float, default=5)
+    parser.add_argument('-m', '--method', default='GET')
+    parser.add_argument('--close', action='store_true',
+                        help='open a new connection for every request')
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    path = url.path + ('?' + url.query if url.query else '')
+    scenario = Scenario(path, path or '/', args.method,
+                        keep_alive=not args.close)
+    result = asyncio.run(run(scenario, url.hostname, url.port or 80,
+                             args.connections, args.duration))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,10 @@
+import json
+import os
 from aiohttp import web
 from urllib.parse import parse_qs
 
+LARGE = b'x' * 2 ** 20
+
 
 async def hello(request):
     return web.Response(body=b'Hello World')
@@ -8,13 +12,39 @@ async def hello(request):
 
 async def form(request):
     data = await request.read()
-    body = data.decode()
     form = parse_qs(data)
     num_fields = len(list(form.keys()))
     return web.Response(body=b'Found %d keys.' % num_fields)
 
 
-app = web.Application()
+async def json_(request):
+    body = json.dumps({
+        'users': [{'id': i, 'name': 'user %d' % i} for i in range(20)]
+    })
+    return web.Response(text=body, content_type='application/json')
+
+
+async def upload(request):
+    data = await request.post()
+    size = len(data['upload'].file.read())
+    return web.Response(body=b'Received %d bytes.' % size)
+
+
+async def large(request):
+    return web.Response(body=LARGE)
+
+
+async def item(request):
+    return web.Response(text='Item %s' % request.match_info['id'])
+
+
+app = web.Application(client_max_size=2 ** 24)
 app.router.add_route('GET', '/hello', hello)
 app.router.add_route('POST', '/form', form)
-web.run_app(app, port=8000)
+app.router.add_route('GET', '/json', json_)
+app.router.add_route('POST', '/upload', upload)
+app.router.add_route('GET', '/large', large)
+for i in range(100):
+    app.router.add_route('GET', '/resource%d/{id}' % i, item)
+web.run_app(app, port=int(os.environ.get('PORT', 8000)), print=None,
+            access_log=None)
@@ -1,5 +1,9 @@
+import os
+import sys
 from albatross import Server
 
+LARGE = b'x' * 2 ** 20
+
 
 class Handler:
     async def on_get(self, req, res):
@@ -12,7 +16,37 @@ class FormHandler:
         res.write('Found %d keys.' % num_fields)
 
 
-app = Server()
+class JsonHandler:
+    async def on_get(self, req, res):
+        res.write_json({
+            'users': [{'id': i, 'name': 'user %d' % i} for i in range(20)]
+        })
+
+
+class UploadHandler:
+    async def on_post(self, req, res):
+        upload = req.form['upload']
+        res.write('Received %d bytes.' % len(upload.value))
+
+
+class LargeHandler:
+    async def on_get(self, req, res):
+        res.write_bytes(LARGE)
+
+
+class ItemHandler:
+    async def on_get(self, req, res):
+        res.write('Item %s' % req.args['id'])
+
+
+# pass 'protocol' to compare against the default stream engine
+engine = sys.argv[1] if len(sys.argv) > 1 else 'stream'
+app = Server(engine=engine)
 app.add_route('/hello', Handler())
 app.add_route('/form', FormHandler())
-app.serve(port=8000)
+app.add_route('/json', JsonHandler())
+app.add_route('/upload', UploadHandler())
+app.add_route('/large', LargeHandler())
+for i in range(100):
+    app.add_route('/resource%d/{id}' % i, ItemHandler())
+app.serve(port=int(os.environ.get('PORT', 8000)))
@@ -1,9 +1,13 @@
+import os
 from flask import Flask
-from time import sleep
 
-app = Flask()
+app = Flask(__name__)
 
 
 @app.route('/hello')
 def hello():
-    sleep(0.1)
+    return 'Hello World'
+
+
+if __name__ == '__main__':
+    app.run(port=int(os.environ.get('PORT', 8000)), threaded=True)
@@ -0,0 +1,159 @@
+"""Benchmarks each server in bench/ against the same scenarios.
+
+Every server is started on a free localhost port and driven by loadgen.py.
+Results are printed, and written as JSON with --output, so runs from
+different releases can be compared.
+
+    python3 run_suite.py --duration 5 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from loadgen import Scenario, run
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVERS = {
+    'albatross': ['run_albatross.py', 'stream'],
+    'albatross-protocol': ['run_albatross.py', 'protocol'],
+    'aiohttp': ['run_aiohttp.py'],
+    'tornado': ['run_tornado.py'],
+}
+BOUNDARY = 'benchmarkboundary'
+
+
+def multipart_body(size):
+    return (
+        b'--%s\r\nContent-Disposition: form-data; name="upload"; '
+        b'filename="upload.bin"\r\nContent-Type: application/octet-stream'
+        b'\r\n\r\n%s\r\n--%s--\r\n'
+    ) % (BOUNDARY.encode(), b'x' * size, BOUNDARY.encode())
+
+
+def scenarios():
+    with open(os.path.join(HERE, 'data.txt'), 'rb') as f:
+        form = f.read().strip()
+    return [
+        Scenario('hello', '/hello'),
+        Scenario('hello-close', '/hello', keep_alive=False),
+        Scenario('form', '/form', 'POST', body=form, headers=[
+            ('Content-Type', 'application/x-www-form-urlencoded')]),
+        Scenario('json', '/json'),
+        Scenario('upload', '/upload', 'POST', body=multipart_body(2 ** 16),
+                 headers=[('Content-Type',
+                           'multipart/form-data; boundary=' + BOUNDARY)]),
+        Scenario('large', '/large'),
+        Scenario('many-routes', '/resource99/42'),
+    ]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def memory(pid):
+    """Reads the current and peak resident set size of a process in KiB,
+    where /proc is available."""
+    sizes = {}
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'VmHWM'):
+                    sizes[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return sizes.get('VmRSS'), sizes.get('VmHWM')
+
+
+def bench_server(name, args, options):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port))
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [os.path.dirname(HERE), env.get('PYTHONPATH')]))
+    process = subprocess.Popen(
+        [sys.executable] + args, cwd=HERE, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        if not wait_for_port(port, process):
+            error = process.stderr.read().decode().strip().split('\n')[-1] \
+                if process.poll() is not None else 'did not start'
+            print('%s: skipped (%s)' % (name, error), file=sys.stderr)
+            return None
+
+        results = []
+        for scenario in scenarios():
+            if options.scenario and scenario.name not in options.scenario:
+                continue
+            # a short warm-up, so imports and caches don't count
+            asyncio.run(run(scenario, '127.0.0.1', port, options.connections,
+                            min(1, options.duration)))
+            result = asyncio.run(run(scenario, '127.0.0.1', port,
+                                     options.connections, options.duration))
+            result['rss_kb'], result['peak_rss_kb'] = memory(process.pid)
+            print('%-20s %-12s %10.1f req/s  p50 %8.3f ms  p99 %8.3f ms' % (
+                name, scenario.name, result['req_per_sec'],
+                result['p50_ms'] or 0, result['p99_ms'] or 0),
+                file=sys.stderr)
+            results.append(result)
+        return results
+    finally:
+        process.terminate()
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-s', '--server', action='append',
+                        choices=sorted(SERVERS))
+    parser.add_argument('--scenario', action='append')
+    parser.add_argument('-c', '--connections', type=int, default=50)
+    parser.add_argument('-d', '--duration', type=float, default=5)
+    parser.add_argument('-o', '--output')
+    options = parser.parse_args()
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'connections': options.connections,
+        'duration': options.duration,
+        'servers': {},
+    }
+    for name in options.server or SERVERS:
+        results = bench_server(name, SERVERS[name], options)
+        if results is not None:
+            report['servers'][name] = results
+
+    output = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
+import os
 import tornado.ioloop
 import tornado.web
 
+LARGE = b'x' * 2 ** 20
+
 
 class MainHandler(tornado.web.RequestHandler):
     def get(self):
@@ -14,14 +17,42 @@ class FormHandler(tornado.web.RequestHandler):
         self.write('Found %d keys.' % num_fields)
 
 
+class JsonHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write({
+            'users': [{'id': i, 'name': 'user %d' % i} for i in range(20)]
+        })
+
+
+class UploadHandler(tornado.web.RequestHandler):
+    def post(self):
+        size = len(self.request.files['upload'][0]['body'])
+        self.write('Received %d bytes.' % size)
+
+
+class LargeHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write(LARGE)
+
+
+class ItemHandler(tornado.web.RequestHandler):
+    def get(self, id):
+        self.write('Item %s' % id)
+
+
 def make_app():
     return tornado.web.Application([
         (r'/hello', MainHandler),
         (r'/form', FormHandler),
+        (r'/json', JsonHandler),
+        (r'/upload', UploadHandler),
+        (r'/large', LargeHandler),
+    ] + [
+        (r'/resource%d/([^/]+)' % i, ItemHandler) for i in range(100)
     ])
 
 
 if __name__ == '__main__':
     app = make_app()
-    app.listen(8000)
+    app.listen(int(os.environ.get('PORT', 8000)))
     tornado.ioloop.IOLoop.current().start()
@@ -33,14 +33,25 @@ setup(
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ],
     keywords='web http server async',
     packages=['albatross'],
+    # socket.create_server, loop.sendfile and asyncio.current_task
+    python_requires='>=3.8',
     install_requires=[
         'httptools',
     ],
     extras_require={
-        'ujson': ['ujson']
+        'ujson': ['ujson'],
+        'orjson': ['orjson'],
+        'brotli': ['brotli'],
+        'h2': ['h2'],
     },
 )
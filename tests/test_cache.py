@@ -0,0 +1,232 @@
+import unittest
+import asyncio
+from albatross import Request, Response, Server
+from albatross.cache import ResponseCache, CacheEntry
+from albatross.status_codes import HTTP_200, HTTP_304, HTTP_404
+
+
+class CachedHandler:
+    cache_ttl = 60
+    cache_query = ('page',)
+
+    def __init__(self):
+        self.calls = 0
+
+    async def on_get(self, req, res):
+        self.calls += 1
+        await asyncio.sleep(0)
+        res.write('page %s' % req.query.get('page'))
+
+
+class LeaderHandler:
+    cache_ttl = 60
+
+    def __init__(self):
+        self.leader = None
+        self.started = asyncio.Event()
+
+    async def on_get(self, req, res):
+        if self.leader is None:
+            res.write('fine')
+            return
+        self.started.set()
+        if self.leader == 'fail':
+            await asyncio.sleep(0.01)
+            raise RuntimeError('failed')
+        if self.leader == 'slow':
+            await asyncio.sleep(0.01)
+            res.write('slow')
+            return
+        await asyncio.Event().wait()
+
+
+class UncacheableHandler:
+    cache_ttl = 60
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.pending = []
+
+    async def on_get(self, req, res):
+        # whether another request was left waiting on this one
+        self.pending.append(bool(self.cache._pending))
+        await asyncio.sleep(0.01)
+        res.status_code = HTTP_404
+
+
+class FailingMiddleware:
+    async def process_response(self, req, res, handler):
+        raise RuntimeError('failed')
+
+
+def make_request(url, headers=()):
+    req = Request(method='GET', args={})
+    req.on_url(url)
+    for name, value in headers:
+        req.on_header(name, value)
+    req.on_headers_complete()
+    return req
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.cache = ResponseCache()
+        self.handler = CachedHandler()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def respond(self, req):
+        async def go():
+            res = Response()
+            if not await self.cache.process_request(req, res, self.handler):
+                await self.handler.on_get(req, res)
+            await self.cache.process_response(req, res, self.handler)
+            return res
+        return go()
+
+    def get(self, url, headers=()):
+        return self.loop.run_until_complete(
+            self.respond(make_request(url, headers)))
+
+    def test_hit_and_vary(self):
+        res = self.get(b'/a?page=1&other=x')
+        assert res._chunks == [b'page 1']
+        res = self.get(b'/a?page=1&other=y')
+        assert res._chunks == [b'page 1']
+        assert self.handler.calls == 1
+        res = self.get(b'/a?page=2')
+        assert res._chunks == [b'page 2']
+        assert self.handler.calls == 2
+
+    def test_not_modified(self):
+        etag = self.get(b'/a').headers['ETag']
+        res = self.get(b'/a', [(b'If-None-Match', etag.encode())])
+        assert res.status_code == HTTP_304
+        assert res._chunks == []
+        assert res.headers['ETag'] == etag
+
+    def test_coalescing(self):
+        async def go():
+            return await asyncio.gather(*[
+                self.respond(make_request(b'/a')) for _ in range(5)])
+        responses = self.loop.run_until_complete(go())
+        assert self.handler.calls == 1
+        assert all(r._chunks == [b'page None'] for r in responses)
+
+    def test_uncached(self):
+        self.handler.cache_ttl = None
+        self.get(b'/a')
+        self.get(b'/a')
+        assert self.handler.calls == 2
+
+    def test_errors_not_cached(self):
+        async def not_found(req, res):
+            self.handler.calls += 1
+            res.status_code = HTTP_404
+        self.handler.on_get = not_found
+        self.get(b'/a')
+        self.get(b'/a')
+        assert self.handler.calls == 2
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_bytes=10)
+        for key in 'abc':
+            cache.set(key, CacheEntry(HTTP_200, [], b'xxxx', '"x"', 1e18))
+        assert cache.get('a') is None
+        assert cache.get('b') is not None
+        cache.set('d', CacheEntry(HTTP_200, [], b'xxxx', '"x"', 1e18))
+        assert cache.get('c') is None
+        assert cache.size == 8
+
+    def test_ttl(self):
+        self.cache.set('a', CacheEntry(HTTP_200, [], b'x', '"x"', 0))
+        assert self.cache.get('a') is None
+        assert self.cache.size == 0
+
+    def test_leader_fails(self):
+        handler = LeaderHandler()
+        server = Server()
+        server.add_middleware(self.cache)
+        server.add_route('/a', handler)
+
+        def respond(res):
+            req = make_request(b'/a')
+            server._route(req)
+            return asyncio.ensure_future(server._respond(req, res))
+
+        async def go(leader):
+            handler.leader = leader
+            handler.started.clear()
+            task = respond(Response())
+            await handler.started.wait()
+            handler.leader = None
+            res = Response()
+            follower = respond(res)
+            await asyncio.sleep(0)
+            if leader == 'hang':
+                task.cancel()
+            # the follower runs the handler itself instead of waiting out
+            # coalesce_timeout
+            await asyncio.wait_for(follower, 1)
+            await asyncio.gather(task, return_exceptions=True)
+            return res
+
+        for leader in ('fail', 'hang'):
+            res = self.loop.run_until_complete(go(leader))
+            assert res._chunks == [b'fine']
+            assert not self.cache._pending
+            self.cache.clear()
+        server.executor.shutdown()
+
+    def test_leader_not_cacheable(self):
+        handler = UncacheableHandler(self.cache)
+
+        async def go():
+            return await asyncio.gather(*[
+                self.loop.create_task(self.respond(make_request(b'/a')))
+                for _ in range(5)])
+        self.handler = handler
+        responses = self.loop.run_until_complete(go())
+        assert all(r.status_code == HTTP_404 for r in responses)
+        # the first request ran alone, and the others then all ran at
+        # once, none of them waiting on another
+        assert handler.pending == [True, False, False, False, False]
+        assert not self.cache._pending
+
+    def test_response_hook_fails(self):
+        handler = LeaderHandler()
+        server = Server()
+        server.add_middleware(FailingMiddleware())
+        server.add_middleware(self.cache)
+        server.add_route('/a', handler)
+
+        async def connection(closed):
+            req = make_request(b'/a')
+            server._route(req)
+            await server._respond(req, Response())
+            # kept alive for the next request
+            await closed.wait()
+
+        async def go():
+            closed = asyncio.Event()
+            handler.leader = 'slow'
+            leader = asyncio.ensure_future(connection(closed))
+            await handler.started.wait()
+            handler.leader = None
+            req = make_request(b'/a')
+            server._route(req)
+            res = Response()
+            # woken when the leader's response hooks fail, not after
+            # coalesce_timeout or once its connection closes
+            await asyncio.wait_for(server._respond(req, res), 1)
+            closed.set()
+            await leader
+            return res
+
+        res = self.loop.run_until_complete(go())
+        assert res.status_code.startswith('500')
+        assert not self.cache._pending
+        server.executor.shutdown()
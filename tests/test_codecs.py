@@ -0,0 +1,125 @@
+import unittest
+import asyncio
+from aiohttp import client
+from albatross import Request, Response, Server
+from albatross.codecs import (
+    CODECS, JSON_TYPE, JSONCodec, OrjsonCodec, default_codecs, media_type)
+from albatross.compat import orjson
+from tests.test_server import get_free_port
+
+
+class LinesCodec:
+    """Newline-separated values, as a stand-in for a custom codec."""
+
+    def dumps(self, data):
+        return b''.join(b'%s\n' % str(value).encode() for value in data)
+
+    def loads(self, data):
+        return bytes(data).decode().splitlines()
+
+
+class EchoHandler:
+    async def on_post(self, req, res):
+        res.write_json(req.form)
+
+
+class LinesHandler(EchoHandler):
+    codecs = {JSON_TYPE: LinesCodec()}
+
+
+def make_request(body, content_type=b'application/json', spool_size=2 ** 20):
+    req = Request(spool_size=spool_size)
+    req.on_header(b'Content-Type', content_type)
+    req.on_headers_complete()
+    req.on_body(body)
+    req.on_message_complete()
+    return req
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_media_type(self):
+        assert media_type('application/JSON; charset=utf-8') == JSON_TYPE
+        assert media_type('') == ''
+
+    def test_json_codec(self):
+        codec = JSONCodec()
+        data = codec.dumps({'a': [1, 'b']})
+        assert isinstance(data, bytes)
+        assert codec.loads(data) == {'a': [1, 'b']}
+        assert codec.loads(memoryview(b'{"a": 1}')) == {'a': 1}
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_orjson_codec(self):
+        codec = OrjsonCodec()
+        assert codec.dumps({1: 'one'}) == b'{"1":"one"}'
+        assert codec.loads(memoryview(b'{"a": 1}')) == {'a': 1}
+        assert isinstance(default_codecs()[JSON_TYPE], OrjsonCodec)
+
+    def test_request_form(self):
+        for spool_size in (2 ** 20, 4):
+            # parsed from memory, then from a body spooled to disk
+            req = make_request(b'{"my": "name"}', spool_size=spool_size)
+            assert req.form == {'my': 'name'}
+            # the view of the buffer was released, so it can be closed
+            req.reset()
+
+    def test_charset(self):
+        req = make_request(b'[1]', b'application/json; charset=utf-8')
+        assert req.form == [1]
+
+    def test_registry(self):
+        req = Request(codecs=dict(CODECS, **{'text/lines': LinesCodec()}))
+        req.on_header(b'Content-Type', b'text/lines')
+        req.on_headers_complete()
+        req.on_body(b'a\nb\n')
+        req.on_message_complete()
+        assert req.form == ['a', 'b']
+
+    def test_response(self):
+        res = Response()
+        res.write_json({'a': 1})
+        assert res.headers['Content-Type'] == JSON_TYPE
+        assert b''.join(res._chunks) == CODECS[JSON_TYPE].dumps({'a': 1})
+        res = Response()
+        res._codec = LinesCodec()
+        res.write_json([1, 2])
+        assert res._chunks == [b'1\n2\n']
+
+
+class CodecIntegrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = Server(codecs={'text/plain': LinesCodec()})
+        self.server.add_route('/echo', EchoHandler())
+        self.server.add_route('/lines', LinesHandler())
+        self.port = get_free_port()
+        self.url = 'http://127.0.0.1:%d' % self.port
+        self.async_server = self.loop.run_until_complete(
+            self.server.start_server('127.0.0.1', self.port))
+
+    def tearDown(self):
+        self.async_server.close()
+        self.loop.close()
+
+    def post(self, path, **kwargs):
+        async def go():
+            async with client.ClientSession() as session:
+                async with session.post(self.url + path,
+                                        **kwargs) as response:
+                    return await response.read()
+        return self.loop.run_until_complete(asyncio.wait_for(go(), 5))
+
+    def test_server_codecs(self):
+        assert self.post('/echo', json={'a': [1, 2]}) == (
+            self.server.codecs[JSON_TYPE].dumps({'a': [1, 2]}))
+        body = self.post('/echo', data='x\ny',
+                         headers={'Content-Type': 'text/plain'})
+        assert self.server.codecs[JSON_TYPE].loads(body) == ['x', 'y']
+
+    def test_route_codecs(self):
+        # the handler's codec replaces the server's, both ways
+        assert self.post('/lines', data='x\ny',
+                         headers={'Content-Type': JSON_TYPE}) == b'x\ny\n'
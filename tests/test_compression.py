@@ -0,0 +1,80 @@
+import unittest
+import gzip
+from albatross import Request, Response
+from albatross.compat import brotli
+from albatross.compression import Compression, GzipEncoder
+
+BODY = b'{"numbers": [%s]}' % b', '.join(b'%d' % i for i in range(1000))
+
+
+def make_request(accept_encoding):
+    req = Request()
+    req.on_header(b'Accept-Encoding', accept_encoding)
+    req.on_headers_complete()
+    return req
+
+
+def make_response(body=BODY, content_type='application/json'):
+    res = Response()
+    res.headers['Content-Type'] = content_type
+    res.write_bytes(body)
+    return res
+
+
+class CompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.compression = Compression(encodings=('gzip',))
+
+    def test_choose_encoding(self):
+        c = Compression(encodings=('br', 'gzip'))
+        c.encodings = ('br', 'gzip')
+        choose = c.choose_encoding
+        assert choose(make_request(b'gzip, deflate')) == 'gzip'
+        assert choose(make_request(b'br;q=0.5, gzip')) == 'br'
+        assert choose(make_request(b'br;q=0, gzip;q=0')) is None
+        assert choose(make_request(b'*')) == 'br'
+        assert choose(Request()) is None
+
+    def test_compress_response(self):
+        res = make_response()
+        res.headers['ETag'] = '"abc"'
+        self.compression.compress_response(make_request(b'gzip'), res)
+        assert res.headers['Content-Encoding'] == 'gzip'
+        assert res.headers['Vary'] == 'Accept-Encoding'
+        assert res.headers['ETag'] == 'W/"abc"'
+        assert gzip.decompress(b''.join(res._chunks)) == BODY
+
+    def test_skipped(self):
+        for res in (make_response(b'{}'),
+                    make_response(content_type='image/png')):
+            self.compression.compress_response(make_request(b'gzip'), res)
+            assert 'Content-Encoding' not in res.headers
+        res = make_response()
+        self.compression.compress_response(make_request(b'identity'), res)
+        assert 'Content-Encoding' not in res.headers
+        assert res.headers['Vary'] == 'Accept-Encoding'
+
+    def test_variants(self):
+        variants = {}
+        res = make_response()
+        res._variants = variants
+        self.compression.compress_response(make_request(b'gzip'), res)
+        assert gzip.decompress(variants['gzip']) == BODY
+        variants['gzip'] = b'precompressed'
+        res = make_response()
+        res._variants = variants
+        self.compression.compress_response(make_request(b'gzip'), res)
+        assert res._chunks == [b'precompressed']
+
+    def test_gzip_encoder(self):
+        encoder = GzipEncoder(6)
+        data = encoder.compress(BODY[:100]) + encoder.compress(BODY[100:])
+        assert gzip.decompress(data + encoder.finish()) == BODY
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+        res = make_response()
+        Compression().compress_response(make_request(b'br, gzip'), res)
+        assert res.headers['Content-Encoding'] == 'br'
+        assert brotli.decompress(b''.join(res._chunks)) == BODY
@@ -1,8 +1,9 @@
 import unittest
 from albatross.data_types import (
     ImmutableMultiDict, CaselessDict,
-    ImmutableCaselessMultiDict
+    ImmutableCaselessMultiDict, Headers
 )
+from albatross.http_error import HTTPError
 
 
 class ImmutableMultiDictTest(unittest.TestCase):
@@ -12,6 +13,12 @@ class ImmutableMultiDictTest(unittest.TestCase):
             z.update({})
         assert z.get_all('one') == ['two', 'three']
         assert z.get_all('two') is None
+        for change in (lambda: z.pop('one'), z.popitem, z.clear,
+                       lambda: z.setdefault('two', []),
+                       lambda: z.__delitem__('one')):
+            with self.assertRaises(TypeError):
+                change()
+        assert z.get_all('one') == ['two', 'three']
 
 
 class CaselessDictTest(unittest.TestCase):
@@ -62,3 +69,44 @@ class ImmutableCaselessMultiDictTest(unittest.TestCase):
 
         assert z.get('three') is None
         assert z.get_all('three') is None
+
+
+class HeadersTest(unittest.TestCase):
+    def test_headers(self):
+        h = Headers([
+            (b'Content-Type', b'text/plain'),
+            (b'X-CUSTOM', b'one'),
+            (b'x-custom', b'two'),
+            (b'Host', b'example.com'),
+        ])
+        assert list(h) == ['content-type', 'x-custom', 'host']
+        assert h['CONTENT-TYPE'] == 'text/plain'
+        assert h.get('X-Custom') == 'one'
+        assert h.get_all('x-custom') == ['one', 'two']
+        assert 'HOST' in h and 'Accept' not in h
+        assert h.get('Accept') is None
+        assert h.get_all('Accept') is None
+        with self.assertRaises(HTTPError):
+            h['Accept']
+        with self.assertRaises(TypeError):
+            h['Accept'] = 'text/html'
+        assert h == ImmutableCaselessMultiDict([
+            ('Content-Type', 'text/plain'), ('X-Custom', 'one'),
+            ('X-Custom', 'two'), ('Host', 'example.com')])
+
+    def test_common_names_are_shared(self):
+        first = Headers([(b'User-Agent', b'a')])
+        second = Headers([(b'user-agent', b'b')])
+        assert next(iter(first)) is next(iter(second))
+
+    def test_values_decoded(self):
+        h = Headers([(b'X-Name', 'café'.encode())])
+        assert dict.__getitem__(h, 'x-name') == ['café']
+        assert h['x-name'] == 'café'
+        assert dict(h) == {**h} == {'x-name': ['café']}
+
+    def test_values_not_utf8(self):
+        h = Headers([(b'X-Name', b'caf\xe9'), (b'X-Other', b'\xff')])
+        value = h['x-name']
+        assert value.encode('utf-8', 'surrogateescape') == b'caf\xe9'
+        assert dict(h.items())['x-other'] == ['\udcff']
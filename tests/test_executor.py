@@ -0,0 +1,187 @@
+import unittest
+import asyncio
+import threading
+import time
+from aiohttp import client, FormData
+from albatross import Server, HTTPError
+from albatross.dispatch import Endpoint
+from albatross.executor import Executor, offload
+from albatross.metrics import Metrics
+from albatross.request import NOT_PARSED
+from tests.test_server import get_free_port
+
+
+class BlockingHandler:
+    @offload
+    def on_get(self, req, res):
+        time.sleep(0.2)
+        res.write(threading.current_thread().name)
+
+    async def on_post(self, req, res):
+        res.write('async')
+
+
+class LegacyHandler:
+    offload = True
+
+    def on_get(self, req, res):
+        res.write('legacy')
+
+
+class FastHandler:
+    async def on_get(self, req, res):
+        res.write('fast')
+
+
+class FormHandler:
+    offload_form = True
+
+    async def on_post(self, req, res):
+        # parsed before the handler was called
+        assert req._form is not NOT_PARSED
+        res.write_json({'keys': sorted(req.form)})
+
+
+class LazyFormHandler:
+    async def on_post(self, req, res):
+        # left for the handler to parse, if it reads it
+        assert req._form is NOT_PARSED
+        res.write_json({'keys': sorted(req.form)})
+
+
+class ExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_thread(self):
+        executor = Executor(threads=2)
+        name = self.loop.run_until_complete(executor.run_in_thread(
+            lambda: threading.current_thread().name))
+        assert name.startswith('albatross')
+        executor.shutdown()
+
+    def test_process(self):
+        executor = Executor(processes=1)
+        assert self.loop.run_until_complete(
+            executor.run_in_process(pow, 2, 10)) == 1024
+        executor.shutdown()
+        with self.assertRaises(RuntimeError):
+            self.loop.run_until_complete(
+                Executor().run_in_process(pow, 2, 10))
+
+    def test_shutdown_joins(self):
+        executor = Executor(threads=1)
+        done = []
+
+        def work():
+            time.sleep(0.05)
+            done.append(True)
+
+        async def go():
+            call = asyncio.ensure_future(executor.run_in_thread(work))
+            await asyncio.sleep(0.01)
+            # returns once the running call has, with the pool stopped
+            executor.shutdown()
+            assert done
+            await call
+        self.loop.run_until_complete(go())
+
+    def test_queue_bound(self):
+        executor = Executor(threads=1, queue_size=1)
+
+        async def go():
+            calls = [asyncio.ensure_future(
+                executor.run_in_thread(time.sleep, 0.05)) for _ in range(3)]
+            await asyncio.sleep(0)
+            limiter = executor.limiters['thread']
+            assert (limiter.active, limiter.waiting) == (1, 1)
+            return await asyncio.gather(*calls, return_exceptions=True)
+        results = self.loop.run_until_complete(go())
+        assert results[:2] == [None, None]
+        assert isinstance(results[2], HTTPError)
+        assert executor.rejected == {'thread': 1}
+        executor.shutdown()
+
+    def test_endpoint(self):
+        executor = Executor()
+        endpoint = Endpoint(LegacyHandler(), executor)
+        assert asyncio.iscoroutinefunction(endpoint.methods['GET'])
+        endpoint = Endpoint(BlockingHandler(), executor)
+        assert endpoint.methods['POST'] == endpoint.handler.on_post
+        with self.assertRaises(ValueError):
+            Endpoint(BlockingHandler())
+
+    def test_metrics(self):
+        metrics = Metrics()
+        Server(metrics=metrics, executor=Executor(processes=2))
+        text = metrics.render()
+        assert 'albatross_executor_active{pool="process"} 0' in text
+        assert 'albatross_executor_queued{pool="thread"} 0' in text
+        assert 'albatross_executor_rejected_total{pool="thread"} 0' in text
+
+
+class OffloadIntegrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = Server(offload_body_size=10)
+        self.server.add_route('/blocking', BlockingHandler())
+        self.server.add_route('/legacy', LegacyHandler())
+        self.server.add_route('/fast', FastHandler())
+        self.server.add_route('/form', FormHandler())
+        self.server.add_route('/lazy', LazyFormHandler())
+        self.port = get_free_port()
+        self.url = 'http://127.0.0.1:%d' % self.port
+        self.async_server = self.loop.run_until_complete(
+            self.server.start_server('127.0.0.1', self.port))
+
+    def tearDown(self):
+        self.async_server.close()
+        self.loop.close()
+        self.server.executor.shutdown()
+
+    def wait(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 5))
+
+    def test_blocking_handler(self):
+        async def get(session, path):
+            async with session.get(self.url + path) as response:
+                return await response.text(), time.monotonic()
+
+        async def go():
+            async with client.ClientSession() as session:
+                return await asyncio.gather(
+                    get(session, '/blocking'), get(session, '/fast'),
+                    get(session, '/legacy'))
+        (blocking, blocked_at), (fast, fast_at), (legacy, _) = self.wait(go())
+        assert blocking.startswith('albatross')
+        assert fast == 'fast' and legacy == 'legacy'
+        # the fast route was answered while the blocking one slept
+        assert fast_at < blocked_at
+
+    def test_large_bodies(self):
+        async def go():
+            async with client.ClientSession() as session:
+                async with session.post(
+                        self.url + '/form',
+                        json={'a': 1, 'b': 'x' * 100}) as response:
+                    assert (await response.json()) == {'keys': ['a', 'b']}
+                async with session.post(
+                        self.url + '/lazy',
+                        json={'a': 1, 'b': 'x' * 100}) as response:
+                    assert (await response.json()) == {'keys': ['a', 'b']}
+                # multipart bodies are parsed as they arrive instead
+                form = FormData()
+                form.add_field('upload', b'y' * 100, filename='y.txt')
+                form.add_field('name', 'value')
+                async with session.post(self.url + '/lazy',
+                                        data=form) as response:
+                    assert (await response.json()) == {
+                        'keys': ['name', 'upload']}
+        self.wait(go())
@@ -0,0 +1,277 @@
+import unittest
+import asyncio
+from aiohttp import client
+from albatross import Server
+from albatross.compat import h2
+from tests.test_server import get_free_port
+
+if h2 is not None:
+    from h2.config import H2Configuration
+    from h2.connection import H2Connection
+    from h2.events import (
+        ConnectionTerminated, DataReceived, ResponseReceived, StreamEnded,
+        StreamReset, TrailersReceived)
+    from h2.exceptions import ProtocolError
+
+BIG = b'x' * 200000
+
+
+class HelloHandler:
+    async def on_get(self, req, res):
+        res.cookies['seen'] = req.headers.get('Host')
+        res.write('Hello %s' % req.query.get('name', 'world'))
+
+    async def on_post(self, req, res):
+        res.write('posted %s' % req.form.get('name'))
+
+
+class BigHandler:
+    async def on_get(self, req, res):
+        res.write_bytes(BIG)
+
+
+class StreamHandler:
+    stream_body = True
+
+    async def on_post(self, req, res):
+        size = 0
+        async for chunk in req.body:
+            size += len(chunk)
+        res.trailers['X-Size'] = size
+        await res.send('got ')
+        await res.send(str(size))
+
+
+class GateHandler:
+    def __init__(self):
+        self.open = asyncio.Event()
+        self.passed = 0
+
+    async def on_get(self, req, res):
+        if req.query.get('open'):
+            self.open.set()
+        else:
+            await self.open.wait()
+        res.write('through')
+        self.passed += 1
+
+
+class Client:
+    """Sends requests over one HTTP/2 connection."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.conn = H2Connection(H2Configuration(
+            client_side=True, header_encoding='utf-8'))
+        self.responses = {}
+        self.task = None
+        self.goaway = None
+
+    @classmethod
+    async def connect(cls, port):
+        client = cls(*await asyncio.open_connection('127.0.0.1', port))
+        client.conn.initiate_connection()
+        client.start()
+        return client
+
+    def start(self):
+        self.writer.write(self.conn.data_to_send())
+        self.task = asyncio.ensure_future(self._read())
+
+    def expect(self, stream_id):
+        response = self.responses[stream_id] = {
+            'data': bytearray(), 'trailers': {},
+            'done': asyncio.get_event_loop().create_future()}
+        return response
+
+    async def _read(self):
+        while True:
+            data = await self.reader.read(2 ** 16)
+            if not data:
+                break
+            try:
+                events = self.conn.receive_data(data)
+            except ProtocolError:
+                # h2 reads nothing more once it has been sent GOAWAY
+                continue
+            for event in events:
+                response = self.responses.get(getattr(event, 'stream_id', 0))
+                if isinstance(event, ResponseReceived):
+                    response['headers'] = dict(event.headers)
+                elif isinstance(event, DataReceived):
+                    response['data'] += event.data
+                    self.conn.acknowledge_received_data(
+                        event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, TrailersReceived):
+                    response['trailers'] = dict(event.headers)
+                elif isinstance(event, StreamEnded):
+                    response['done'].set_result(response)
+                elif isinstance(event, StreamReset):
+                    response['done'].set_exception(
+                        ConnectionResetError('reset'))
+                elif isinstance(event, ConnectionTerminated):
+                    self.goaway = event.last_stream_id
+            self.writer.write(self.conn.data_to_send())
+        for response in self.responses.values():
+            if not response['done'].done():
+                response['done'].set_exception(ConnectionResetError())
+
+    async def request(self, path, method='GET', headers=(), body=b''):
+        stream_id = self.conn.get_next_available_stream_id()
+        response = self.expect(stream_id)
+        self.conn.send_headers(stream_id, [
+            (':method', method), (':path', path), (':scheme', 'http'),
+            (':authority', 'localhost'),
+        ] + list(headers), end_stream=not body)
+        size = self.conn.max_outbound_frame_size
+        for i in range(0, len(body), size):
+            self.conn.send_data(stream_id, body[i:i + size],
+                                end_stream=i + size >= len(body))
+        self.writer.write(self.conn.data_to_send())
+        return await response['done']
+
+    def close(self):
+        self.writer.close()
+        self.task.cancel()
+
+
+@unittest.skipIf(h2 is None, 'h2 is not installed')
+class Http2IntegrationTest(unittest.TestCase):
+    engine = 'stream'
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.gate = GateHandler()
+        self.server = Server(engine=self.engine, http2=True)
+        self.server.add_route('/hello', HelloHandler())
+        self.server.add_route('/big', BigHandler())
+        self.server.add_route('/stream', StreamHandler())
+        self.server.add_route('/gate', self.gate)
+        self.port = get_free_port()
+        self.async_server = self.loop.run_until_complete(
+            self.server.start_server('127.0.0.1', self.port))
+
+    def tearDown(self):
+        self.async_server.close()
+        self.wait(self.closed())
+        self.loop.close()
+
+    async def closed(self):
+        while self.server._open:
+            await asyncio.sleep(0.01)
+
+    def wait(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 5))
+
+    def test_prior_knowledge(self):
+        async def go():
+            client = await Client.connect(self.port)
+            response = await client.request('/hello?name=h2')
+            assert response['headers'][':status'] == '200'
+            assert response['headers']['set-cookie'] == 'seen=localhost'
+            assert 'connection' not in response['headers']
+            assert bytes(response['data']) == b'Hello h2'
+            response = await client.request('/missing')
+            assert response['headers'][':status'] == '404'
+            response = await client.request(
+                '/hello', 'POST', body=b'name=form',
+                headers=[('content-type',
+                          'application/x-www-form-urlencoded')])
+            assert bytes(response['data']) == b'posted form'
+            client.close()
+        self.wait(go())
+
+    def test_concurrent_streams(self):
+        async def go():
+            client = await Client.connect(self.port)
+            # the first request waits for the second, so would never be
+            # answered if streams were handled one after another
+            blocked = asyncio.ensure_future(client.request('/gate'))
+            opener = await client.request('/gate?open=1')
+            assert bytes(opener['data']) == b'through'
+            assert bytes((await blocked)['data']) == b'through'
+            responses = await asyncio.gather(*(
+                client.request('/hello?name=%d' % i) for i in range(50)))
+            for i, response in enumerate(responses):
+                assert bytes(response['data']) == b'Hello %d' % i
+            client.close()
+        self.wait(go())
+
+    def test_flow_control(self):
+        async def go():
+            client = await Client.connect(self.port)
+            # larger than the initial window, so only sent as the client
+            # acknowledges what it has read
+            responses = await asyncio.gather(
+                client.request('/big'), client.request('/big'))
+            for response in responses:
+                assert response['headers']['content-length'] == str(len(BIG))
+                assert bytes(response['data']) == BIG
+            client.close()
+        self.wait(go())
+
+    def test_streamed(self):
+        async def go():
+            client = await Client.connect(self.port)
+            response = await client.request(
+                '/stream', 'POST', body=b'y' * 50000)
+            assert bytes(response['data']) == b'got 50000'
+            assert response['trailers'] == {'x-size': '50000'}
+            client.close()
+        self.wait(go())
+
+    def test_upgrade(self):
+        async def go():
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            client = Client(reader, writer)
+            settings = client.conn.initiate_upgrade_connection().decode()
+            response = client.expect(1)
+            writer.write((
+                'GET /hello?name=upgrade HTTP/1.1\r\nHost: localhost\r\n'
+                'Connection: Upgrade, HTTP2-Settings\r\nUpgrade: h2c\r\n'
+                'HTTP2-Settings: %s\r\n\r\n' % settings).encode())
+            head = await reader.readuntil(b'\r\n\r\n')
+            assert head.startswith(b'HTTP/1.1 101')
+            client.start()
+            await response['done']
+            assert bytes(response['data']) == b'Hello upgrade'
+            # later requests are sent over HTTP/2 as well
+            response = await client.request('/hello')
+            assert bytes(response['data']) == b'Hello world'
+            client.close()
+        self.wait(go())
+
+    def test_http1(self):
+        async def go():
+            async with client.ClientSession() as session:
+                async with session.get(
+                        'http://127.0.0.1:%d/hello' % self.port) as response:
+                    assert await response.text() == 'Hello world'
+        self.wait(go())
+
+    def test_shutdown(self):
+        async def go():
+            client = await Client.connect(self.port)
+            blocked = asyncio.ensure_future(client.request('/gate'))
+            while not self.server._http2_connections:
+                await asyncio.sleep(0.01)
+            shutdown = asyncio.ensure_future(
+                self.server._shutdown_gracefully(self.async_server))
+            while client.goaway is None:
+                await asyncio.sleep(0.01)
+            assert client.goaway == 1
+            assert not shutdown.done()
+            # the open stream is still answered, then the connection closed
+            self.gate.open.set()
+            await shutdown
+            assert self.gate.passed == 1
+            blocked.cancel()
+            client.close()
+        self.wait(go())
+
+
+class ProtocolHttp2IntegrationTest(Http2IntegrationTest):
+    engine = 'protocol'
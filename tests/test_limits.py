@@ -0,0 +1,151 @@
+import unittest
+import asyncio
+from albatross import Server
+from albatross.limits import Limiter
+from tests.test_server import get_free_port
+
+
+class SlowHandler:
+    def __init__(self):
+        self.release = None
+
+    async def on_get(self, req, res):
+        await self.release.wait()
+        res.write('done')
+
+
+class HelloHandler:
+    async def on_get(self, req, res):
+        res.write('hello')
+
+
+class LimiterTest(unittest.TestCase):
+
+    def test_queue(self):
+        async def go():
+            limiter = Limiter(1, queue_size=1)
+            assert await limiter.acquire()
+            waiter = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            assert limiter.waiting == 1
+            assert not await limiter.acquire()
+            limiter.release()
+            assert await waiter
+            assert limiter.active == 1
+            limiter.release()
+            assert limiter.active == 0
+
+        asyncio.run(go())
+
+    def test_cancelled_waiter(self):
+        async def go():
+            limiter = Limiter(1, queue_size=1)
+            assert limiter.try_acquire()
+            waiter = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.sleep(0)
+            assert limiter.waiting == 0
+            limiter.release()
+            assert limiter.active == 0
+
+        asyncio.run(go())
+
+
+class LimitsIntegrationTest(unittest.TestCase):
+    engine = 'stream'
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.slow = SlowHandler()
+        self.slow.release = asyncio.Event()
+        self.port = get_free_port()
+        self.async_server = None
+
+    def tearDown(self):
+        if self.async_server is not None:
+            self.async_server.close()
+        self.loop.close()
+
+    def start(self, **kwargs):
+        self.server = Server(engine=self.engine, **kwargs)
+        self.server.add_route('/slow', self.slow)
+        self.server.add_route('/hello', HelloHandler())
+        self.async_server = self.loop.run_until_complete(
+            self.server.start_server('127.0.0.1', self.port))
+
+    async def send(self, data, delay=0):
+        reader, writer = await asyncio.open_connection(
+            '127.0.0.1', self.port)
+        writer.write(data)
+        if delay:
+            await asyncio.sleep(delay)
+        response = await reader.read()
+        writer.close()
+        return response
+
+    def wait(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def overload(self, second):
+        async def go():
+            slow = asyncio.ensure_future(self.send(
+                b'GET /slow HTTP/1.1\r\nConnection: close\r\n\r\n'))
+            await asyncio.sleep(0.05)
+            other = asyncio.ensure_future(self.send(second))
+            await asyncio.sleep(0.05)
+            self.slow.release.set()
+            return await slow, await other
+        return self.wait(go())
+
+    def test_in_flight_shed(self):
+        self.start(max_in_flight=1)
+        slow, other = self.overload(
+            b'GET /hello HTTP/1.1\r\nConnection: close\r\n\r\n')
+        assert slow.endswith(b'done')
+        assert other.startswith(b'HTTP/1.1 503 Service Unavailable')
+        assert b'retry-after: 1\r\n' in other
+
+    def test_in_flight_queue(self):
+        self.start(max_in_flight=1, request_queue_size=1)
+        slow, other = self.overload(
+            b'GET /hello HTTP/1.1\r\nConnection: close\r\n\r\n')
+        assert slow.endswith(b'done')
+        assert other.startswith(b'HTTP/1.1 200 OK')
+
+    def test_connection_limit(self):
+        self.start(max_connections=1, retry_after=5)
+        slow, other = self.overload(
+            b'GET /hello HTTP/1.1\r\nConnection: close\r\n\r\n')
+        assert slow.endswith(b'done')
+        assert other.startswith(b'HTTP/1.1 503 Service Unavailable')
+        assert b'retry-after: 5\r\n' in other
+        assert self.server._connections.active == 0
+
+    def test_connection_queue(self):
+        self.start(max_connections=1, connection_queue_size=1)
+        slow, other = self.overload(
+            b'GET /hello HTTP/1.1\r\nConnection: close\r\n\r\n')
+        assert other.startswith(b'HTTP/1.1 200 OK')
+
+    def test_header_timeout(self):
+        self.start(header_timeout=0.05)
+        response = self.wait(self.send(b'GET /hello HTTP/1.1\r\nHost: x'))
+        assert response.startswith(b'HTTP/1.1 408 Request Time-out')
+
+    def test_body_timeout(self):
+        self.start(body_timeout=0.05)
+        response = self.wait(self.send(
+            b'POST /hello HTTP/1.1\r\nContent-Length: 10\r\n\r\nab'))
+        assert response.startswith(b'HTTP/1.1 408 Request Time-out')
+
+    def test_handler_timeout(self):
+        self.start(handler_timeout=0.05)
+        response = self.wait(self.send(
+            b'GET /slow HTTP/1.1\r\nConnection: close\r\n\r\n'))
+        assert response.startswith(b'HTTP/1.1 503 Service Unavailable')
+
+
+class ProtocolLimitsIntegrationTest(LimitsIntegrationTest):
+    engine = 'protocol'
@@ -0,0 +1,95 @@
+import unittest
+import asyncio
+from albatross import Server
+from albatross.metrics import Histogram, Metrics, MetricsHandler, PHASES
+from tests.test_server import get_free_port
+
+
+class ItemHandler:
+    async def on_get(self, req, res):
+        res.write('item %s' % req.args['id'])
+
+
+class FailingHandler:
+    async def on_get(self, req, res):
+        raise ValueError('broken')
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_observe(self):
+        histogram = Histogram((0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        assert histogram.counts == [2, 1, 1]
+        assert histogram.count == 4
+        assert histogram.sum == 2.65
+
+
+class MetricsTest(unittest.TestCase):
+    engine = 'stream'
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.metrics = Metrics()
+        self.traces = []
+        self.metrics.add_callback(self.traces.append)
+        self.server = Server(engine=self.engine, metrics=self.metrics)
+        self.server.add_route('/item/{id}', ItemHandler())
+        self.server.add_route('/fail', FailingHandler())
+        self.server.add_route('/metrics', MetricsHandler(self.metrics))
+        self.port = get_free_port()
+        self.async_server = self.loop.run_until_complete(
+            self.server.start_server('127.0.0.1', self.port))
+
+    def tearDown(self):
+        self.async_server.close()
+        self.loop.close()
+
+    def get(self, *paths):
+        async def go():
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            writer.write(b''.join(
+                b'GET %s HTTP/1.1\r\n\r\n' % path for path in paths[:-1]) +
+                b'GET %s HTTP/1.1\r\nConnection: close\r\n\r\n' % paths[-1])
+            response = await reader.read()
+            writer.close()
+            return response
+        return self.loop.run_until_complete(go())
+
+    def test_phases_per_route(self):
+        self.get(b'/item/1', b'/item/2', b'/fail', b'/missing')
+        assert [t.route for t in self.traces] == [
+            '/item/{id}', '/item/{id}', '/fail', '<unmatched>']
+        trace = self.traces[0]
+        assert set(trace.phases) == set(PHASES)
+        assert all(seconds >= 0 for seconds in trace.phases.values())
+        assert trace.status_code == '200 OK'
+        assert trace.bytes_in > 0 and trace.bytes_out > 0
+
+        histogram = self.metrics.histograms['/item/{id}']['handler']
+        assert histogram.count == 2
+        assert self.metrics.requests['/item/{id}', 'GET', '200'] == 2
+        assert self.metrics.errors == {'/fail': 1}
+        assert self.metrics.in_flight == 0
+        assert self.metrics.bytes_out == sum(
+            t.bytes_out for t in self.traces)
+
+    def test_prometheus_endpoint(self):
+        self.get(b'/item/1')
+        response = self.get(b'/metrics')
+        assert b'content-type: text/plain; version=0.0.4' in response
+        body = response.partition(b'\r\n\r\n')[2].decode()
+        assert ('albatross_phase_seconds_count'
+                '{route="/item/{id}",phase="handler"} 1') in body
+        assert ('albatross_phase_seconds_bucket'
+                '{route="/item/{id}",phase="handler",le="+Inf"} 1') in body
+        assert ('albatross_requests_total'
+                '{route="/item/{id}",method="GET",status="200"} 1') in body
+        assert 'albatross_in_flight_requests 1' in body
+
+
+class ProtocolMetricsTest(MetricsTest):
+    engine = 'protocol'
@@ -0,0 +1,140 @@
+import unittest
+import asyncio
+from aiohttp import client
+from albatross import Server
+from albatross.middleware import Middleware, MiddlewareChain
+from tests.test_server import get_free_port
+
+
+class Recorder(Middleware):
+    """Records the hooks it runs in `req.calls`."""
+
+    def __init__(self, name, answer=False):
+        self.name = name
+        self.answer = answer
+
+    async def process_request(self, req, res, handler):
+        req.__dict__.setdefault('calls', []).append(self.name + '>')
+        if self.answer:
+            res.write('answered by %s' % self.name)
+        return self.answer
+
+    async def process_response(self, req, res, handler):
+        req.__dict__.setdefault('calls', []).append('<' + self.name)
+        res.headers['X-Calls'] = ' '.join(req.calls)
+
+
+class RequestOnly(Middleware):
+    async def process_request(self, req, res, handler):
+        req.__dict__.setdefault('calls', []).append('request-only')
+
+
+class ResponseOnly:
+    async def process_response(self, req, res, handler):
+        res.headers['X-Response-Only'] = 'yes'
+
+
+class HelloHandler:
+    async def on_get(self, req, res):
+        req.__dict__.setdefault('calls', []).append('handler')
+        res.write('hello')
+
+
+class GuardedHandler(HelloHandler):
+    middleware = [Recorder('guard', answer=True)]
+
+
+class SlowHandler(HelloHandler):
+    def __init__(self):
+        self.entered = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def on_get(self, req, res):
+        self.entered.set()
+        await self.release.wait()
+        await super().on_get(req, res)
+
+
+class MiddlewareChainTest(unittest.TestCase):
+
+    def test_skips_missing_hooks(self):
+        a, b, c = Recorder('a'), RequestOnly(), ResponseOnly()
+        chain = MiddlewareChain((a, b, c))
+        assert chain.middleware == (a, b, c)
+        assert [hook for hook, _ in chain.requests] == [
+            a.process_request, b.process_request]
+        assert chain.responses == (a.process_response, c.process_response)
+        # answering runs the response hooks of the middleware so far
+        assert [r for _, r in chain.requests] == [
+            (a.process_response,), (a.process_response,)]
+
+    def test_extend(self):
+        chain = MiddlewareChain((Recorder('a'),))
+        extended = chain.extend((Recorder('b'),))
+        assert extended.parent is chain
+        assert len(extended.requests) == len(extended.responses) == 2
+        assert MiddlewareChain().requests == ()
+
+
+class MiddlewareIntegrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = Server()
+        self.slow = SlowHandler()
+        self.server.add_route('/hello', HelloHandler())
+        self.server.add_route('/guarded', GuardedHandler())
+        self.server.add_route('/slow', self.slow)
+        self.port = get_free_port()
+        self.url = 'http://127.0.0.1:%d' % self.port
+        self.async_server = self.loop.run_until_complete(
+            self.server.start_server('127.0.0.1', self.port))
+
+    def tearDown(self):
+        self.async_server.close()
+        self.loop.close()
+
+    async def get(self, path):
+        async with client.ClientSession() as session:
+            async with session.get(self.url + path) as response:
+                return response.headers, await response.text()
+
+    def wait(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 5))
+
+    def test_partial_middleware(self):
+        self.server.add_middleware(Recorder('a'))
+        self.server.add_middleware(RequestOnly())
+        self.server.add_middleware(ResponseOnly())
+        headers, body = self.wait(self.get('/hello'))
+        assert body == 'hello'
+        assert headers['X-Calls'] == 'a> request-only handler <a'
+        assert headers['X-Response-Only'] == 'yes'
+
+    def test_route_middleware(self):
+        self.server.add_middleware(Recorder('a'))
+        headers, body = self.wait(self.get('/guarded'))
+        assert body == 'answered by guard'
+        assert headers['X-Calls'] == 'a> guard> <a <guard'
+        # other routes don't run it
+        headers, body = self.wait(self.get('/hello'))
+        assert headers['X-Calls'] == 'a> handler <a'
+        # and it follows middleware added later
+        self.server.add_middleware(Recorder('b'))
+        headers, body = self.wait(self.get('/guarded'))
+        assert headers['X-Calls'] == 'a> b> guard> <a <b <guard'
+
+    def test_added_in_flight(self):
+        self.server.add_middleware(Recorder('a'))
+
+        async def go():
+            slow = asyncio.ensure_future(self.get('/slow'))
+            await self.slow.entered.wait()
+            # a request in flight keeps the chain it started with
+            self.server.add_middleware(Recorder('b'))
+            self.slow.release.set()
+            return await slow, await self.get('/hello')
+        (headers, _), (later, _) = self.wait(go())
+        assert headers['X-Calls'] == 'a> handler <a'
+        assert later['X-Calls'] == 'a> b> handler <a <b'
@@ -0,0 +1,64 @@
+import unittest
+from albatross.multipart import MultipartParser, parse_header
+from albatross.request import SpooledBody
+
+BODY = (
+    b'preamble\r\n'
+    b'--XyZ\r\n'
+    b'Content-Disposition: form-data; name="key1"\r\n\r\n'
+    b'value1\r\n'
+    b'--XyZ\r\n'
+    b'Content-Disposition: form-data; name="key1"\r\n\r\n'
+    b'value\r\n--Xy\r\n'
+    b'--XyZ\r\n'
+    b'Content-Disposition: form-data; name="upload"; filename="a \\"b\\".txt"'
+    b'\r\nContent-Type: text/plain\r\n\r\n'
+    b'what a great file\n\r\n'
+    b'--XyZ--\r\n'
+    b'epilogue'
+)
+
+
+def parse(body, chunk_size, **kwargs):
+    parser = MultipartParser('XyZ', **kwargs)
+    for i in range(0, len(body), chunk_size):
+        parser.feed(body[i:i + chunk_size])
+    return parser.close()
+
+
+class MultipartParserTest(unittest.TestCase):
+
+    def test_parse(self):
+        for chunk_size in (1, 2, 7, len(BODY)):
+            parts = parse(BODY, chunk_size)
+            assert [p.name for p in parts] == ['key1', 'key1', 'upload']
+            assert parts[0].value == b'value1'
+            assert parts[1].value == b'value\r\n--Xy'
+            assert parts[2].filename == 'a "b".txt'
+            assert parts[2].content_type == 'text/plain'
+            assert parts[2].file.read() == b'what a great file\n'
+
+    def test_spooled_file(self):
+        body = (
+            b'--XyZ\r\n'
+            b'Content-Disposition: form-data; name="f"; filename="big"\r\n'
+            b'\r\n' + b'x' * 1000 + b'\r\n--XyZ--\r\n'
+        )
+        parts = parse(body, 64, make_file=lambda: SpooledBody(max_size=100))
+        assert parts[0].file._rolled
+        assert parts[0].file.read() == b'x' * 1000
+
+    def test_incomplete(self):
+        with self.assertRaises(ValueError):
+            parse(BODY[:50], 10)
+
+    def test_malformed(self):
+        with self.assertRaises(ValueError):
+            parse(b'--XyZ\r\nNo colon here\r\n\r\nvalue\r\n--XyZ--', 5)
+        with self.assertRaises(ValueError):
+            MultipartParser(None)
+
+    def test_parse_header(self):
+        assert parse_header('multipart/form-data; boundary="a;b"') == (
+            'multipart/form-data', {'boundary': 'a;b'})
+        assert parse_header('Text/Plain') == ('text/plain', {})
@@ -1,5 +1,9 @@
 import unittest
-from albatross import Request
+import asyncio
+from albatross import Request, Response
+from albatross.codecs import JSONCodec, OrjsonCodec
+from albatross.compat import json, orjson
+from albatross.request import RequestBody
 from albatross.http_error import HTTPError
 from io import BytesIO
 
@@ -32,14 +36,132 @@ class RequestTest(unittest.TestCase):
         assert r.cookies['fizzle'] == 'bizzle'
         assert ' fizzle' not in r.cookies
 
+    def test_headers_are_str(self):
+        r = Request()
+        r.on_header(b'Host', b'example.com')
+        r.on_header(b'X-Custom', b'one')
+        r.on_headers_complete()
+        assert dict(r.headers) == {
+            'host': ['example.com'], 'x-custom': ['one']}
+        codecs = [JSONCodec()]
+        if orjson is not None:
+            codecs.append(OrjsonCodec())
+        for codec in codecs:
+            res = Response()
+            res._codec = codec
+            res.write_json(r.headers)
+            assert json.loads(b''.join(res._chunks)) == dict(r.headers)
+
+    def test_reset(self):
+        r = Request('GET', '/a', 'x=1', headers={'A': 'b'},
+                    cookies={'c': ['d']})
+        r.on_body(b'body')
+        r.mark = True
+        r.reset()
+        assert r.method is None and r.path is None
+        assert r.query is None
+        assert r.headers == {} and r.cookies == {}
+        assert r.raw_body.getvalue() == b''
+        assert not hasattr(r, 'mark')
+
     def test_request_raw_body(self):
         r = Request()
         r.on_body(b'stream')
         assert r.raw_body.getvalue() == b'stream'
 
+    def test_request_spooled_body(self):
+        r = Request(spool_size=4)
+        r.on_body(b'str')
+        assert not r.raw_body._rolled
+        r.on_body(b'eam')
+        assert r.raw_body._rolled
+        assert r.raw_body.getvalue() == b'stream'
+
+    def test_request_read_buffered(self):
+        r = Request()
+        r.on_body(b'stream')
+        r.on_message_complete()
+        loop = asyncio.new_event_loop()
+        assert loop.run_until_complete(r.read(3)) == b'str'
+        assert loop.run_until_complete(r.read()) == b'eam'
+        loop.close()
+
+    def test_request_lazy(self):
+        r = Request()
+        r.on_url(b'/hello?one=two')
+        r.on_header(b'X-Thing', b'value')
+        r.on_header(b'Cookie', b'token=bizbaz')
+        r.on_header(b'Content-Type', b'application/json')
+        r.on_headers_complete()
+        r.on_body(b'{"broken"')
+        r.on_message_complete()
+        assert r._headers is None
+        assert r._query is not None and not isinstance(r._query, dict)
+        assert r.headers['x-thing'] == 'value'
+        assert r.query['one'] == 'two'
+        assert r.cookies['token'] == 'bizbaz'
+        with self.assertRaises(ValueError):
+            r.form
+
     def test_request_json(self):
         r = Request()
         r.on_header(b'Content-Type', b'application/json')
         r.on_headers_complete()
         r._parse_body(BytesIO(b'{"my":"name"}'))
         assert r.form == {'my': 'name'}
+
+    def test_offload_form(self):
+        body = b'{"my":"name"}'
+        for size, offload in ((len(body), False), (len(body) - 1, True)):
+            r = Request(offload_size=size)
+            r.on_header(b'Content-Type', b'application/json')
+            r.on_headers_complete()
+            r.on_body(body)
+            r.on_message_complete()
+            assert r._offload_form() == offload
+            assert r.form == {'my': 'name'}
+            assert not r._offload_form()
+
+        r = Request(offload_size=10)
+        r.on_header(b'Content-Type', b'multipart/form-data; boundary=x')
+        r.on_header(b'Content-Length', b'11')
+        r.on_headers_complete()
+        # parsed as it arrives, whatever its size
+        assert r._multipart is not None
+        r.on_body(b'--x--\r\n')
+        r.on_message_complete()
+        assert not r._offload_form()
+
+
+class RequestBodyTest(unittest.TestCase):
+
+    def test_read_while_arriving(self):
+        paused = []
+        body = RequestBody(
+            pause=lambda: paused.append(True),
+            resume=lambda: paused.append(False),
+            limit=4,
+        )
+
+        async def go():
+            body.feed(b'abc')
+            assert await body.read(2) == b'ab'
+            body.feed(b'defgh')
+            assert paused == [True]
+            assert await body.read(4) == b'cdef'
+            assert paused == [True, False]
+            asyncio.get_event_loop().call_soon(body.feed_eof)
+            return [chunk async for chunk in body]
+
+        loop = asyncio.new_event_loop()
+        assert loop.run_until_complete(go()) == [b'gh']
+        assert body.complete
+        loop.close()
+
+    def test_exception(self):
+        body = RequestBody()
+        body.set_exception(HTTPError('413 Payload Too Large'))
+        loop = asyncio.new_event_loop()
+        with self.assertRaises(HTTPError):
+            loop.run_until_complete(body.read())
+        loop.close()
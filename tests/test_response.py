@@ -1,6 +1,6 @@
 import unittest
 from albatross import Response, HTTPError
-from albatross.status_codes import HTTP_301, HTTP_302
+from albatross.status_codes import HTTP_200, HTTP_301, HTTP_302
 
 
 class RequestTest(unittest.TestCase):
@@ -16,3 +16,23 @@ class RequestTest(unittest.TestCase):
             r.redirect('/another', permanent=True)
         assert r.headers['Location'] == '/another'
         assert r.status_code == HTTP_301
+
+    def test_start_detached(self):
+        r = Response()
+        with self.assertRaises(RuntimeError):
+            r.start()
+
+    def test_reset(self):
+        r = Response()
+        r.status_code = HTTP_301
+        r.headers['Location'] = '/'
+        r.cookies['a'] = 'b'
+        r.trailers['Checksum'] = 'c'
+        r.write('body')
+        r.mark = True
+        r.reset()
+        assert r.status_code == HTTP_200
+        assert r.headers == {'content-type': 'text/html'}
+        assert r.cookies == {} and r.trailers == {}
+        assert r._chunks == []
+        assert not hasattr(r, 'mark')
@@ -0,0 +1,82 @@
+import unittest
+from albatross.router import Router
+
+
+class RouterTest(unittest.TestCase):
+
+    def test_static_and_params(self):
+        r = Router()
+        r.add('/users', 1)
+        r.add('/users/{id}', 2)
+        r.add('/users/{id}/posts/{post-id}', 3)
+        assert r.get('/users') == (1, {})
+        assert r.get('/users/7') == (2, {'id': '7'})
+        assert r.get('/users/7/posts/9') == (3, {'id': '7', 'post-id': '9'})
+        assert r.get('/users/') == (None, None)
+        assert r.get('/users/7/posts') == (None, None)
+
+    def test_registration_order_wins(self):
+        r = Router()
+        r.add('/hello/{name}', 1)
+        r.add('/hello/world', 2)
+        r.add('/static/file', 3)
+        r.add('/static/{name}', 4)
+        assert r.get('/hello/world') == (1, {'name': 'world'})
+        assert r.get('/static/file') == (3, {})
+        assert r.get('/static/other') == (4, {'name': 'other'})
+
+    def test_backtracking(self):
+        r = Router()
+        r.add('/a/b/c', 1)
+        r.add('/a/{x}/d', 2)
+        assert r.get('/a/b/d') == (2, {'x': 'b'})
+
+    def test_duplicate_params(self):
+        r = Router()
+        for template in ('/a/{id}/b/{id}', '/a/{id}/{id}.json'):
+            with self.assertRaises(ValueError):
+                r.add(template, 1)
+        # nothing was registered
+        assert r.get('/a/1/b/2') == (None, None)
+        assert r.get('/a/1/2.json') == (None, None)
+
+    def test_args_are_dicts(self):
+        for r in (Router(), Router(cache_size=2)):
+            r.add('/a', 1)
+            r.add('/b/{id}', 2)
+            for path in ('/a', '/a', '/b/1', '/b/1'):
+                _, args = r.get(path)
+                # handlers may fill in defaults, whatever the route
+                args.setdefault('page', '1')
+                assert args.pop('id', '1') == '1'
+                assert args == {'page': '1'}
+
+    def test_regex_precedence(self):
+        r = Router()
+        r.add('/api/{name}', 1)
+        r.add_regex('/.*', 2)
+        r.add('/other', 3)
+        assert r.get('/api/x') == (1, {'name': 'x'})
+        assert r.get('/other') == (2, {})
+        assert r.get('/anything/else') == (2, {})
+
+    def test_template_with_regex_falls_back(self):
+        r = Router()
+        r.add('/files/{name}.json', 1)
+        r.add('/v(1|2)/{name}', 2)
+        assert r.get('/files/report.json') == (1, {'name': 'report'})
+        assert r.get('/v2/x') == (2, {'name': 'x'})
+        assert r.get('/files/report.xml') == (None, None)
+
+    def test_cache(self):
+        r = Router(cache_size=2)
+        r.add('/a', 1)
+        r.add('/b/{x}', 2)
+        handler, args = r.get('/b/1')
+        args['x'] = 'changed'
+        assert r.get('/b/1') == (2, {'x': '1'})
+        assert r.get('/a') == (1, {})
+        assert r.get('/c') == (None, None)
+        assert len(r._cache) == 2
+        r.add('/c', 3)
+        assert r.get('/c') == (3, {})
@@ -1,7 +1,11 @@
 import unittest
 import asyncio
-from albatross import Server
+import re
+from albatross import Response, Server
 from albatross.compat import json
+from albatross.compression import Compression
+from albatross.protocol import TransportWriter
+from albatross.server import write_cookie
 from aiohttp import client
 import socket
 from datetime import datetime
@@ -32,6 +36,47 @@ class Handler:
         })
 
 
+class StreamHandler:
+    stream_body = True
+
+    async def on_post(self, req, res):
+        size = 0
+        async for chunk in req.body:
+            size += len(chunk)
+        res.write_json({'size': size, 'form': req.form})
+
+    async def on_put(self, req, res):
+        head = await req.read(5)
+        res.write_bytes(head)
+
+
+class ExportHandler:
+    async def on_get(self, req, res):
+        res.headers['Content-Type'] = 'application/x-ndjson'
+        res.write('{"row":0}\n')
+        res.trailers['X-Rows'] = 3
+
+        async def rows():
+            for i in range(1, 3):
+                yield '{"row":%d}\n' % i
+        await res.stream(rows())
+
+    async def on_post(self, req, res):
+        await res.send('partial')
+        raise ValueError('failed mid-stream')
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.seen = []
+
+    async def on_get(self, req, res):
+        self.seen.append((req, res, req.query, req.cookies.get('c'),
+                          getattr(req, 'mark', None)))
+        req.mark = True
+        res.write('ok')
+
+
 class TimingMiddleware:
     async def process_request(self, req, res, handler):
         req._start_time = time()
@@ -41,6 +86,17 @@ class TimingMiddleware:
         res.headers['Duration'] = duration
 
 
+class BlockingMiddleware:
+    async def process_request(self, req, res, handler):
+        if req.headers.get('X-Block'):
+            res.status_code = '403 Forbidden'
+            res.write('blocked')
+            return True
+
+    async def process_response(self, req, res, handler):
+        res.headers['X-Seen'] = 'yes'
+
+
 def get_free_port():
     s = socket.socket()
     s.bind(('', 0))
@@ -49,38 +105,67 @@ def get_free_port():
     return port
 
 
+class SlowPartsHandler:
+    async def on_get(self, req, res):
+        await res.send('part1;')
+        await asyncio.sleep(0.1)
+        await res.send('part2;')
+
+
 class ServerIntegrationTest(unittest.TestCase):
+    engine = 'stream'
 
     def setUp(self):
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
-        self.server = Server()
+        self.server = Server(engine=self.engine)
         self.server.add_route('/hello', Handler())
+        self.server.add_route('/stream', StreamHandler())
+        self.server.add_route('/export', ExportHandler())
 
         self.port = get_free_port()
         self.url = 'http://127.0.0.1:%d' % (self.port, )
         self.async_server = self.loop.run_until_complete(
-            asyncio.start_server(
-                self.server._handle, '127.0.0.1', self.port, loop=self.loop
-            )
+            self.server.start_server('127.0.0.1', self.port)
         )
 
     def tearDown(self):
         self.async_server.close()
+        self.loop.run_until_complete(self.closed())
+        self.loop.close()
+
+    async def closed(self, timeout=1):
+        # connections lingering after a refused request end with them
+        deadline = self.loop.time() + timeout
+        while self.server._open and self.loop.time() < deadline:
+            await asyncio.sleep(0.01)
 
     def request(self, method, path, data=None, headers=None):
         async def go():
-            self.session = client.ClientSession(loop=self.loop)
+            self.session = client.ClientSession()
             response = await self.session.request(
                 method, self.url + path,
                 data=data, headers=headers
             )
             bytes = await response.read()
             body = bytes.decode()
-            self.session.close()
+            await self.session.close()
             return response, body
         return self.loop.run_until_complete(go())
 
+    def raw_request(self, data, read_until_close=True):
+        async def go():
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            writer.write(data)
+            if read_until_close:
+                response = await reader.read()
+            else:
+                response = await reader.read(2 ** 16)
+            writer.close()
+            return response
+        return self.loop.run_until_complete(go())
+
     def test_hello_world(self):
         response, body = self.request('GET', '/hello')
         assert body == 'Hello World'
@@ -127,6 +212,19 @@ class ServerIntegrationTest(unittest.TestCase):
         response, body = self.request('GET', '/hello')
         assert float(response.headers['Duration'])
 
+    def test_middleware_short_circuit(self):
+        self.server.add_middleware(BlockingMiddleware())
+        self.server.add_middleware(TimingMiddleware())
+        response, body = self.request(
+            'GET', '/hello', headers={'X-Block': '1'})
+        assert response.status == 403
+        assert body == 'blocked'
+        assert response.headers['X-Seen'] == 'yes'
+        assert 'Duration' not in response.headers
+        response, body = self.request('GET', '/hello')
+        assert body == 'Hello World'
+        assert float(response.headers['Duration'])
+
     def test_expect_continue(self):
         response, body = self.request(
             'POST', '/hello',
@@ -138,6 +236,373 @@ class ServerIntegrationTest(unittest.TestCase):
         assert response.status == 200
         assert body == '{"name":"test"}'
 
+    def test_keep_alive(self):
+        async def go():
+            self.session = client.ClientSession()
+            bodies = []
+            for _ in range(3):
+                response = await self.session.get(self.url + '/hello')
+                bodies.append(await response.read())
+                assert response.headers['Connection'] == 'keep-alive'
+            await self.session.close()
+            return bodies
+        bodies = self.loop.run_until_complete(go())
+        assert bodies == [b'Hello World'] * 3
+
+    def test_pipelining(self):
+        response = self.raw_request(
+            b'GET /hello HTTP/1.1\r\nHost: x\r\n\r\n'
+            b'GET /notfound HTTP/1.1\r\nHost: x\r\n\r\n'
+            b'GET /hello HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n'
+        )
+        statuses = re.findall(b'HTTP/1.1 [^\r]+', response)
+        assert statuses == [
+            b'HTTP/1.1 200 OK',
+            b'HTTP/1.1 404 Not Found',
+            b'HTTP/1.1 200 OK',
+        ], response
+        assert response.endswith(b'Hello World')
+
+    def test_connection_close(self):
+        response = self.raw_request(
+            b'GET /hello HTTP/1.0\r\n\r\n'
+        )
+        assert b'connection: close' in response
+        assert response.endswith(b'Hello World')
+
+    def test_max_keep_alive_requests(self):
+        self.server.max_keep_alive_requests = 2
+        response = self.raw_request(
+            b'GET /hello HTTP/1.1\r\nHost: x\r\n\r\n' * 3
+        )
+        assert response.count(b'HTTP/1.1 200 OK') == 2
+        assert response.endswith(b'Hello World')
+
+    def test_keep_alive_timeout(self):
+        self.server.keep_alive_timeout = 0.01
+        response = self.raw_request(
+            b'GET /hello HTTP/1.1\r\nHost: x\r\n\r\n'
+        )
+        assert response.count(b'HTTP/1.1 200 OK') == 1
+        assert b'connection: keep-alive' in response
+
+    def test_stream_body(self):
+        response, body = self.request(
+            'POST', '/stream', data=b'x' * 2 ** 20)
+        assert json.loads(body) == {'size': 2 ** 20, 'form': None}
+
+    def test_stream_body_partially_read(self):
+        response, body = self.request(
+            'PUT', '/stream', data=b'abcdefghij' * 2 ** 16)
+        assert body == 'abcde'
+        assert response.headers['Connection'] == 'close'
+
+    def test_max_body_size(self):
+        self.server.max_body_size = 10
+        response, body = self.request(
+            'POST', '/hello', data='name=a-long-mouse-name', headers={
+                'Content-Type': 'application/x-www-form-urlencoded'
+            }
+        )
+        assert response.status == 413
+        response, body = self.request(
+            'POST', '/hello', data='name=mouse', headers={
+                'Content-Type': 'application/x-www-form-urlencoded'
+            }
+        )
+        assert response.status == 200
+
+    def test_max_body_size_expect_continue(self):
+        self.server.max_body_size = 10
+        response = self.raw_request(
+            b'POST /hello HTTP/1.1\r\nHost: x\r\nContent-Length: 100\r\n'
+            b'Expect: 100-continue\r\n\r\n')
+        # the client is not invited to send the body that was refused
+        assert response.startswith(b'HTTP/1.1 413'), response
+        assert b'100 (Continue)' not in response
+
+    def test_max_body_size_upload(self):
+        self.server.max_body_size = 10
+        body = b'x' * 2 ** 22
+
+        async def go():
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            writer.write(b'POST /hello HTTP/1.1\r\nHost: x\r\n'
+                         b'Content-Length: %d\r\n\r\n' % len(body))
+            writer.write(body)
+            # the refused body is read and dropped, so the connection
+            # isn't reset before the 413 arrives
+            response = await reader.read()
+            writer.close()
+            return response
+        response = self.loop.run_until_complete(asyncio.wait_for(go(), 5))
+        assert response.startswith(b'HTTP/1.1 413'), response
+
+    def test_max_body_size_chunked(self):
+        self.server.max_body_size = 10
+        response = self.raw_request(
+            b'POST /stream HTTP/1.1\r\nHost: x\r\n'
+            b'Transfer-Encoding: chunked\r\n\r\n'
+            b'8\r\n12345678\r\n8\r\n12345678\r\n0\r\n\r\n'
+        )
+        assert response.startswith(b'HTTP/1.1 413'), response
+
+    def test_streamed_response(self):
+        response, body = self.request('GET', '/export')
+        assert response.headers['Transfer-Encoding'] == 'chunked'
+        assert body == '{"row":0}\n{"row":1}\n{"row":2}\n'
+
+    def test_streamed_response_trailers(self):
+        response = self.raw_request(
+            b'GET /export HTTP/1.1\r\nHost: x\r\n\r\n'
+            b'GET /hello HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n'
+        )
+        assert b'trailer: x-rows\r\n' in response
+        assert b'\r\n0\r\nx-rows: 3\r\n\r\nHTTP/1.1 200 OK' in response
+        assert response.endswith(b'Hello World')
+
+    def test_streamed_response_http_1_0(self):
+        response = self.raw_request(b'GET /export HTTP/1.0\r\n\r\n')
+        assert b'transfer-encoding' not in response
+        assert b'connection: close' in response
+        assert response.endswith(b'{"row":0}\n{"row":1}\n{"row":2}\n')
+
+    def test_streamed_response_error(self):
+        response = self.raw_request(
+            b'POST /export HTTP/1.1\r\nHost: x\r\nContent-Length: 0\r\n\r\n'
+        )
+        assert response.startswith(b'HTTP/1.1 200 OK')
+        assert response.endswith(b'7\r\npartial\r\n')
+
+    def test_compression(self):
+        self.server.compression = Compression(min_size=0, encodings=('gzip',))
+        response, body = self.request(
+            'POST', '/hello', data='name=mouse', headers={
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'Accept-Encoding': 'gzip',
+            }
+        )
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert body == '{"name":"mouse"}'
+        response, body = self.request(
+            'GET', '/export', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['Transfer-Encoding'] == 'chunked'
+        assert body == '{"row":0}\n{"row":1}\n{"row":2}\n'
+
+    def test_malformed_request(self):
+        response = self.raw_request(b'NOT HTTP\r\n\r\n')
+        assert response.startswith(b'HTTP/1.1 400 Bad Request')
+
+    def test_malformed_pipelined_request(self):
+        self.server.add_route('/parts', SlowPartsHandler())
+
+        async def go():
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            writer.write(b'GET /parts HTTP/1.1\r\nHost: x\r\n\r\n')
+            await asyncio.sleep(0.05)
+            writer.write(b'NOT HTTP\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+            return response
+        response = self.loop.run_until_complete(asyncio.wait_for(go(), 5))
+        # the earlier request is answered in full before the 400
+        assert b'part1;\r\n6\r\npart2;\r\n0\r\n\r\n' in response
+        assert re.findall(b'HTTP/1.1 [^\r]+', response) == [
+            b'HTTP/1.1 200 OK', b'HTTP/1.1 400 Bad Request'], response
+
+    def test_pipelined_expect_continue(self):
+        self.server.add_route('/parts', SlowPartsHandler())
+
+        async def go():
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            writer.write(b'GET /parts HTTP/1.1\r\nHost: x\r\n\r\n')
+            await asyncio.sleep(0.05)
+            writer.write(
+                b'POST /hello HTTP/1.1\r\nHost: x\r\n'
+                b'Content-Type: application/x-www-form-urlencoded\r\n'
+                b'Content-Length: 10\r\nExpect: 100-continue\r\n'
+                b'Connection: close\r\n\r\n')
+            head = await reader.readuntil(b'100 (Continue)\r\n\r\n')
+            writer.write(b'name=mouse')
+            response = await reader.read()
+            writer.close()
+            return head, response
+        head, response = self.loop.run_until_complete(
+            asyncio.wait_for(go(), 5))
+        # the 100 follows the whole of the streamed response
+        assert head.endswith(
+            b'part2;\r\n0\r\n\r\nHTTP/1.1 100 (Continue)\r\n\r\n'), head
+        assert response.startswith(b'HTTP/1.1 200 OK')
+        assert response.endswith(b'{"name":"mouse"}')
+
+
+    def test_head(self):
+        response = self.raw_request(
+            b'HEAD /hello HTTP/1.1\r\n\r\n'
+            b'GET /hello HTTP/1.1\r\nConnection: close\r\n\r\n')
+        head, get = re.findall(b'HTTP/1.1 .*?(?=HTTP/1.1 |$)', response,
+                               re.S)
+        assert b'content-length: 11\r\n' in head
+        assert head.endswith(b'\r\n\r\n')
+        assert get.endswith(b'Hello World')
+
+        response = self.raw_request(
+            b'HEAD /export HTTP/1.1\r\nConnection: close\r\n\r\n')
+        assert b'transfer-encoding: chunked\r\n' in response
+        assert response.endswith(b'\r\n\r\n')
+
+    def test_methods(self):
+        class PatchHandler:
+            async def on_get(self, req, res):
+                res.write('got')
+
+            async def on_patch(self, req, res):
+                res.write('patched %s' % req.form['name'])
+
+        self.server.add_route('/patch', PatchHandler())
+        response, body = self.request(
+            'PATCH', '/patch', data='name=mouse', headers={
+                'Content-Type': 'application/x-www-form-urlencoded'})
+        assert body == 'patched mouse'
+
+        response, body = self.request('DELETE', '/patch')
+        assert response.status == 405
+        assert response.headers['Allow'] == 'GET, HEAD, PATCH, OPTIONS'
+
+        response, body = self.request('OPTIONS', '/patch')
+        assert response.status == 200
+        assert response.headers['Allow'] == 'GET, HEAD, PATCH, OPTIONS'
+
+        self.server.spoof_options = False
+        response, body = self.request('OPTIONS', '/patch')
+        assert response.status == 405
+        assert response.headers['Allow'] == 'GET, HEAD, PATCH'
+
+    def test_graceful_shutdown(self):
+        release = asyncio.Event()
+        shutdowns = []
+
+        class SlowHandler:
+            async def on_get(self, req, res):
+                await release.wait()
+                res.write('finished')
+
+        async def shutdown():
+            shutdowns.append(True)
+
+        self.server.add_route('/slow', SlowHandler())
+        self.server.shutdown = shutdown
+
+        async def go():
+            idle_reader, idle_writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            idle_writer.write(b'GET /hello HTTP/1.1\r\n\r\n')
+            await idle_reader.readuntil(b'Hello World')
+
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            writer.write(b'GET /slow HTTP/1.1\r\n\r\n')
+            await asyncio.sleep(0.05)
+            stopping = asyncio.ensure_future(
+                self.server._shutdown_gracefully(self.async_server))
+            await asyncio.sleep(0.05)
+
+            # idle connections are closed and new ones refused at once
+            assert await idle_reader.read() == b''
+            with self.assertRaises(OSError):
+                await asyncio.open_connection('127.0.0.1', self.port)
+            assert not stopping.done()
+
+            release.set()
+            response = await reader.read()
+            await stopping
+            idle_writer.close()
+            writer.close()
+            return response
+
+        response = self.loop.run_until_complete(go())
+        assert b'connection: close\r\n' in response
+        assert response.endswith(b'finished')
+        assert shutdowns == [True]
+
+    def test_shutdown_fresh_connection(self):
+        async def go():
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            await asyncio.sleep(0.05)
+            stopping = asyncio.ensure_future(
+                self.server._shutdown_gracefully(self.async_server))
+            await asyncio.sleep(0.05)
+            # accepted just before shutdown, so its request is still
+            # answered
+            writer.write(b'GET /hello HTTP/1.1\r\n\r\n')
+            response = await reader.read()
+            await stopping
+            writer.close()
+            return response
+
+        response = self.loop.run_until_complete(asyncio.wait_for(go(), 5))
+        assert b'connection: close\r\n' in response
+        assert response.endswith(b'Hello World')
+
+    def test_shutdown_timeout(self):
+        class StuckHandler:
+            async def on_get(self, req, res):
+                await asyncio.sleep(10)
+
+        self.server.add_route('/stuck', StuckHandler())
+        self.server.shutdown_timeout = 0.05
+
+        async def go():
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            writer.write(b'GET /stuck HTTP/1.1\r\n\r\n')
+            await asyncio.sleep(0.05)
+            await self.server._shutdown_gracefully(self.async_server)
+            response = await reader.read()
+            writer.close()
+            return response
+
+        assert self.loop.run_until_complete(go()) == b''
+
+
+    def test_pool_objects(self):
+        self.server.pool_objects = True
+        handler = RecordingHandler()
+        self.server.add_route('/record', handler)
+
+        async def go():
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            for request in (b'GET /record?a=1 HTTP/1.1\r\nCookie: c=1\r\n',
+                            b'GET /record HTTP/1.1\r\n'):
+                writer.write(request + b'\r\n')
+                assert (await reader.readuntil(b'ok')).startswith(
+                    b'HTTP/1.1 200')
+            writer.close()
+            for _ in range(100):
+                if self.server._parsers:
+                    break
+                await asyncio.sleep(0.01)
+
+        self.loop.run_until_complete(go())
+        (first, first_res, query, cookie, mark), second = handler.seen
+        assert query == {'a': ['1']} and cookie == '1' and mark is None
+        # the request and response were reset and used again
+        assert second == (first, first_res, {}, None, None)
+        # and the closed connection's parser is kept for the next one
+        assert len(self.server._parsers) == 1
+        response, body = self.request('GET', '/hello')
+        assert body == 'Hello World'
+
+
+class ProtocolServerIntegrationTest(ServerIntegrationTest):
+    engine = 'protocol'
+
 
 class FakeHandler:
     def __init__(self, n):
@@ -167,3 +632,51 @@ class ServerUnitTest(unittest.TestCase):
         handler, args = self.server.get_handler('/hello/')
         assert handler is None
         assert args is None
+
+    def test_unknown_engine(self):
+        self.server.engine = 'carrier-pigeon'
+        with self.assertRaises(ValueError):
+            self.server.start_server('127.0.0.1', 0)
+
+    def test_write_large_response(self):
+        class Transport(asyncio.WriteTransport):
+            def __init__(self):
+                super().__init__()
+                self.writes = []
+
+            def write(self, data):
+                self.writes.append(data)
+
+        class NativeTransport(Transport):
+            def writelines(self, data):
+                self.writes.append(list(data))
+
+        chunks = [b'x' * 2 ** 16, b'y' * 2 ** 16]
+        for transport in (Transport(), NativeTransport()):
+            res = Response()
+            for chunk in chunks:
+                res.write_bytes(chunk)
+            writer = TransportWriter(transport, None)
+            self.server._write_response(res, writer)
+            if isinstance(transport, NativeTransport):
+                [writes] = transport.writes
+            else:
+                # the body isn't joined into one copy
+                writes = transport.writes
+            assert writes[0].startswith(b'HTTP/1.1 200 OK\r\n')
+            assert writes[1:] == chunks
+            assert writes[1] is chunks[0]
+
+    def test_write_cookie(self):
+        class Writer:
+            def __init__(self):
+                self.writes = []
+
+            def write(self, data):
+                self.writes.append(data)
+
+        writer = Writer()
+        with self.assertWarns(DeprecationWarning):
+            write_cookie(writer, 'a', ('b', 10))
+            write_cookie(writer, 'c', ('d', 'unknown'))
+        assert writer.writes == [b'Set-Cookie: a=b;max-age=10\r\n']
@@ -0,0 +1,187 @@
+import unittest
+import asyncio
+from aiohttp import client
+from albatross import Server
+from albatross.compression import Compression
+from albatross.sse import Channel, EventStream, encode_event
+from tests.test_server import get_free_port
+
+
+class EventsHandler:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def on_get(self, req, res):
+        await EventStream(req, res, heartbeat=0.05).subscribe(self.channel)
+
+
+class CountHandler:
+    async def on_get(self, req, res):
+        stream = EventStream(req, res, retry=1000)
+        for i in range(3):
+            await stream.send(str(i), event='count')
+
+
+async def read_event(response):
+    lines = []
+    while True:
+        line = await response.content.readline()
+        if line == b'\n':
+            return b''.join(lines)
+        lines.append(line)
+
+
+class EncodeTest(unittest.TestCase):
+
+    def test_encode(self):
+        assert encode_event('hi') == b'data: hi\n\n'
+        assert encode_event('a\nb', event='x', id=3, retry=10) == (
+            b'id: 3\nevent: x\nretry: 10\ndata: a\ndata: b\n\n')
+        assert encode_event('') == b'data: \n\n'
+
+
+class ChannelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_fan_out(self):
+        channel = Channel()
+        first = channel.subscribe()
+        second = channel.subscribe()
+        channel.publish('hello')
+        a = self.loop.run_until_complete(first.get())
+        b = self.loop.run_until_complete(second.get())
+        assert a == b'id: 1\ndata: hello\n\n'
+        # the event was encoded once for both
+        assert a is b
+
+    def test_resume(self):
+        channel = Channel(history=3)
+        for i in range(5):
+            channel.publish(str(i))
+        subscription = channel.subscribe(last_event_id='3')
+        frame = self.loop.run_until_complete(subscription.get())
+        assert frame == b'id: 4\ndata: 3\n\n'
+        # ids no longer in the history replay nothing
+        subscription = channel.subscribe(last_event_id='1')
+        assert self.loop.run_until_complete(subscription.get(0.01)) is None
+
+    def test_slow_subscriber(self):
+        channel = Channel(max_queue=2)
+        slow = channel.subscribe()
+        for i in range(3):
+            channel.publish(str(i))
+        assert slow.dropped
+        assert slow not in channel.subscribers
+        assert self.loop.run_until_complete(slow.get()) is None
+
+
+class SSEIntegrationTest(unittest.TestCase):
+    engine = 'stream'
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.channel = Channel(max_queue=4)
+        self.server = Server(engine=self.engine, handler_timeout=0.1,
+                             compression=Compression(min_size=0))
+        self.server.add_route('/events', EventsHandler(self.channel))
+        self.server.add_route('/count', CountHandler())
+        self.port = get_free_port()
+        self.url = 'http://127.0.0.1:%d' % self.port
+        self.async_server = self.loop.run_until_complete(
+            self.server.start_server('127.0.0.1', self.port))
+
+    def tearDown(self):
+        # streams end once a heartbeat finds their client gone
+        self.wait(self.subscribed(0))
+        self.async_server.close()
+        self.loop.run_until_complete(self.async_server.wait_closed())
+        self.loop.close()
+
+    def wait(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 5))
+
+    async def subscribed(self, count):
+        while len(self.channel.subscribers) != count:
+            await asyncio.sleep(0.01)
+
+    def test_send(self):
+        async def go():
+            async with client.ClientSession() as session:
+                async with session.get(self.url + '/count') as response:
+                    assert response.headers['Content-Type'] == (
+                        'text/event-stream')
+                    assert 'Content-Encoding' not in response.headers
+                    return await response.read()
+        body = self.wait(go())
+        assert body == (b'retry: 1000\n\n' + b''.join(
+            b'event: count\ndata: %d\n\n' % i for i in range(3)))
+
+    def test_subscribe(self):
+        async def go():
+            async with client.ClientSession() as session:
+                responses = [await session.get(self.url + '/events')
+                             for _ in range(2)]
+                await self.subscribed(2)
+                # outlives the handler timeout, since it has started
+                await asyncio.sleep(0.15)
+                self.channel.publish('news', event='update')
+                for response in responses:
+                    # heartbeats are comments sent while nothing happens
+                    event = await read_event(response)
+                    while event == b':\n':
+                        event = await read_event(response)
+                    assert event == b'id: 1\nevent: update\ndata: news\n'
+                    response.close()
+        self.wait(go())
+
+    def test_last_event_id(self):
+        for i in range(3):
+            self.channel.publish(str(i))
+
+        async def go():
+            async with client.ClientSession() as session:
+                headers = {'Last-Event-ID': '1'}
+                async with session.get(self.url + '/events',
+                                       headers=headers) as response:
+                    assert await read_event(response) == b'id: 2\ndata: 1\n'
+                    assert await read_event(response) == b'id: 3\ndata: 2\n'
+        self.wait(go())
+
+    def test_dropped(self):
+        async def go():
+            async with client.ClientSession() as session:
+                async with session.get(self.url + '/events') as response:
+                    await self.subscribed(1)
+                    # published faster than the handler can send them
+                    for i in range(10):
+                        self.channel.publish(str(i))
+                    # the stream ends, so the client reconnects
+                    await response.read()
+                    assert not self.channel.subscribers
+        self.wait(go())
+
+
+    def test_shutdown(self):
+        self.server.shutdown_timeout = 5
+
+        async def go():
+            async with client.ClientSession() as session:
+                async with session.get(self.url + '/events') as response:
+                    await self.subscribed(1)
+                    shutdown = asyncio.ensure_future(
+                        self.server._shutdown_gracefully(self.async_server))
+                    # the stream ends rather than waiting out the timeout
+                    await asyncio.wait_for(response.read(), 1)
+                    await asyncio.wait_for(shutdown, 1)
+                    assert not self.server._event_streams
+        self.wait(go())
+
+class ProtocolSSEIntegrationTest(SSEIntegrationTest):
+    engine = 'protocol'
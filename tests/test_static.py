@@ -0,0 +1,171 @@
+import unittest
+import asyncio
+import os
+import shutil
+import gzip
+import tempfile
+from unittest import mock
+from albatross import Server, HTTPError
+from albatross import compression
+from albatross.data_types import CaselessDict
+from albatross.static import StaticFiles, parse_range, send_file
+from tests.test_server import get_free_port
+
+SMALL = b'<h1>hello</h1>\n'
+LARGE = bytes(range(256)) * 8192
+
+
+class ParseRangeTest(unittest.TestCase):
+
+    def test_ranges(self):
+        assert parse_range('bytes=0-99', 1000) == (0, 99)
+        assert parse_range('bytes=900-', 1000) == (900, 999)
+        assert parse_range('bytes=-100', 1000) == (900, 999)
+        assert parse_range('bytes=990-2000', 1000) == (990, 999)
+        assert parse_range('bytes=0-1,5-6', 1000) is None
+        assert parse_range('items=0-1', 1000) is None
+        assert parse_range('bytes=5-1', 1000) is None
+        with self.assertRaises(HTTPError):
+            parse_range('bytes=1000-', 1000)
+
+
+class BufferWriter:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data.extend(data)
+
+    async def drain(self):
+        pass
+
+
+class SendFileTest(unittest.TestCase):
+
+    def test_mmap_fallback(self):
+        writer = BufferWriter()
+        with tempfile.TemporaryFile() as f:
+            f.write(LARGE * 2)
+            f.flush()
+            asyncio.run(send_file(writer, f, 10, len(LARGE) + 5))
+        assert writer.data == (LARGE * 2)[10:len(LARGE) + 15]
+
+
+class StaticFilesTest(unittest.TestCase):
+    engine = 'stream'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.directory, 'css'))
+        with open(os.path.join(self.directory, 'index.html'), 'wb') as f:
+            f.write(SMALL)
+        with open(os.path.join(self.directory, 'css', 'big.bin'), 'wb') as f:
+            f.write(LARGE)
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.static = StaticFiles(self.directory, max_cache_bytes=100)
+        self.server = Server(engine=self.engine)
+        self.server.add_regex_route('/static/(?P<path>.*)', self.static)
+        self.port = get_free_port()
+        self.async_server = self.loop.run_until_complete(
+            self.server.start_server('127.0.0.1', self.port))
+
+    def tearDown(self):
+        self.async_server.close()
+        self.loop.close()
+        shutil.rmtree(self.directory)
+
+    def get(self, path, *headers):
+        async def go():
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            writer.write(b'GET %s HTTP/1.1\r\nConnection: close\r\n%s\r\n' % (
+                path, b''.join(h + b'\r\n' for h in headers)))
+            response = await reader.read()
+            writer.close()
+            return response
+        head, _, body = self.loop.run_until_complete(go()).partition(
+            b'\r\n\r\n')
+        lines = head.decode().split('\r\n')
+        headers = CaselessDict(line.split(': ', 1) for line in lines[1:])
+        return lines[0], headers, body
+
+    def test_small_file(self):
+        status, headers, body = self.get(b'/static/index.html')
+        assert status == 'HTTP/1.1 200 OK'
+        assert headers['Content-Type'] == 'text/html'
+        assert headers['Accept-Ranges'] == 'bytes'
+        assert body == SMALL
+        assert self.static.cache_size == len(SMALL)
+
+        etag = headers['ETag'].encode()
+        status, headers, body = self.get(
+            b'/static/index.html', b'If-None-Match: ' + etag)
+        assert status == 'HTTP/1.1 304 Not Modified'
+        assert body == b''
+        status, _, _ = self.get(
+            b'/static/index.html',
+            b'If-Modified-Since: ' + headers['Last-Modified'].encode())
+        assert status == 'HTTP/1.1 304 Not Modified'
+
+    def test_large_file(self):
+        status, headers, body = self.get(b'/static/css/big.bin')
+        assert status == 'HTTP/1.1 200 OK'
+        assert headers['Content-Length'] == str(len(LARGE))
+        assert body == LARGE
+        assert self.static.cache_size == 0
+
+    def test_range(self):
+        status, headers, body = self.get(
+            b'/static/css/big.bin', b'Range: bytes=1000-1999')
+        assert status == 'HTTP/1.1 206 Partial Content'
+        assert headers['Content-Range'] == 'bytes 1000-1999/%d' % len(LARGE)
+        assert body == LARGE[1000:2000]
+
+        status, headers, body = self.get(
+            b'/static/index.html', b'Range: bytes=-5')
+        assert status == 'HTTP/1.1 206 Partial Content'
+        assert body == SMALL[-5:]
+
+        status, headers, _ = self.get(
+            b'/static/index.html', b'Range: bytes=100-')
+        assert status == 'HTTP/1.1 416 Range Not Satisfiable'
+        assert headers['Content-Range'] == 'bytes */%d' % len(SMALL)
+
+        status, _, body = self.get(
+            b'/static/index.html', b'Range: bytes=0-1', b'If-Range: "old"')
+        assert status == 'HTTP/1.1 200 OK'
+        assert body == SMALL
+
+    def test_compressed_once(self):
+        self.server.compression = compression.Compression(
+            min_size=0, encodings=('gzip',))
+        path = os.path.join(self.directory, 'index.html')
+        with mock.patch.object(compression, 'compress',
+                               wraps=compression.compress) as compress:
+            for _ in range(3):
+                status, headers, body = self.get(
+                    b'/static/index.html', b'Accept-Encoding: gzip')
+                assert headers['Content-Encoding'] == 'gzip'
+                assert gzip.decompress(body) == SMALL
+            assert compress.call_count == 1
+
+            # a changed file is compressed anew
+            with open(path, 'wb') as f:
+                f.write(SMALL * 2)
+            status, headers, body = self.get(
+                b'/static/index.html', b'Accept-Encoding: gzip')
+            assert gzip.decompress(body) == SMALL * 2
+            assert compress.call_count == 2
+
+    def test_not_found(self):
+        for path in (b'/static/missing', b'/static/css',
+                     b'/static/../tests/test_static.py',
+                     b'/static/css/%2e%2e/%2e%2e/etc/passwd'):
+            status, _, _ = self.get(path)
+            assert status == 'HTTP/1.1 404 Not Found', path
+
+
+class ProtocolStaticFilesTest(StaticFilesTest):
+    engine = 'protocol'
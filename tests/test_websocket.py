@@ -0,0 +1,185 @@
+import unittest
+import asyncio
+import os
+import struct
+from aiohttp import client, WSMsgType
+from albatross import Server
+from albatross.websocket import (
+    CLOSE_GOING_AWAY, CLOSE_PROTOCOL_ERROR, CLOSE_TOO_BIG, OP_BINARY,
+    OP_TEXT, apply_mask, broadcast, encode_frame)
+from tests.test_server import get_free_port
+
+UPGRADE = (b'GET /echo HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\n'
+           b'Connection: Upgrade\r\nSec-WebSocket-Version: 13\r\n'
+           b'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n\r\n')
+
+
+def client_frame(opcode, payload, fin=True):
+    mask = os.urandom(4)
+    first = opcode | 0x80 if fin else opcode
+    return (bytes((first, 0x80 | len(payload))) + mask +
+            apply_mask(payload, mask))
+
+
+class EchoHandler:
+    async def on_websocket(self, req, ws):
+        async for message in ws:
+            await ws.send(message)
+
+
+class RoomHandler:
+    def __init__(self):
+        self.sockets = set()
+        self.joined = asyncio.Event()
+
+    async def on_get(self, req, res):
+        res.write('room')
+
+    async def on_websocket(self, req, ws):
+        self.sockets.add(ws)
+        self.joined.set()
+        try:
+            async for message in ws:
+                await broadcast(self.sockets, message)
+        finally:
+            self.sockets.discard(ws)
+
+
+class FrameTest(unittest.TestCase):
+
+    def test_mask(self):
+        mask = b'\x01\x02\x03\x04'
+        data = bytes(range(11))
+        masked = apply_mask(data, mask)
+        assert masked == bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+        assert apply_mask(masked, mask) == data
+        assert apply_mask(b'', mask) == b''
+
+    def test_encode_lengths(self):
+        assert encode_frame(OP_TEXT, b'hi') == b'\x81\x02hi'
+        frame = encode_frame(OP_BINARY, b'x' * 300)
+        assert frame[:4] == b'\x82\x7e' + struct.pack('!H', 300)
+        frame = encode_frame(OP_BINARY, b'x' * 70000, fin=False)
+        assert frame[:10] == b'\x02\x7f' + struct.pack('!Q', 70000)
+
+
+class WebSocketIntegrationTest(unittest.TestCase):
+    engine = 'stream'
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.room = RoomHandler()
+        self.server = Server(engine=self.engine, websocket_max_size=2 ** 16)
+        self.server.add_route('/echo', EchoHandler())
+        self.server.add_route('/room', self.room)
+        self.port = get_free_port()
+        self.url = 'http://127.0.0.1:%d' % self.port
+        self.async_server = self.loop.run_until_complete(
+            self.server.start_server('127.0.0.1', self.port))
+
+    def tearDown(self):
+        self.async_server.close()
+        self.loop.close()
+
+    def wait(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 5))
+
+    def test_echo(self):
+        async def go():
+            async with client.ClientSession() as session:
+                async with session.ws_connect(self.url + '/echo') as ws:
+                    await ws.send_str('hello')
+                    assert await ws.receive_str() == 'hello'
+                    await ws.send_bytes(b'\x00\xff' * 30000)
+                    assert await ws.receive_bytes() == b'\x00\xff' * 30000
+                    await ws.close()
+                    assert ws.close_code == 1000
+        self.wait(go())
+
+    def test_raw_frames(self):
+        async def go():
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            # the first frame arrives in the same packet as the upgrade
+            writer.write(UPGRADE + client_frame(OP_TEXT, b'fr', fin=False))
+            head = await reader.readuntil(b'\r\n\r\n')
+            assert head.startswith(b'HTTP/1.1 101')
+            assert b's3pPLMBiTxaQ9kYGzzhZRbK+xOo=' in head
+            writer.write(client_frame(0x9, b'beat'))
+            writer.write(client_frame(0x0, b'ag', fin=True))
+            assert await reader.readexactly(6) == b'\x8a\x04beat'
+            assert await reader.readexactly(6) == b'\x81\x04frag'
+            # unmasked frames are refused
+            writer.write(b'\x81\x02hi')
+            frame = await reader.read()
+            assert frame[0] == 0x88
+            assert struct.unpack('!H', frame[2:4])[0] == CLOSE_PROTOCOL_ERROR
+            writer.close()
+        self.wait(go())
+
+    def test_too_big(self):
+        async def go():
+            async with client.ClientSession() as session:
+                async with session.ws_connect(self.url + '/echo') as ws:
+                    await ws.send_bytes(b'x' * (2 ** 16 + 1))
+                    message = await ws.receive()
+                    assert message.type == WSMsgType.CLOSE
+                    assert message.data == CLOSE_TOO_BIG
+        self.wait(go())
+
+    def test_plain_request(self):
+        async def go():
+            async with client.ClientSession() as session:
+                async with session.get(self.url + '/echo') as response:
+                    assert response.status == 426
+                    assert response.headers['Upgrade'] == 'websocket'
+                async with session.get(self.url + '/room') as response:
+                    assert await response.text() == 'room'
+        self.wait(go())
+
+    def test_bad_version(self):
+        async def go():
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            writer.write(UPGRADE.replace(b'Version: 13', b'Version: 8'))
+            response = await reader.read()
+            writer.close()
+            return response
+        response = self.wait(go())
+        assert response.startswith(b'HTTP/1.1 426')
+        assert b'sec-websocket-version: 13' in response.lower()
+
+    def test_broadcast(self):
+        async def go():
+            async with client.ClientSession() as session:
+                sockets = []
+                for _ in range(3):
+                    sockets.append(
+                        await session.ws_connect(self.url + '/room'))
+                while len(self.room.sockets) < 3:
+                    await asyncio.sleep(0.01)
+                await sockets[0].send_str('to everyone')
+                for ws in sockets:
+                    assert await ws.receive_str() == 'to everyone'
+                for ws in sockets:
+                    await ws.close()
+        self.wait(go())
+
+    def test_shutdown(self):
+        async def go():
+            async with client.ClientSession() as session:
+                ws = await session.ws_connect(self.url + '/room')
+                await self.room.joined.wait()
+                shutdown = asyncio.ensure_future(
+                    self.server._shutdown_gracefully(self.async_server))
+                message = await ws.receive()
+                assert message.type == WSMsgType.CLOSE
+                assert message.data == CLOSE_GOING_AWAY
+                await ws.close()
+                await shutdown
+        self.wait(go())
+
+
+class ProtocolWebSocketIntegrationTest(WebSocketIntegrationTest):
+    engine = 'protocol'
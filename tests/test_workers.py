@@ -0,0 +1,170 @@
+import unittest
+import os
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+from tests.test_server import get_free_port
+
+APP = '''
+import asyncio
+import os
+from albatross import Server
+
+
+class Handler:
+    async def on_get(self, req, res):
+        res.write(str(os.getpid()))
+
+
+class SlowHandler:
+    async def on_get(self, req, res):
+        await asyncio.sleep(0.5)
+        res.write('slow')
+
+
+app = Server()
+app.add_route('/pid', Handler())
+app.add_route('/slow', SlowHandler())
+app.serve(port=%d, host='127.0.0.1', workers=%d)
+'''
+
+
+class ServeTestCase(unittest.TestCase):
+    workers = 2
+
+    def setUp(self):
+        self.port = get_free_port()
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', APP % (self.port, self.workers)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+    def tearDown(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def get_pid(self, timeout=5):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                url = 'http://127.0.0.1:%d/pid' % self.port
+                with urlopen(url, timeout=1) as response:
+                    return int(response.read())
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'workers need os.fork')
+class SupervisorTest(ServeTestCase):
+
+    def test_restart_and_shutdown(self):
+        pid = self.get_pid()
+        assert pid != self.process.pid
+        os.kill(pid, signal.SIGKILL)
+
+        # the replacement worker shows up alongside the surviving one
+        deadline = time.monotonic() + 5
+        pids = set()
+        while len(pids) < 2:
+            assert time.monotonic() < deadline, pids
+            pids.add(self.get_pid())
+        assert pid not in pids
+
+        self.process.send_signal(signal.SIGTERM)
+        assert self.process.wait(timeout=5) == 0
+
+    def test_reload(self):
+        old = set()
+        deadline = time.monotonic() + 5
+        while len(old) < 2:
+            assert time.monotonic() < deadline, old
+            old.add(self.get_pid())
+
+        self.process.send_signal(signal.SIGHUP)
+        # requests keep being answered while the workers are replaced,
+        # without a single one failing
+        deadline = time.monotonic() + 10
+        new = set()
+        while len(new) < 2:
+            assert time.monotonic() < deadline, new
+            pid = self.get_pid(timeout=0)
+            if pid not in old:
+                new.add(pid)
+
+        # the old workers drain and exit, and the supervisor reaps them
+        deadline = time.monotonic() + 5
+        for pid in old:
+            while _exists(pid):
+                assert time.monotonic() < deadline, pid
+                time.sleep(0.05)
+        assert self.process.poll() is None
+        self.process.send_signal(signal.SIGTERM)
+        assert self.process.wait(timeout=5) == 0
+
+    @unittest.skipUnless(os.path.isdir('/proc'), 'needs /proc')
+    def test_signals_during_reload(self):
+        self.get_pid()
+        # a second reload waits for the first instead of forking another
+        # set of workers alongside it
+        self.process.send_signal(signal.SIGHUP)
+        self.process.send_signal(signal.SIGHUP)
+        deadline = time.monotonic() + 10
+        while True:
+            time.sleep(0.5)
+            workers = _children(self.process.pid)
+            assert len(workers) <= 4, workers
+            if len(workers) == 2 or time.monotonic() > deadline:
+                break
+        assert len(workers) == 2, workers
+
+        # stopping in the middle of a reload takes every worker with it
+        self.process.send_signal(signal.SIGHUP)
+        self.process.send_signal(signal.SIGTERM)
+        assert self.process.wait(timeout=5) == 0
+        assert not _children(self.process.pid)
+
+
+class SingleProcessTest(ServeTestCase):
+    workers = 1
+
+    def test_hangup(self):
+        self.get_pid()
+        url = 'http://127.0.0.1:%d/slow' % self.port
+        with ThreadPoolExecutor(1) as pool:
+            slow = pool.submit(lambda: urlopen(url, timeout=5).read())
+            time.sleep(0.2)
+            # there is no supervisor to reload it, so it drains and exits
+            self.process.send_signal(signal.SIGHUP)
+            assert slow.result() == b'slow'
+        assert self.process.wait(timeout=5) == 0
+
+
+def _children(pid):
+    children = set()
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % name) as f:
+                stat = f.read()
+        except OSError:
+            continue
+        fields = stat.rsplit(')', 1)[-1].split()
+        # state, then parent pid; exited workers may linger as zombies
+        if int(fields[1]) == pid and fields[0] != 'Z':
+            children.add(int(name))
+    return children
+
+
+def _exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True